@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import threading
+import time
+from result_cache import content_hash
+
+# Journal states. A file is running until all its pages are accounted for;
+# a page is done (JSON written), empty (no text, nothing to parse) or failed
+FILE_STATES = ('running', 'done', 'failed')
+
+def file_fingerprint(path, *settings):
+    """
+    SHA-256 of a file's bytes plus the settings that change its outputs,
+    so a replaced input or a different run mode is processed again
+    """
+    with open(path, 'rb') as input_file:
+        return content_hash(input_file.read(), *settings)
+
+class BatchManifest:
+    """
+    SQLite journal of a batch run: state, input fingerprint and error of
+    every file, and state and output path of every page. Every update is
+    committed at once, so a run killed at any point can be resumed.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, state TEXT NOT NULL,"
+            " page_count INTEGER, error TEXT, updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " path TEXT NOT NULL, page TEXT NOT NULL, state TEXT NOT NULL,"
+            " output TEXT, error TEXT, updated REAL NOT NULL,"
+            " PRIMARY KEY (path, page))"
+        )
+        self._conn.commit()
+
+    def start_file(self, path, fingerprint, page_count, keep_pages=False):
+        """
+        Mark a file as running. Its journaled pages are forgotten unless
+        keep_pages is set and the input has the same fingerprint.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprint FROM files WHERE path = ?", (path,)).fetchone()
+            if row is not None and (not keep_pages or row[0] != fingerprint):
+                self._conn.execute("DELETE FROM pages WHERE path = ?", (path,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, fingerprint, state, page_count, error, updated)"
+                " VALUES (?, ?, 'running', ?, NULL, ?)",
+                (path, fingerprint, page_count, time.time())
+            )
+            self._conn.commit()
+
+    def record_page(self, path, page, state, output=None, error=None):
+        """Journal the outcome of one page"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (path, page, state, output, error, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, page, state, output, error, time.time())
+            )
+            self._conn.commit()
+
+    def finish_file(self, path, errors=()):
+        """
+        Close a file: done when every expected page was journaled without
+        error, failed otherwise (with the errors and the number of missing pages)
+        """
+        with self._lock:
+            page_count = self._conn.execute("SELECT page_count FROM files WHERE path = ?", (path,)).fetchone()[0]
+            journaled = self._conn.execute("SELECT COUNT(*) FROM pages WHERE path = ?", (path,)).fetchone()[0]
+            errors = list(errors)
+            if page_count is not None and journaled < page_count:
+                errors.append(f"{page_count - journaled} of {page_count} pages missing")
+            self._conn.execute(
+                "UPDATE files SET state = ?, error = ?, updated = ? WHERE path = ?",
+                ('failed' if errors else 'done', '; '.join(errors) or None, time.time(), path)
+            )
+            self._conn.commit()
+
+    def finished_pages(self, path, fingerprint):
+        """
+        Names of the pages of a file that need no more work: done with their
+        output still on disk, or empty. Nothing when the input changed.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprint FROM files WHERE path = ?", (path,)).fetchone()
+            if row is None or row[0] != fingerprint:
+                return set()
+            rows = self._conn.execute(
+                "SELECT page, state, output FROM pages WHERE path = ? AND state IN ('done', 'empty')", (path,)
+            ).fetchall()
+        return {page for page, state, output in rows if state == 'empty' or (output and os.path.exists(output))}
+
+    def is_done(self, path, fingerprint):
+        """True when a file finished with the same fingerprint and all its outputs are still on disk"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, state, page_count FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None or row[0] != fingerprint or row[1] != 'done':
+            return False
+        return row[2] is None or len(self.finished_pages(path, fingerprint)) >= row[2]
+
+    def failures(self):
+        """(path, error) of every failed file"""
+        with self._lock:
+            return self._conn.execute("SELECT path, error FROM files WHERE state = 'failed' ORDER BY path").fetchall()
+
+    def summary(self):
+        """Number of files in each state"""
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM files GROUP BY state").fetchall()
+        counts = {state: 0 for state in FILE_STATES}
+        counts.update(dict(rows))
+        return counts
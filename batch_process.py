@@ -7,9 +7,18 @@ Processes all images in the dataset directories
 import os
 import json
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from main import process_file
-from extract_pdf import is_pdf_file, is_image_file
+from main import extract_file_text, parse_text, parse_document, save_result, ensure_api_key, warm_up_page_ocr, DOCUMENT_MODE
+from batch_manifest import BatchManifest, file_fingerprint
+from preprocess import deskew_summary, DESKEW_STATS
+from result_cache import cache_stats, merge_stats, diff_stats, format_hit_ratio
+from template_parser import template_summary
+from extract_pdf import is_pdf_file, is_image_file, pdf_page_count
+import instrumentation
+
+# Journal of the files and pages processed, kept next to the outputs
+MANIFEST_NAME = 'manifest.sqlite'
 
 def get_all_files(base_dir):
     """Get all image and PDF files from the dataset directories"""
@@ -37,7 +46,217 @@ def get_all_files(base_dir):
     
     return files_list
 
-def process_batch(output_dir="output", max_files=None):
+def prepare_files(file_infos, output_path, manifest=None, resume=False):
+    """
+    Give each file its output directory and prompt and journal it in the
+    manifest. With resume, files already done are left out and the finished
+    pages of the others are skipped. Returns (files to process, files skipped).
+    """
+    pending = []
+    skipped = 0
+    for info in file_infos:
+        bank_output_dir = output_path / info['bank']
+        bank_output_dir.mkdir(parents=True, exist_ok=True)
+        info['output_dir'] = str(bank_output_dir)
+        info['prompt'] = f"Extract all relevant data from this {info['bank']} bank statement and return in structured JSON format."
+        if manifest is None:
+            pending.append(info)
+            continue
+
+        # Document mode writes one JSON per PDF instead of one per page
+        document = DOCUMENT_MODE and info['type'] == 'pdf'
+        fingerprint = file_fingerprint(info['path'], 'document' if document else 'pages')
+        if resume:
+            if manifest.is_done(info['path'], fingerprint):
+                skipped += 1
+                continue
+            if not document:
+                info['skip_pages'] = manifest.finished_pages(info['path'], fingerprint)
+                if info['skip_pages']:
+                    print(f"Resuming {info['filename']}: {len(info['skip_pages'])} pages already done")
+        try:
+            page_count = 1 if document or info['type'] == 'image' else pdf_page_count(info['path'])
+        except Exception:
+            page_count = None
+        manifest.start_file(info['path'], fingerprint, page_count, keep_pages=resume)
+        pending.append(info)
+    return pending, skipped
+
+def page_jobs(info, extracted):
+    """
+    Parsing jobs for an OCR'd file as (page_name, function, args): one per
+    page, or a single one for the whole PDF in document mode. function is
+    None for a page without text, which has nothing to parse.
+    """
+    if DOCUMENT_MODE and info['type'] == 'pdf' and extracted['pages']:
+        return [(info['filename'], parse_document_and_save,
+                 (extracted['pages'], info['filename'], info['output_dir'], info['prompt'], info.get('bank'),
+                  extracted['page_info']))]
+    jobs = []
+    for page_name, text in extracted['pages']:
+        if not text.strip():
+            print(f"OCR failed or no text extracted from {page_name}. Skipping...")
+            jobs.append((page_name, None, None))
+            continue
+        jobs.append((page_name, parse_and_save, (text, page_name, info['output_dir'], info['prompt'],
+                                                 info.get('bank'), extracted['page_info'].get(page_name))))
+    return jobs
+
+def record_page(result, manifest, info, page_name, output_path=None, error=None):
+    """Count the outcome of a parsing job in the file's result and journal it"""
+    if error is None:
+        result['outputs'].append(output_path)
+    else:
+        result['errors'].append(f"{page_name}: {error}")
+    if manifest is not None:
+        manifest.record_page(info['path'], page_name, 'failed' if error else 'done', output_path, error)
+
+def record_empty_page(manifest, info, page_name):
+    if manifest is not None:
+        manifest.record_page(info['path'], page_name, 'empty')
+
+def parse_and_save(text, page_name, output_dir, prompt, bank=None, page_info=None):
+    """Parsing stage for one page (template or LLM), run in the bounded thread pool"""
+    timings = {}
+    with instrumentation.page_scope(page_name):
+        data = parse_text(text, prompt, timings, bank=bank, page_info=page_info)
+    return save_result(page_name, output_dir, data), timings
+
+def parse_document_and_save(pages, file_name, output_dir, prompt, bank=None, page_infos=None):
+    """Document mode parsing stage: all pages of a PDF into one statement JSON"""
+    timings = {}
+    data = parse_document(pages, prompt, timings, bank=bank, page_infos=page_infos)
+    return save_result(file_name, output_dir, data), timings
+
+def run_parallel(file_infos, workers, llm_workers=4, manifest=None):
+    """
+    Process files in two stages: PDF rendering, deskew and OCR run in a
+    process pool of `workers` processes, and Gemini parsing runs in a
+    separate thread pool capped at `llm_workers` in-flight requests.
+    Results come back in input order whatever order the work finishes in.
+    Page outcomes are journaled in the manifest as they come in.
+    """
+    ensure_api_key()
+    results = [{'pages': 0, 'outputs': [], 'errors': []} for _ in file_infos]
+    timings = {}
+    deskew_stats = {key: 0 for key in DESKEW_STATS}
+    worker_cache_stats = {}
+    cache_before = cache_stats()
+    llm_jobs = []
+
+    # Each worker loads its OCR engine once, before its first page
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up_page_ocr) as ocr_pool, \
+            ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+        ocr_futures = {ocr_pool.submit(extract_file_text, info['path'], bank=info.get('bank'),
+                                       output_dir=info['output_dir'], skip_pages=info.get('skip_pages')): i
+                       for i, info in enumerate(file_infos)}
+
+        for future in as_completed(ocr_futures):
+            i = ocr_futures[future]
+            info = file_infos[i]
+            try:
+                extracted = future.result()
+            except Exception as e:
+                results[i]['errors'].append(str(e))
+                print(f"❌ OCR failed for {info['filename']}: {str(e)}")
+                continue
+
+            for stage, seconds in extracted['timings'].items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+            for key, value in extracted['deskew_stats'].items():
+                deskew_stats[key] += value
+            merge_stats(worker_cache_stats, extracted['cache_stats'])
+
+            print(f"🔍 OCR done: {info['filename']} ({len(extracted['pages'])} pages)")
+            results[i]['pages'] += len(extracted['pages'])
+            for page_index, (page_name, job, args) in enumerate(page_jobs(info, extracted)):
+                if job is None:
+                    record_empty_page(manifest, info, page_name)
+                    continue
+                llm_jobs.append((i, page_index, page_name, llm_pool.submit(job, *args)))
+
+        for i, page_index, page_name, future in sorted(llm_jobs, key=lambda job: job[:2]):
+            try:
+                output_path, llm_timings = future.result()
+                record_page(results[i], manifest, file_infos[i], page_name, output_path)
+                for stage, seconds in llm_timings.items():
+                    timings[stage] = timings.get(stage, 0.0) + seconds
+            except Exception as e:
+                record_page(results[i], manifest, file_infos[i], page_name, error=str(e))
+                print(f"❌ Gemini failed for {page_name}: {str(e)}")
+
+    if manifest is not None:
+        for info, result in zip(file_infos, results):
+            manifest.finish_file(info['path'], result['errors'])
+
+    # OCR lookups happened in the workers, LLM lookups in this process
+    run_cache_stats = merge_stats(worker_cache_stats, diff_stats(cache_stats(), cache_before))
+    return results, timings, deskew_stats, run_cache_stats
+
+def run_sequential(file_infos, manifest=None):
+    """
+    Process files one at a time in this process: OCR a file, then parse its
+    pages, journaling every page outcome like run_parallel
+    """
+    ensure_api_key()
+    results = [{'pages': 0, 'outputs': [], 'errors': []} for _ in file_infos]
+
+    for n, (info, result) in enumerate(zip(file_infos, results), 1):
+        print(f"\n[{n}/{len(file_infos)}] Processing: {info['filename']}")
+        print(f"Bank: {info['bank']} | Type: {info['type'].upper()}")
+        try:
+            extracted = extract_file_text(info['path'], bank=info.get('bank'), output_dir=info['output_dir'],
+                                          skip_pages=info.get('skip_pages'))
+            result['pages'] += len(extracted['pages'])
+            for page_name, job, args in page_jobs(info, extracted):
+                if job is None:
+                    record_empty_page(manifest, info, page_name)
+                    continue
+                try:
+                    output_path, _ = job(*args)
+                    record_page(result, manifest, info, page_name, output_path)
+                except Exception as e:
+                    print(f"Error with Gemini API: {e}")
+                    record_page(result, manifest, info, page_name, error=str(e))
+        except Exception as e:
+            result['errors'].append(str(e))
+            print(f"❌ Failed to process {info['filename']}: {str(e)}")
+        if manifest is not None:
+            manifest.finish_file(info['path'], result['errors'])
+
+    return results
+
+def print_manifest_summary(manifest):
+    """File states recorded in the manifest, with the errors of failed files"""
+    counts = manifest.summary()
+    print(f"Manifest: {counts['done']} done, {counts['failed']} failed, {counts['running']} unfinished "
+          f"({manifest.path})")
+    for path, error in manifest.failures():
+        print(f"  - {Path(path).name}: {error}")
+
+def print_parallel_stats(results, timings, total_time):
+    """Throughput and per-stage time for a parallel run"""
+    pages = sum(r['pages'] for r in results)
+    print(f"Pages processed: {pages}")
+    print(f"Throughput: {(pages/total_time if total_time else 0):.2f} pages/s")
+    print("Time per stage (summed over workers):")
+    for stage in ('text_layer', 'render', 'classify', 'deskew', 'roi', 'rescale', 'ocr', 'template', 'llm'):
+        if stage in timings:
+            print(f"  - {stage}: {timings[stage]:.1f} seconds")
+
+def print_metrics():
+    """Export the instrumentation records of this run (all worker processes) and print the per-stage totals"""
+    if not instrumentation.enabled():
+        return
+    path, totals = instrumentation.write_prometheus()
+    if path is None:
+        return
+    print(f"Instrumentation (run {instrumentation.run_id()}):")
+    for line in instrumentation.format_totals(totals):
+        print(f"  - {line}")
+    print(f"Metrics: {instrumentation.jsonl_path()} (per page), {path} (Prometheus)")
+
+def process_batch(output_dir="output", max_files=None, workers=1, llm_workers=4, resume=False, manifest_path=None):
     """Process all bank statement images in batch"""
     base_dir = Path(__file__).parent
     output_path = base_dir / output_dir
@@ -62,40 +281,37 @@ def process_batch(output_dir="output", max_files=None):
     print(f"  - PDFs: {len(pdfs)}")
     print("=" * 60)
     
+    manifest = BatchManifest(manifest_path or str(output_path / MANIFEST_NAME))
+    all_files, skipped = prepare_files(all_files, output_path, manifest, resume)
+    if resume:
+        print(f"Resuming: {skipped} files already done, {len(all_files)} left to process")
+    if not all_files:
+        print_manifest_summary(manifest)
+        return
+    
     # Process each file
     successful = 0
     failed = 0
+    if instrumentation.enabled():
+        instrumentation.start_run()
     start_time = time.time()
     
-    for i, file_info in enumerate(all_files, 1):
-        print(f"\n[{i}/{len(all_files)}] Processing: {file_info['filename']}")
-        print(f"Bank: {file_info['bank']} | Type: {file_info['type'].upper()}")
-        
-        try:
-            # Create bank-specific output directory
-            bank_output_dir = output_path / file_info['bank']
-            bank_output_dir.mkdir(exist_ok=True)
-            
-            # Process the file
-            prompt = f"Extract all relevant data from this {file_info['bank']} bank statement and return in structured JSON format."
-            
-            result = process_file(
-                file_path=file_info['path'],
-                output_dir=str(bank_output_dir),
-                prompt=prompt
-            )
-            
-            if result:
-                successful += 1
-                print(f"✅ Successfully processed: {file_info['filename']}")
-            else:
-                failed += 1
-                print(f"❌ Failed to process: {file_info['filename']}")
-            
-        except Exception as e:
+    if workers > 1:
+        print(f"Running with {workers} OCR workers and {llm_workers} concurrent Gemini requests")
+        results, timings, deskew_stats, run_cache_stats = run_parallel(all_files, workers, llm_workers, manifest)
+    else:
+        deskew_stats = DESKEW_STATS
+        cache_before = cache_stats()
+        results = run_sequential(all_files, manifest)
+        run_cache_stats = diff_stats(cache_stats(), cache_before)
+    
+    for file_info, result in zip(all_files, results):
+        if result['outputs']:
+            successful += 1
+            print(f"✅ Successfully processed: {file_info['filename']}")
+        else:
             failed += 1
-            print(f"❌ Failed to process {file_info['filename']}: {str(e)}")
-            continue
+            print(f"❌ Failed to process: {file_info['filename']}")
     
     # Summary
     end_time = time.time()
@@ -105,20 +321,35 @@ def process_batch(output_dir="output", max_files=None):
     print("BATCH PROCESSING SUMMARY")
     print("=" * 60)
     print(f"Total files processed: {len(all_files)}")
-    print(f"  - Images: {len(images)}")
-    print(f"  - PDFs: {len(pdfs)}")
+    print(f"  - Images: {sum(1 for f in all_files if f['type'] == 'image')}")
+    print(f"  - PDFs: {sum(1 for f in all_files if f['type'] == 'pdf')}")
+    if skipped:
+        print(f"Skipped (already done): {skipped}")
     print(f"Successful: {successful}")
     print(f"Failed: {failed}")
     print(f"Success rate: {(successful/len(all_files)*100):.1f}%")
     print(f"Total time: {total_time:.1f} seconds")
     print(f"Average time per file: {(total_time/len(all_files)):.1f} seconds")
+    if workers > 1:
+        print_parallel_stats(results, timings, total_time)
+    deskew = deskew_summary(deskew_stats)
+    if deskew['pages']:
+        print(f"Deskew skipped: {deskew['skipped']}/{deskew['pages']} pages ({deskew['skip_rate']*100:.1f}%), "
+              f"~{deskew['time_saved']:.1f} seconds saved")
+    print(template_summary())
+    hit_ratio = format_hit_ratio(run_cache_stats)
+    if hit_ratio:
+        print("Cache hit ratio:")
+        for line in hit_ratio:
+            print(f"  - {line}")
+    print_metrics()
+    print_manifest_summary(manifest)
     print(f"Output directory: {output_path}")
 
-def process_single_bank(bank_name, output_dir="output"):
+def process_single_bank(bank_name, output_dir="output", workers=1, llm_workers=4, resume=False, manifest_path=None):
     """Process all images from a specific bank"""
     base_dir = Path(__file__).parent
-    output_path = base_dir / output_dir / bank_name
-    output_path.mkdir(parents=True, exist_ok=True)
+    output_path = base_dir / output_dir
     
     data_dir = base_dir / 'gmindia-challlenge-012024-datas' / bank_name
     
@@ -142,26 +373,45 @@ def process_single_bank(bank_name, output_dir="output"):
     print(f"  - PDFs: {len(pdfs)}")
     print("=" * 50)
     
-    for i, file_path in enumerate(all_files, 1):
-        file_type = 'PDF' if is_pdf_file(str(file_path)) else 'Image'
-        print(f"\n[{i}/{len(all_files)}] Processing: {file_path.name} ({file_type})")
-        
-        try:
-            prompt = f"Extract all relevant data from this {bank_name} bank statement and return in structured JSON format."
-            
-            result = process_file(
-                file_path=str(file_path),
-                output_dir=str(output_path),
-                prompt=prompt
-            )
-            
-            if result:
-                print(f"✅ Successfully processed: {file_path.name}")
-            else:
-                print(f"❌ Failed to process: {file_path.name}")
-            
-        except Exception as e:
-            print(f"❌ Failed to process {file_path.name}: {str(e)}")
+    file_infos = [{
+        'path': str(f),
+        'bank': bank_name,
+        'filename': f.name,
+        'type': 'pdf' if is_pdf_file(str(f)) else 'image',
+    } for f in all_files]
+    
+    output_path.mkdir(parents=True, exist_ok=True)
+    manifest = BatchManifest(manifest_path or str(output_path / MANIFEST_NAME))
+    file_infos, skipped = prepare_files(file_infos, output_path, manifest, resume)
+    if resume:
+        print(f"Resuming: {skipped} files already done, {len(file_infos)} left to process")
+    if not file_infos:
+        print_manifest_summary(manifest)
+        return
+    
+    if instrumentation.enabled():
+        instrumentation.start_run()
+    start_time = time.time()
+    if workers > 1:
+        results, timings, _, run_cache_stats = run_parallel(file_infos, workers, llm_workers, manifest)
+    else:
+        results = run_sequential(file_infos, manifest)
+    total_time = time.time() - start_time
+    
+    for file_info, result in zip(file_infos, results):
+        if result['outputs']:
+            print(f"✅ Successfully processed: {file_info['filename']}")
+        else:
+            print(f"❌ Failed to process: {file_info['filename']}")
+    
+    if workers > 1:
+        print("=" * 50)
+        print_parallel_stats(results, timings, total_time)
+        print(template_summary())
+        for line in format_hit_ratio(run_cache_stats):
+            print(f"Cache hit ratio - {line}")
+    print_metrics()
+    print_manifest_summary(manifest)
 
 def list_available_banks():
     """List all available banks in the dataset"""
@@ -183,8 +433,17 @@ if __name__ == "__main__":
     parser.add_argument("--max-files", type=int, help="Maximum number of files to process")
     parser.add_argument("--output", default="output", help="Output directory")
     parser.add_argument("--list-banks", action="store_true", help="List available banks")
+    parser.add_argument("--workers", type=int, default=1, help="Number of OCR worker processes")
+    parser.add_argument("--llm-workers", type=int, default=4, help="Maximum concurrent Gemini requests with --workers")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip files already done and retry only failed or missing pages")
+    parser.add_argument("--manifest", help=f"Job manifest path (default: <output>/{MANIFEST_NAME})")
+    parser.add_argument("--metrics", nargs='?', const=instrumentation.METRICS_DIR, metavar="DIR",
+                        help="Record per-page stage metrics (JSON lines + Prometheus file) in DIR")
     
     args = parser.parse_args()
+    if args.metrics:
+        instrumentation.enable(args.metrics)
     
     if args.list_banks:
         banks = list_available_banks()
@@ -192,6 +451,6 @@ if __name__ == "__main__":
         for bank in banks:
             print(f"  - {bank}")
     elif args.bank:
-        process_single_bank(args.bank, args.output)
+        process_single_bank(args.bank, args.output, args.workers, args.llm_workers, args.resume, args.manifest)
     else:
-        process_batch(args.output, args.max_files)
\ No newline at end of file
+        process_batch(args.output, args.max_files, args.workers, args.llm_workers, args.resume, args.manifest)
\ No newline at end of file
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Benchmark for OCR layout reconstruction
+Times extract_ocr.extract_text against the original pure-Python line
+clustering and collation on synthetic dense pages. The reference
+implementation below is also the golden output of tests/test_layout.py.
+With --layouts, compares the size of the space-padded and table layouts on
+synthetic statement pages and checks every amount lands in its column.
+"""
+
+import itertools
+import random
+import time
+from operator import itemgetter
+import extract_ocr
+from extract_ocr import extract_text, layout_text, LAYOUT_SEPARATORS
+
+# Reference implementation: line clustering and collation as they were before
+# the NumPy rewrite, kept verbatim as the golden output.
+
+def legacy_cluster_list(xs, tolerance=0):
+    if tolerance == 0 or len(xs) < 2:
+        return [[x] for x in sorted(xs)]
+    
+    groups = []
+    xs = list(sorted(xs))
+    current_group = [xs[0]]
+    last = xs[0]
+
+    for x in xs[1:]:
+        if x <= (last + tolerance):
+            current_group.append(x)
+        else:
+            groups.append(current_group)
+            current_group = [x]
+        last = x
+    groups.append(current_group)
+
+    return groups
+
+def legacy_make_cluster_dict(values, tolerance):
+    clusters = legacy_cluster_list(list(set(values)), tolerance)
+
+    nested_tuples = [
+        [(val, i) for val in value_cluster] for i, value_cluster in enumerate(clusters)
+    ]
+
+    return dict(itertools.chain(*nested_tuples))
+
+def legacy_cluster_objects(xs, tolerance):
+    key_fn = lambda x: (x['coordinates'][1] + x['coordinates'][3]) / 2
+    values = map(key_fn, xs)
+    cluster_dict = legacy_make_cluster_dict(values, tolerance)
+    get_0, get_1 = itemgetter(0), itemgetter(1)
+    cluster_tuples = sorted(((x, cluster_dict.get(key_fn(x))) for x in xs), key=get_1)
+    grouped = itertools.groupby(cluster_tuples, key=get_1)
+
+    return [list(map(get_0, v)) for k, v in grouped]
+
+def legacy_get_avg_char_width(data):
+    height = 1000
+    sum_widths = 0.0
+    cnt = 0
+    for datum in data:
+        height = min(height, abs(datum['coordinates'][3] - datum['coordinates'][1]))
+        sum_widths += datum['coordinates'][2] - datum['coordinates'][0]
+        cnt += len(datum['value'])
+    return height / 2, sum_widths // cnt
+
+def legacy_collate_line(line_chars, tolerance, add_spaces) -> str:
+    coll = ""
+    last_x1 = 0
+
+    for char in sorted(line_chars, key=lambda x: x['coordinates'][0]):
+        coll += ' '
+        last_x1 += tolerance
+        while last_x1 + tolerance < char['coordinates'][0] and add_spaces: 
+            coll += " "
+            last_x1 += tolerance
+        coll += char['value']
+        last_x1 = char['coordinates'][2]
+
+    return coll[1:] if add_spaces else coll.strip()
+
+def legacy_extract_text(data, add_spaces):
+    min_height, x_tolerance = legacy_get_avg_char_width(data)
+    
+    doctop_clusters = legacy_cluster_objects(data, tolerance=min_height)
+
+    lines = (
+        legacy_collate_line(line_chars, x_tolerance, add_spaces) for line_chars in doctop_clusters
+    )
+
+    return "\n".join(lines)
+
+def synthetic_page(rows, words_per_row, seed=0):
+    """Word boxes laid out like a dense statement page, with baseline jitter and ragged gaps"""
+    rng = random.Random(seed)
+    data = []
+    for row in range(rows):
+        top = 40 + row * 36 + rng.randint(-3, 3)
+        x = rng.randint(20, 80)
+        for _ in range(words_per_row):
+            value = ''.join(rng.choice('0123456789abcdefghijKLMNOP,.-') for _ in range(rng.randint(1, 12)))
+            width = len(value) * rng.randint(14, 20)
+            height = rng.randint(18, 28)
+            jitter = rng.randint(-2, 2)
+            data.append({'value': value, 'coordinates': [x, top + jitter, x + width, top + jitter + height]})
+            x += width + rng.choice([8, 12, 20, 60, 150])
+    # OCR engines do not return words in strict reading order
+    rng.shuffle(data)
+    return data
+
+CHAR_WIDTH = 18
+COLUMNS = {'date': 60, 'description': 260, 'debit': 1500, 'credit': 1800, 'balance': 2150}
+
+def place(data, rng, text, top, x, right_aligned=False):
+    """Add the words of text on one baseline starting (or ending) at x"""
+    words = text.split()
+    width = sum(len(w) for w in words) * CHAR_WIDTH + (len(words) - 1) * 12
+    x = x - width if right_aligned else x
+    for word in words:
+        jitter = rng.randint(-2, 2)
+        data.append({'value': word, 'coordinates': [x, top + jitter, x + len(word) * CHAR_WIDTH, top + jitter + 26]})
+        x += len(word) * CHAR_WIDTH + 12
+
+def synthetic_statement(transactions, seed=0):
+    """
+    Word boxes of a statement page: an address block, a header row, then
+    transactions with right-aligned debit/credit/balance amounts and some
+    wrapped descriptions. Returns the words and the expected table rows.
+    """
+    rng = random.Random(seed)
+    data = []
+    place(data, rng, "BANQUE EXEMPLE Agence Centre", 40, 60)
+    place(data, rng, "M. CLIENT 12 RUE DES LILAS 75000 PARIS", 80, 60)
+    place(data, rng, "Relevé de compte du 01/01/2021 au 31/01/2021", 120, 60)
+
+    top = 200
+    header = ['Date', 'Libellé', 'Débit', 'Crédit', 'Solde']
+    place(data, rng, 'Date', top, COLUMNS['date'])
+    place(data, rng, 'Libellé', top, COLUMNS['description'])
+    for name, column in zip(header[2:], ('debit', 'credit', 'balance')):
+        place(data, rng, name, top, COLUMNS[column], right_aligned=True)
+    expected = [header]
+
+    balance = 1000.0
+    labels = ['PRLV SEPA', 'CB MONOPRIX', 'VIR SALAIRE', 'RETRAIT DAB', 'COTIS CARTE', 'FRAIS TENUE COMPTE']
+    for i in range(transactions):
+        top += 40
+        date = f"{i % 28 + 1:02d}/01"
+        label = f"{rng.choice(labels)} {rng.randint(1000, 99999)}"
+        amount = f"{rng.randint(1, 2500)},{rng.randint(0, 99):02d}"
+        column = rng.choice(['debit', 'credit'])
+        balance += rng.uniform(-500, 500)
+        balance_text = f"{balance:.2f}".replace('.', ',')
+
+        place(data, rng, date, top, COLUMNS['date'])
+        place(data, rng, label, top, COLUMNS['description'])
+        place(data, rng, amount, top, COLUMNS[column], right_aligned=True)
+        place(data, rng, balance_text, top, COLUMNS['balance'], right_aligned=True)
+        expected.append([date, label, amount if column == 'debit' else '',
+                         amount if column == 'credit' else '', balance_text])
+        if rng.random() < 0.2:
+            top += 40
+            place(data, rng, "REF 2021 WRAPPED", top, COLUMNS['description'])
+            expected.append(['', 'REF 2021 WRAPPED', '', '', ''])
+    rng.shuffle(data)
+    return data, expected
+
+def count_tokens(text):
+    """Exact token count when the tokenizer is available, otherwise None"""
+    try:
+        from tokenizer import num_tokens
+        return num_tokens(text)
+    except Exception:
+        return None
+
+def compare_layouts(pages=5, transactions=40):
+    """Check the table layout against the expected cells and compare output sizes"""
+    print(f"{'Layout':<8} {'chars':>9} {'tokens':>9} {'ms/page':>9}")
+    print("-" * 38)
+    sizes = {}
+    for layout in ['spaces'] + sorted(LAYOUT_SEPARATORS):
+        chars = 0
+        tokens = 0
+        elapsed = 0.0
+        for page in range(pages):
+            data, expected = synthetic_statement(transactions, seed=page)
+            start = time.perf_counter()
+            text = layout_text(data, True, layout=layout)
+            elapsed += time.perf_counter() - start
+
+            if layout != 'spaces':
+                rows = [line.split(LAYOUT_SEPARATORS[layout]) for line in text.split("\n")]
+                table = rows[3:]
+                if table != expected:
+                    raise AssertionError(f"Table cells differ from the expected rows on page {page} ({layout})")
+            chars += len(text)
+            page_tokens = count_tokens(text)
+            tokens = None if page_tokens is None or tokens is None else tokens + page_tokens
+        sizes[layout] = chars
+        shown_tokens = '-' if tokens is None else str(tokens // pages)
+        print(f"{layout:<8} {chars // pages:>9} {shown_tokens:>9} {elapsed / pages * 1000:>9.1f}")
+
+    print("=" * 38)
+    print("Every amount is in its debit/credit/balance column ✅")
+    for layout in sorted(LAYOUT_SEPARATORS):
+        print(f"{layout}: {sizes[layout] / sizes['spaces'] * 100:.0f}% of the space-padded size")
+
+def time_call(function, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run_benchmark(pages=5, rows=60, words_per_row=40):
+    """Print per-page timings for both implementations"""
+    # Token limiting is the same for both sides, keep it out of the timings
+    extract_ocr.limit_tokens = lambda text, max_tokens: text
+
+    print(f"{'Page':<6} {'words':>7} {'spaces':>7} {'legacy':>9} {'numpy':>9} {'speedup':>8}")
+    print("-" * 52)
+
+    total_legacy = 0.0
+    total_numpy = 0.0
+    for page in range(pages):
+        data = synthetic_page(rows, words_per_row, seed=page)
+        for add_spaces in (True, False):
+            t_legacy = time_call(legacy_extract_text, data, add_spaces)
+            t_numpy = time_call(extract_text, data, add_spaces)
+            total_legacy += t_legacy
+            total_numpy += t_numpy
+            print(f"{page:<6} {len(data):>7} {str(add_spaces):>7} {t_legacy*1000:>7.1f}ms {t_numpy*1000:>7.1f}ms {t_legacy/t_numpy:>7.1f}x")
+
+    print("=" * 52)
+    print(f"Legacy: {total_legacy / (pages * 2) * 1000:.1f} ms/page")
+    print(f"NumPy: {total_numpy / (pages * 2) * 1000:.1f} ms/page")
+    print(f"Speedup: {total_legacy / total_numpy:.1f}x")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark OCR layout reconstruction")
+    parser.add_argument("--pages", type=int, default=5, help="Number of synthetic pages")
+    parser.add_argument("--rows", type=int, default=60, help="Text rows per page")
+    parser.add_argument("--words-per-row", type=int, default=40, help="Words per row")
+    parser.add_argument("--layouts", action="store_true",
+                        help="Compare space-padded and table layouts on synthetic statements instead")
+
+    args = parser.parse_args()
+    if args.layouts:
+        compare_layouts(args.pages)
+    else:
+        run_benchmark(args.pages, args.rows, args.words_per_row)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Benchmark for region-of-interest OCR
+Detects the text regions of every sample page and reports the share of
+pixels Tesseract still has to read. When Tesseract is installed, also
+times full-page OCR against region OCR and compares the words found.
+With --backends, compares OCR engines instead: the fixed cost of a call
+(process startup and model loading for pytesseract) and time per page.
+"""
+
+import shutil
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+import pytesseract
+from preprocess import correct_skew, text_regions
+from extract_ocr import build_mosaic, ocr_words, ocr_words_in_regions, OCR_BACKENDS
+from benchmark_skew import get_dataset_images
+
+def has_tesseract():
+    """True when a Tesseract binary can be called"""
+    return shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
+def available_backends():
+    """OCR backends that can run here, by name"""
+    backends = {}
+    for name, backend_class in OCR_BACKENDS.items():
+        if name == 'pytesseract' and not has_tesseract():
+            continue
+        try:
+            backends[name] = backend_class()
+        except ImportError:
+            continue
+    return backends
+
+def time_calls(backend, image, repeat):
+    """Seconds per image_to_data call, averaged over repeat calls"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        backend.image_to_data(image)
+    return (time.perf_counter() - start) / repeat
+
+def run_backend_benchmark(max_files=None, repeat=5):
+    """Per-call overhead and per-page time of every available OCR backend"""
+    backends = available_backends()
+    if not backends:
+        print("No OCR backend available (install tesseract or tesserocr)")
+        return
+
+    images = get_dataset_images(Path(__file__).parent)
+    if max_files:
+        images = images[:max_files]
+    pages = [image for image in (cv2.imread(str(path)) for path in images) if image is not None]
+    # A tiny blank image costs next to nothing to recognize: its time is the fixed cost of a call
+    blank = np.full((32, 32), 255, dtype=np.uint8)
+
+    print(f"{'Backend':<12} {'first call':>10} {'per call':>10} {'per page':>10}")
+    print("-" * 46)
+    report = {}
+    for name, backend in backends.items():
+        start = time.perf_counter()
+        backend.image_to_data(blank)
+        first_call = time.perf_counter() - start
+        per_call = time_calls(backend, blank, repeat)
+        start = time.perf_counter()
+        for page in pages:
+            backend.image_to_data(page)
+        per_page = (time.perf_counter() - start) / len(pages) if pages else 0.0
+        report[name] = per_page
+        print(f"{name:<12} {first_call * 1000:>8.1f}ms {per_call * 1000:>8.1f}ms {per_page:>9.2f}s")
+
+    print("=" * 46)
+    print(f"Pages: {len(pages)}")
+    if len(report) == 2 and report['tesserocr']:
+        saved = report['pytesseract'] - report['tesserocr']
+        print(f"Saved per page with tesserocr: {saved:.2f}s ({report['pytesseract'] / report['tesserocr']:.2f}x)")
+
+def word_recall(reference, candidate):
+    """Share of the reference words (as a multiset) also found in candidate"""
+    remaining = {}
+    for datum in candidate:
+        remaining[datum['value']] = remaining.get(datum['value'], 0) + 1
+    found = 0
+    for datum in reference:
+        if remaining.get(datum['value'], 0):
+            remaining[datum['value']] -= 1
+            found += 1
+    return found / len(reference) if reference else 1.0
+
+def run_benchmark(max_files=None, mode='mosaic'):
+    """Detect regions on every sample image, OCR them if possible, and print a report"""
+    base_dir = Path(__file__).parent
+    images = get_dataset_images(base_dir)
+    if max_files:
+        images = images[:max_files]
+
+    if not images:
+        print("No images found in the dataset!")
+        return
+
+    run_ocr = has_tesseract()
+    if not run_ocr:
+        print("Tesseract not found, reporting region detection only")
+
+    print(f"{'File':<50} {'regions':>7} {'pixels':>7} {'t_roi':>7} {'t_full':>7} {'t_' + mode[:5]:>7} {'recall':>7}")
+    print("-" * 92)
+
+    totals = {'roi': 0.0, 'full': 0.0, 'regions': 0.0, 'fraction': 0.0}
+    recalls = []
+    pages = 0
+
+    for image_path in images:
+        image = cv2.imread(str(image_path))
+        if image is None:
+            print(f"Could not read {image_path}")
+            continue
+
+        _, corrected, mask = correct_skew(image, method='coarse_to_fine', skip_tolerance=0.5, return_mask=True)
+        start = time.perf_counter()
+        regions = text_regions(mask)
+        t_roi = time.perf_counter() - start
+
+        mosaic, _ = build_mosaic(corrected, regions)
+        fraction = mosaic.shape[0] * mosaic.shape[1] / (corrected.shape[0] * corrected.shape[1])
+        pages += 1
+        totals['roi'] += t_roi
+        totals['fraction'] += fraction
+
+        name = f"{image_path.parent.name}/{image_path.name}"[:50]
+        line = f"{name:<50} {len(regions):>7} {fraction:>7.2f} {t_roi:>6.3f}s"
+        if run_ocr:
+            start = time.perf_counter()
+            full_words = ocr_words(corrected)
+            t_full = time.perf_counter() - start
+            start = time.perf_counter()
+            region_words = ocr_words_in_regions(corrected, regions, mode=mode)
+            t_regions = time.perf_counter() - start
+            totals['full'] += t_full
+            totals['regions'] += t_regions
+            recalls.append(word_recall(full_words, region_words))
+            line += f" {t_full:>6.2f}s {t_regions:>6.2f}s {recalls[-1]:>7.3f}"
+        print(line)
+
+    print("=" * 92)
+    print(f"Pages: {pages}")
+    print(f"Region detection: {totals['roi'] / pages * 1000:.1f} ms/page")
+    print(f"Pixels sent to Tesseract ({mode}): {totals['fraction'] / pages * 100:.1f}% of the page")
+    if run_ocr:
+        print(f"Full page OCR: {totals['full'] / pages:.2f} s/page")
+        print(f"Region OCR ({mode}): {totals['regions'] / pages:.2f} s/page")
+        print(f"Speedup: {totals['full'] / totals['regions']:.2f}x")
+        print(f"Word recall vs full page: mean {sum(recalls) / pages:.3f}, min {min(recalls):.3f}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark region-of-interest OCR")
+    parser.add_argument("--max-files", type=int, help="Maximum number of images to benchmark")
+    parser.add_argument("--mode", default="mosaic", choices=["mosaic", "crops"],
+                        help="How the regions are handed to Tesseract")
+    parser.add_argument("--backends", action="store_true", help="Compare OCR backends instead of ROI modes")
+    parser.add_argument("--repeat", type=int, default=5, help="Calls used to measure the fixed cost per call")
+    args = parser.parse_args()
+    if args.backends:
+        run_backend_benchmark(args.max_files, args.repeat)
+    else:
+        run_benchmark(args.max_files, args.mode)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark for skew correction
+Compares the brute-force projection sweep with another skew estimator
+(coarse-to-fine by default) over the sample dataset, reporting time per
+page and angle difference.
+"""
+
+import os
+import time
+from pathlib import Path
+import cv2
+from preprocess import correct_skew, SKEW_ESTIMATORS
+from extract_pdf import is_image_file
+
+def get_dataset_images(base_dir):
+    """Get all sample images from the dataset directories"""
+    data_dir = Path(base_dir) / 'gmindia-challlenge-012024-datas'
+    images = []
+    for root, dirs, files in os.walk(data_dir):
+        for file in sorted(files):
+            if is_image_file(file):
+                images.append(Path(root) / file)
+    return sorted(images)
+
+def run_benchmark(max_files=None, method='coarse_to_fine'):
+    """Run both skew engines on every sample image and print a report"""
+    base_dir = Path(__file__).parent
+    images = get_dataset_images(base_dir)
+    if max_files:
+        images = images[:max_files]
+
+    if not images:
+        print("No images found in the dataset!")
+        return
+
+    print(f"{'File':<50} {'brute':>8} {method[:8]:>8} {'t_brute':>8} {'t_' + method[:6]:>8}")
+    print("-" * 86)
+
+    total_brute = 0.0
+    total_fast = 0.0
+    diffs = []
+
+    for image_path in images:
+        image = cv2.imread(str(image_path))
+        if image is None:
+            print(f"Could not read {image_path}")
+            continue
+
+        start = time.perf_counter()
+        brute_angle, _ = correct_skew(image)
+        t_brute = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fast_angle, _ = correct_skew(image, method=method)
+        t_fast = time.perf_counter() - start
+
+        total_brute += t_brute
+        total_fast += t_fast
+        diffs.append(abs(float(brute_angle) - float(fast_angle)))
+
+        name = f"{image_path.parent.name}/{image_path.name}"[:50]
+        print(f"{name:<50} {brute_angle:>8.3f} {fast_angle:>8.3f} {t_brute:>7.2f}s {t_fast:>7.2f}s")
+
+    pages = len(diffs)
+    print("=" * 86)
+    print(f"Pages: {pages}")
+    print(f"Brute force: {total_brute / pages:.2f} s/page")
+    print(f"{method}: {total_fast / pages:.2f} s/page")
+    print(f"Speedup: {total_brute / total_fast:.1f}x")
+    print(f"Angle difference: mean {sum(diffs) / pages:.3f}°, max {max(diffs):.3f}°")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark skew correction engines")
+    parser.add_argument("--max-files", type=int, help="Maximum number of images to benchmark")
+    parser.add_argument("--method", default="coarse_to_fine", choices=sorted(SKEW_ESTIMATORS),
+                        help="Skew estimator to compare against the brute-force sweep")
+
+    args = parser.parse_args()
+    run_benchmark(args.max_files, args.method)
@@ -0,0 +1,115 @@
+from tokenizer import num_tokens
+from template_parser import split_cells, DATE_RE
+from statement_schema import parse_number
+
+PAGE_MARKER = "=== Page {} ==="
+
+# Fields of the statement schema that describe the whole statement
+HEADER_FIELDS = ('bank', 'statement_date', 'account_number', 'statement_period')
+DETAIL_FIELDS = ('contact_info', 'client_info', 'account_details')
+# Account details that belong to the end of the statement, taken from the last page having them
+LAST_VALUE_DETAILS = ('closing_balance',)
+
+def starts_transaction(line):
+    """True for a table row whose first cell is a date, i.e. the first line of a transaction"""
+    _, cells = split_cells(line)
+    first = next((cell for _, cell in cells if cell), '')
+    return bool(DATE_RE.match(first))
+
+def transaction_blocks(text):
+    """
+    Split a page's text at transaction boundaries: the lines before the
+    first transaction, then one block per transaction with its wrapped lines
+    """
+    blocks = []
+    for line in text.splitlines(keepends=True):
+        if not blocks or starts_transaction(line):
+            blocks.append(line)
+        else:
+            blocks[-1] += line
+    return blocks
+
+def chunk_pages(pages, budget, count=num_tokens):
+    """
+    Group (page_number, text) pairs into chunks of at most budget tokens,
+    keeping pages whole when they fit. A page larger than the budget is split
+    between transactions, never inside one (a single oversized transaction
+    still gets a chunk of its own). Every later chunk of a split page starts
+    with the page's header block (column titles), so cells keep their
+    meaning. Returns lists of (page_number, text).
+    """
+    chunks = []
+    current, used = [], 0
+    for number, text in pages:
+        marker = count(PAGE_MARKER.format(number))
+        size = count(text)
+        blocks = transaction_blocks(text) if size + marker > budget else [text]
+        header = blocks[0] if len(blocks) > 1 and not starts_transaction(blocks[0].split('\n', 1)[0]) else ''
+        for index, block in enumerate(blocks):
+            size = count(block) if len(blocks) > 1 else size
+            continues_page = bool(current) and current[-1][0] == number
+            needed = size if continues_page else size + marker
+            if current and used + needed > budget:
+                chunks.append(current)
+                current, used = [], 0
+                continues_page = False
+                if header and index > 0:
+                    block = header + block
+                    size += count(header)
+                needed = size + marker
+            if continues_page:
+                current[-1] = (number, current[-1][1] + block)
+            else:
+                current.append((number, block))
+            used += needed
+    if current:
+        chunks.append(current)
+    return chunks
+
+def chunk_text(chunk):
+    """Text of a chunk, each page preceded by its page marker"""
+    return "\n".join(f"{PAGE_MARKER.format(number)}\n{text.rstrip()}" for number, text in chunk) + "\n"
+
+def to_number(value):
+    """Amount from a parsed JSON value, 0.0 when absent or unreadable"""
+    return parse_number(value) or 0.0
+
+def is_empty(value):
+    return value is None or value == '' or value == {} or value == []
+
+def merge_statements(parts):
+    """
+    Merge per-chunk statement JSONs (in page order) into one statement.
+    Header fields and details keep the first value found, the closing balance
+    the last one, transactions are concatenated and the summary recomputed.
+    """
+    merged = {field: None for field in HEADER_FIELDS}
+    merged.update({field: {} for field in DETAIL_FIELDS})
+    transactions = []
+    for part in parts:
+        if not isinstance(part, dict):
+            continue
+        for key, value in part.items():
+            if key in ('transactions', 'summary', 'processing_info'):
+                continue
+            if key in DETAIL_FIELDS and isinstance(value, dict):
+                for detail, detail_value in value.items():
+                    if is_empty(detail_value):
+                        continue
+                    if detail in LAST_VALUE_DETAILS or is_empty(merged[key].get(detail)):
+                        merged[key][detail] = detail_value
+            elif is_empty(merged.get(key)) and not is_empty(value):
+                merged[key] = value
+        if isinstance(part.get('transactions'), list):
+            transactions.extend(part['transactions'])
+
+    total_debits = round(sum(to_number(t.get('debit')) for t in transactions if isinstance(t, dict)), 2)
+    total_credits = round(sum(to_number(t.get('credit')) for t in transactions if isinstance(t, dict)), 2)
+    merged['transactions'] = transactions
+    merged['summary'] = {
+        'total_credits': total_credits,
+        'total_debits': total_debits,
+        'transaction_count': len(transactions),
+        'net_change': round(total_credits - total_debits, 2),
+    }
+    return merged
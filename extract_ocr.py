@@ -1,10 +1,13 @@
 import itertools
 import os
-from operator import itemgetter
+import shlex
+import threading
+import numpy as np
 import pytesseract
-import tiktoken
 from PIL import Image
 from dotenv import load_dotenv
+from tokenizer import limit_tokens
+from instrumentation import instrumented, image_fields
 
 # Load environment variables
 load_dotenv()
@@ -13,105 +16,328 @@ load_dotenv()
 tesseract_path = os.getenv('TESSERACT_CMD', r'C:\Program Files\Tesseract-OCR\tesseract.exe')
 pytesseract.pytesseract.tesseract_cmd = tesseract_path
 
-def num_tokens(text, model="gpt-3.5-turbo-0613"):
-    """Return the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-
-    num_tokens = len(encoding.encode(text))
-    return num_tokens
-
-def limit_tokens(text, max_tokens=16000):
-    num_of_tokens = num_tokens(text)
-    if num_of_tokens > max_tokens:
-        return text[:max_tokens]
+# OCR engine: auto (tesserocr when installed, else pytesseract), tesserocr or pytesseract
+OCR_BACKEND = os.getenv('OCR_BACKEND', 'auto')
+
+def word_arrays(data):
+    """Word boxes as an (n, 4) float array, the word strings and their lengths"""
+    values = [datum['value'] for datum in data]
+    coordinates = itertools.chain.from_iterable(datum['coordinates'] for datum in data)
+    boxes = np.fromiter(coordinates, dtype=float, count=4 * len(data)).reshape(-1, 4)
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    return boxes, values, lengths
+
+def char_metrics(boxes, lengths):
+    """Half the smallest word height (row tolerance) and the average character width"""
+    height = min(1000, np.abs(boxes[:, 3] - boxes[:, 1]).min())
+    # cumsum adds left to right, matching a plain running sum bit for bit
+    sum_widths = np.cumsum(boxes[:, 2] - boxes[:, 0])[-1]
+    return height / 2, sum_widths // lengths.sum()
+
+def get_avg_char_width(data):
+    boxes, _, lengths = word_arrays(data)
+    return char_metrics(boxes, lengths)
+
+def cluster_rows(centers, tolerance):
+    """
+    Row index for each word: sorted distinct vertical centers start a new
+    row wherever the gap to the previous center exceeds tolerance
+    """
+    unique, inverse = np.unique(centers, return_inverse=True)
+    breaks = unique[1:] > unique[:-1] + tolerance
+    row_of_unique = np.concatenate(([0], np.cumsum(breaks)))
+    return row_of_unique[inverse.ravel()]
+
+def sorted_words(data):
+    """
+    Word boxes, values and row ids in reading order (one stable sort by row,
+    then left edge), plus the average character width
+    """
+    boxes, values, lengths = word_arrays(data)
+    min_height, x_tolerance = char_metrics(boxes, lengths)
+
+    rows = cluster_rows((boxes[:, 1] + boxes[:, 3]) / 2, min_height)
+    order = np.lexsort((boxes[:, 0], rows))
+    return boxes[order], [values[i] for i in order.tolist()], rows[order], x_tolerance
+
+def extract_text(data, add_spaces, max_tokens=16000):
+    """
+    Rebuild the page layout as text from word boxes: words are grouped into
+    rows by vertical center, ordered left to right, and padded with one space
+    per average character width of horizontal gap when add_spaces is set
+    """
+    if not data:
+        return ""
+
+    boxes, values, rows, x_tolerance = sorted_words(data)
+    x0 = boxes[:, 0]
+    x1 = boxes[:, 2]
+    line_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+
+    if add_spaces and x_tolerance > 0:
+        # Spaces before each word: one separator plus one per tolerance step
+        # that still fits before the word's left edge
+        previous_x1 = np.r_[0.0, x1[:-1]]
+        previous_x1[line_starts] = 0.0
+        steps = np.ceil((x0 - (previous_x1 + x_tolerance)) / x_tolerance) - 1
+        pads = (np.maximum(steps, 0) + 1).astype(int)
     else:
-        return text
-
-def cluster_list(xs, tolerance=0):
-    if tolerance == 0 or len(xs) < 2:
-        return [[x] for x in sorted(xs)]
-    
-    groups = []
-    xs = list(sorted(xs))
-    current_group = [xs[0]]
-    last = xs[0]
-
-    for x in xs[1:]:
-        if x <= (last + tolerance):
-            current_group.append(x)
-        else:
-            groups.append(current_group)
-            current_group = [x]
-        last = x
-    groups.append(current_group)
+        pads = np.ones(len(values), dtype=int)
+    pads[line_starts] -= 1
 
-    return groups
+    words = [' ' * pad + value for pad, value in zip(pads.tolist(), values)]
+    bounds = line_starts.tolist() + [len(words)]
+    lines = ("".join(words[start:end]) for start, end in zip(bounds[:-1], bounds[1:]))
+    if not add_spaces:
+        lines = (line.strip() for line in lines)
 
-def make_cluster_dict(values, tolerance):
-    clusters = cluster_list(list(set(values)), tolerance)
+    text = "\n".join(lines)
 
-    nested_tuples = [
-        [(val, i) for val in value_cluster] for i, value_cluster in enumerate(clusters)
-    ]
+    return limit_tokens(text, max_tokens)
 
-    return dict(itertools.chain(*nested_tuples))
+def assign_bands(cell_x0, cell_x1, band_x0, band_x1):
+    """Index of the band each cell overlaps most, or of the nearest band when it overlaps none"""
+    overlap = np.minimum(cell_x1[:, None], band_x1) - np.maximum(cell_x0[:, None], band_x0)
+    return overlap.argmax(axis=1)
 
-def cluster_objects(xs, tolerance):
-    key_fn = lambda x: (x['coordinates'][1] + x['coordinates'][3]) / 2
-    values = map(key_fn, xs)
-    cluster_dict = make_cluster_dict(values, tolerance)
-    get_0, get_1 = itemgetter(0), itemgetter(1)
-    cluster_tuples = sorted(((x, cluster_dict.get(key_fn(x))) for x in xs), key=get_1)
-    grouped = itertools.groupby(cluster_tuples, key=get_1)
+def extract_table_text(data, separator='\t', max_tokens=16000, cell_gap=2.0, min_cells=3):
+    """
+    Rebuild the page as compact rows of cells instead of space-padded lines.
 
-    return [list(map(get_0, v)) for k, v in grouped]
+    Words closer than cell_gap average character widths form a cell. The
+    row with the most cells (at least min_cells), the column header on a
+    statement, gives one band per cell, so a column stays even when only a
+    few rows fill it. Every row between the first and last row with at
+    least min_cells cells is written with one slot per band, empty slots
+    included, each cell in the band it overlaps most, so amounts stay under
+    their debit/credit/balance column, as are the following rows whose
+    cells all sit inside a band (wrapped descriptions). Rows outside the
+    table keep their cells in reading order.
+    """
+    if not data:
+        return ""
 
-def get_avg_char_width(data):
-    height = 1000
-    sum_widths = 0.0
-    cnt = 0
-    for datum in data:
-        height = min(height, abs(datum['coordinates'][3] - datum['coordinates'][1]))
-        sum_widths += datum['coordinates'][2] - datum['coordinates'][0]
-        cnt += len(datum['value'])
-    return height / 2, sum_widths // cnt
-
-def collate_line(line_chars, tolerance, add_spaces) -> str:
-    coll = ""
-    last_x1 = 0
-
-    for char in sorted(line_chars, key=lambda x: x['coordinates'][0]):
-        coll += ' '
-        last_x1 += tolerance
-        while last_x1 + tolerance < char['coordinates'][0] and add_spaces: 
-            coll += " "
-            last_x1 += tolerance
-        coll += char['value']
-        last_x1 = char['coordinates'][2]
-
-    return coll[1:] if add_spaces else coll.strip()
+    boxes, values, rows, x_tolerance = sorted_words(data)
+    x0 = boxes[:, 0]
+    x1 = boxes[:, 2]
 
-def extract_text(data, add_spaces, max_tokens=16000):
-    min_height, x_tolerance = get_avg_char_width(data)
-    
-    doctop_clusters = cluster_objects(data, tolerance=min_height)
+    new_line = np.r_[True, rows[1:] != rows[:-1]]
+    new_cell = new_line | (x0 - np.r_[0.0, x1[:-1]] > cell_gap * x_tolerance)
+    cell_starts = np.flatnonzero(new_cell)
+    cell_x0 = np.minimum.reduceat(x0, cell_starts)
+    cell_x1 = np.maximum.reduceat(x1, cell_starts)
+    cell_rows = rows[cell_starts]
+    bounds = cell_starts.tolist() + [len(values)]
+    cells = [' '.join(values[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    cells_per_row = np.bincount(cell_rows)
+    table_rows = np.flatnonzero(cells_per_row >= min_cells)
+    slots = None
+    if len(table_rows):
+        # argmax keeps the first of the widest rows: the header comes before
+        # a transaction whose description happens to split in two cells
+        header = cell_rows == cells_per_row.argmax()
+        bands = assign_bands(cell_x0, cell_x1, cell_x0[header], cell_x1[header])
+        slots = bands.tolist()
+        # Band extents grow over the table cells, for the wrapped rows test below
+        in_table = cells_per_row[cell_rows] >= min_cells
+        starts = cell_x0[header].copy()
+        ends = cell_x1[header].copy()
+        np.minimum.at(starts, bands[in_table], cell_x0[in_table])
+        np.maximum.at(ends, bands[in_table], cell_x1[in_table])
+        first_row, last_row = table_rows[0], table_rows[-1]
+        # Wrapped descriptions after the last full row still belong to the table
+        centers = (cell_x0 + cell_x1) / 2
+        in_gutter = np.bincount(cell_rows, (centers < starts[bands]) | (centers > ends[bands]),
+                                minlength=len(cells_per_row))
+        while last_row + 1 < len(cells_per_row) and not in_gutter[last_row + 1]:
+            last_row += 1
 
-    lines = (
-        collate_line(line_chars, x_tolerance, add_spaces) for line_chars in doctop_clusters
-    )
+    lines = []
+    line_cells = []
+    for i, row in enumerate(cell_rows.tolist()):
+        if i and row != cell_rows[i - 1]:
+            lines.append(separator.join(line_cells))
+            line_cells = []
+        if slots is not None and first_row <= row <= last_row:
+            if not line_cells:
+                line_cells = [''] * len(starts)
+            slot = slots[i]
+            line_cells[slot] = f"{line_cells[slot]} {cells[i]}" if line_cells[slot] else cells[i]
+        else:
+            line_cells.append(cells[i])
+    lines.append(separator.join(line_cells))
 
     text = "\n".join(lines)
 
     return limit_tokens(text, max_tokens)
 
-def extract_text_ocr(image_file, add_spaces, max_tokens=16000):
-    # Tesseract path is already set at module level
-    image = Image.open(image_file)
-    ocr_data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+# Text layouts for OCR'd and text-layer pages: space-padded lines, or table
+# rows with tab or pipe separated cells
+LAYOUT_SEPARATORS = {
+    'tsv': '\t',
+    'pipe': ' | ',
+}
+
+def layout_text(data, add_spaces, max_tokens=16000, layout='spaces'):
+    """Rebuild page text from word boxes in the requested layout"""
+    if layout == 'spaces':
+        return extract_text(data, add_spaces, max_tokens)
+    if layout not in LAYOUT_SEPARATORS:
+        raise ValueError(f"Unknown text layout: {layout}")
+    return extract_table_text(data, LAYOUT_SEPARATORS[layout], max_tokens)
+
+def to_pil_image(image):
+    """Accept a path, file object, PIL image or NumPy array (BGR, as read by OpenCV)"""
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, np.ndarray):
+        if image.ndim == 3 and image.shape[2] == 3:
+            image = image[:, :, ::-1]
+        elif image.ndim == 3 and image.shape[2] == 4:
+            image = image[:, :, [2, 1, 0, 3]]
+        return Image.fromarray(np.ascontiguousarray(image))
+    return Image.open(image)
+
+class PytesseractBackend:
+    """Runs the tesseract executable once per call (process startup and model loading every page)"""
+
+    name = 'pytesseract'
+
+    def image_to_data(self, image, config=''):
+        # Tesseract path is already set at module level
+        return pytesseract.image_to_data(to_pil_image(image), config=config, output_type=pytesseract.Output.DICT)
+
+    def image_to_string(self, image, config=''):
+        return pytesseract.image_to_string(to_pil_image(image), config=config)
+
+    def languages(self):
+        """Installed traineddata languages"""
+        return pytesseract.get_languages(config='')
+
+def parse_tesseract_config(config):
+    """
+    Split tesseract command line options into (lang, psm, oem, variables),
+    e.g. '-l fra --psm 6 -c preserve_interword_spaces=1'
+    """
+    lang, psm, oem, variables = 'eng', None, None, {}
+    args = shlex.split(config)
+    for option, value in zip(args, args[1:] + ['']):
+        if option == '-l':
+            lang = value
+        elif option == '--psm':
+            psm = int(value)
+        elif option == '--oem':
+            oem = int(value)
+        elif option == '-c' and '=' in value:
+            name, setting = value.split('=', 1)
+            variables[name] = setting
+    return lang, psm, oem, variables
+
+class TesserocrBackend:
+    """
+    In-process Tesseract through tesserocr. One engine per thread and per
+    config stays loaded, so only the first page pays for model loading.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self):
+        import tesserocr
+        self.tesserocr = tesserocr
+        self.path = os.getenv('TESSDATA_PREFIX')
+        self._local = threading.local()
+
+    def api(self, config=''):
+        """This thread's engine for config, created on first use"""
+        apis = self._local.__dict__.setdefault('apis', {})
+        if config not in apis:
+            lang, psm, oem, variables = parse_tesseract_config(config)
+            kwargs = {'lang': lang}
+            if self.path:
+                kwargs['path'] = self.path
+            if psm is not None:
+                kwargs['psm'] = psm
+            if oem is not None:
+                kwargs['oem'] = oem
+            api = self.tesserocr.PyTessBaseAPI(**kwargs)
+            for name, setting in variables.items():
+                api.SetVariable(name, setting)
+            apis[config] = api
+        return apis[config]
+
+    def image_to_data(self, image, config=''):
+        """Word level boxes in pytesseract's image_to_data dict layout"""
+        api = self.api(config)
+        api.SetImage(to_pil_image(image))
+        api.Recognize()
+        data = {'text': [], 'left': [], 'top': [], 'width': [], 'height': [], 'conf': []}
+        level = self.tesserocr.RIL.WORD
+        iterator = api.GetIterator()
+        if iterator is None:
+            return data
+        for word in self.tesserocr.iterate_level(iterator, level):
+            box = word.BoundingBox(level)
+            text = word.GetUTF8Text(level)
+            if box is None or text is None:
+                continue
+            x0, y0, x1, y1 = box
+            data['text'].append(text)
+            data['left'].append(x0)
+            data['top'].append(y0)
+            data['width'].append(x1 - x0)
+            data['height'].append(y1 - y0)
+            data['conf'].append(word.Confidence(level))
+        return data
+
+    def image_to_string(self, image, config=''):
+        api = self.api(config)
+        api.SetImage(to_pil_image(image))
+        return api.GetUTF8Text()
+
+    def languages(self):
+        """Installed traineddata languages"""
+        kwargs = {'path': self.path} if self.path else {}
+        return self.tesserocr.get_languages(**kwargs)[1]
+
+OCR_BACKENDS = {'pytesseract': PytesseractBackend, 'tesserocr': TesserocrBackend}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_ocr_backend(name=None):
+    """
+    Process-wide OCR backend (OCR_BACKEND by default). auto prefers the
+    persistent tesserocr engine and falls back to pytesseract when it is
+    not installed. Forked worker processes build their own.
+    """
+    name = name or OCR_BACKEND
+    key = (os.getpid(), name)
+    with _backends_lock:
+        if key not in _backends:
+            if name == 'auto':
+                try:
+                    backend = TesserocrBackend()
+                except ImportError:
+                    backend = PytesseractBackend()
+            else:
+                backend = OCR_BACKENDS[name]()
+            _backends[key] = backend
+        return _backends[key]
+
+def warm_up_ocr(config=''):
+    """
+    Load the OCR engine now (e.g. as a process pool initializer), so the
+    first page of each worker does not pay for it
+    """
+    backend = get_ocr_backend()
+    if isinstance(backend, TesserocrBackend):
+        backend.api(config)
+    return backend.name
+
+def ocr_words(image, config=''):
+    """Word boxes of a page from Tesseract, as [{'value', 'coordinates': [x0, y0, x1, y1]}]"""
+    ocr_data = get_ocr_backend().image_to_data(image, config)
     data = []
     for i in range(len(ocr_data['text'])):
         if ocr_data['text'][i].strip():  
@@ -125,5 +351,108 @@ def extract_text_ocr(image_file, add_spaces, max_tokens=16000):
                 ]
             }
             data.append(datum)
-    return extract_text(data, add_spaces, max_tokens)
+    return data
+
+def skyline_pack(sizes, width, gap, step=8):
+    """
+    Bottom-left skyline packing of (w, h) boxes, widest first, in a strip of
+    the given width. Returns the (x, y) of each box and the strip height.
+    """
+    columns = -(-width // step)
+    skyline = np.full(columns, gap)
+    offsets = [None] * len(sizes)
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][0]):
+        w, h = sizes[i]
+        span = -(-(w + gap) // step)
+        # Lowest top over every window of span columns, left margin excluded
+        tops = np.lib.stride_tricks.sliding_window_view(skyline[1:], span).max(axis=1)
+        j = int(tops.argmin()) + 1
+        y = int(tops[j - 1])
+        offsets[i] = (j * step, y)
+        skyline[j:j + span] = y + h + gap
+    return offsets, int(skyline.max())
+
+def build_mosaic(image, regions, gap=20, width_factors=(0.75, 1.0, 1.25, 1.5, 2.0)):
+    """
+    Pack the region crops of a page into one image on the page's background
+    colour, trying a few strip widths and keeping the smallest mosaic.
+    Returns the mosaic and the (x, y) offset of each region inside it.
+    """
+    sizes = [(x1 - x0, y1 - y0) for x0, y0, x1, y1 in regions]
+    min_width = max(w for w, h in sizes) + 2 * gap + 8
+    best = None
+    for factor in width_factors:
+        width = max(min_width, int(image.shape[1] * factor))
+        offsets, height = skyline_pack(sizes, width, gap)
+        if best is None or width * height < best[0] * best[1]:
+            best = (width, height, offsets)
+    width, height, offsets = best
+
+    channels = image.shape[2:]
+    background = np.median(image[::8, ::8].reshape((-1,) + channels), axis=0)
+    mosaic = np.empty((height, width) + channels, dtype=image.dtype)
+    mosaic[:] = background
+    for (x0, y0, x1, y1), (x, y) in zip(regions, offsets):
+        mosaic[y:y + y1 - y0, x:x + x1 - x0] = image[y0:y1, x0:x1]
+    return mosaic, offsets
 
+def ocr_words_in_regions(image, regions, config='', mode='mosaic', max_coverage=0.85):
+    """
+    OCR only the text regions of a page (see preprocess.text_regions) and
+    return word boxes in page coordinates. 'mosaic' packs the crops into a
+    single Tesseract call, 'crops' OCRs each crop on its own. Pages whose
+    regions cover most of the page are OCR'd whole.
+    """
+    page_area = image.shape[0] * image.shape[1]
+    covered = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+    if not regions or covered >= max_coverage * page_area:
+        return ocr_words(image, config)
+
+    if mode == 'crops':
+        data = []
+        for x0, y0, x1, y1 in regions:
+            for datum in ocr_words(image[y0:y1, x0:x1], config):
+                c = datum['coordinates']
+                datum['coordinates'] = [c[0] + x0, c[1] + y0, c[2] + x0, c[3] + y0]
+                data.append(datum)
+        return data
+
+    mosaic, offsets = build_mosaic(image, regions)
+    words = ocr_words(mosaic, config)
+    if not words:
+        return []
+    # Each word belongs to the placed crop holding its center
+    boxes = np.array([datum['coordinates'] for datum in words], dtype=float)
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    placed = np.array([(x, y, x + x1 - x0, y + y1 - y0) for (x0, y0, x1, y1), (x, y) in zip(regions, offsets)])
+    inside = ((cx[:, None] >= placed[:, 0]) & (cx[:, None] < placed[:, 2]) &
+              (cy[:, None] >= placed[:, 1]) & (cy[:, None] < placed[:, 3]))
+    owner = inside.argmax(axis=1)
+    data = []
+    for datum, region, found in zip(words, owner.tolist(), inside.any(axis=1).tolist()):
+        if not found:
+            continue
+        dx = regions[region][0] - offsets[region][0]
+        dy = regions[region][1] - offsets[region][1]
+        c = datum['coordinates']
+        datum['coordinates'] = [c[0] + dx, c[1] + dy, c[2] + dx, c[3] + dy]
+        data.append(datum)
+    return data
+
+@instrumented('ocr', lambda text, image_file, *args, **kwargs: dict(image_fields(image_file), words=len(text.split())))
+def extract_text_ocr(image_file, add_spaces, max_tokens=16000, layout='spaces', config='', regions=None,
+                     roi_mode='mosaic'):
+    """
+    OCR a page and rebuild its layout as text (see layout_text).
+    config holds extra Tesseract options.
+    image_file can be a path, an open file, a PIL image or a NumPy array, so
+    an in-memory page can be handed over without an encode/decode round-trip.
+    With regions (page-coordinate text blocks of an array page), only those
+    crops are OCR'd.
+    """
+    if regions is not None and isinstance(image_file, np.ndarray):
+        data = ocr_words_in_regions(image_file, regions, config, roi_mode)
+    else:
+        data = ocr_words(image_file, config)
+    return layout_text(data, add_spaces, max_tokens, layout)
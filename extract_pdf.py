@@ -1,46 +1,149 @@
 import pypdfium2 as pdfium 
-import tiktoken
+import pypdfium2.raw as pdfium_c
 import fitz  # PyMuPDF
 from PIL import Image
 import os
 import tempfile
 from pathlib import Path
 import io
+import queue
+import threading
+import numpy as np
+from extract_ocr import layout_text
+from tokenizer import limit_tokens
+from instrumentation import instrumented, measure, image_fields
 
-def num_tokens(text, model="gpt-3.5-turbo-0613"):
-	"""Return the number of tokens used by a list of messages."""
-	try:
-		encoding = tiktoken.encoding_for_model(model)
-	except KeyError:
-		print("Warning: model not found. Using cl100k_base encoding.")
-		encoding = tiktoken.get_encoding("cl100k_base")
-
-	num_tokens = len(encoding.encode(text))
-	return num_tokens
-
-
-def limit_tokens (text, max_tokens=16000):
-	num_of_tokens = num_tokens(text)
-	if num_of_tokens > max_tokens:
-		return text[:max_tokens]
-	else:
-		return text
+# PDFium and MuPDF are not thread-safe: concurrent calls from job threads or
+# the prefetch thread can crash the process. Every call into pypdfium2 or
+# PyMuPDF (open, render, text extraction, close) holds this lock; work on the
+# results (layout, OCR) runs outside it.
+PDF_LOCK = threading.RLock()
 
 def extract_text_pdf(feed: str, multiple_pages: bool = False, max_page_count: int=2, page_num: int = 1, max_tokens: int = 16000) -> str:
 	""" 	This function makes use of the PyPDFium2 library to extract the text from a pdf file	"""
 	if multiple_pages == False:
-		pdf = pdfium.PdfDocument(feed)
-		text = pdf[page_num - 1].get_textpage().get_text_range()
+		with PDF_LOCK:
+			pdf = pdfium.PdfDocument(feed)
+			text = pdf[page_num - 1].get_textpage().get_text_range()
+			pdf.close()
 		return limit_tokens (text, max_tokens=max_tokens)
 	else:
 		data = []
-		pdf = pdfium.PdfDocument(feed)
-		for i in range (min(len(pdf), max_page_count)):
-			data.append (pdf[i].get_textpage().get_text_range())
+		with PDF_LOCK:
+			pdf = pdfium.PdfDocument(feed)
+			for i in range (min(len(pdf), max_page_count)):
+				data.append (pdf[i].get_textpage().get_text_range())
+			pdf.close()
 		text = "\n".join(data)
 		return limit_tokens (text, max_tokens=max_tokens)
 
-def pdf_to_images(pdf_path, output_dir=None, dpi=300):
+# Minimum number of visible characters for a page's text layer to be trusted
+MIN_TEXT_LAYER_CHARS = 20
+# A page mostly covered by one image is a scan: its text layer is only trusted
+# when it covers a real share of the page, not just a stamp or a footer
+SCAN_IMAGE_COVERAGE = 0.5
+MIN_SCAN_TEXT_COVERAGE = 0.02
+
+def page_words(page, scale=300 / 72):
+    """
+    Group the characters of a pypdfium2 page into words with top-down pixel
+    boxes, in the same {'value', 'coordinates'} format as the OCR word boxes.
+    Coordinates are scaled from PDF points so layout tolerances match a
+    page rendered at 300 DPI.
+    """
+    textpage = page.get_textpage()
+    count = textpage.count_chars()
+    page_height = page.get_size()[1]
+    text = textpage.get_text_range(0, count)
+    if len(text) != count:
+        text = "".join(textpage.get_text_range(i, 1) for i in range(count))
+
+    words = []
+    chars = []
+    box = None
+
+    def flush():
+        if chars:
+            words.append({
+                'value': "".join(chars),
+                'coordinates': [box[0] * scale, (page_height - box[3]) * scale,
+                                box[2] * scale, (page_height - box[1]) * scale]
+            })
+
+    for i, char in enumerate(text):
+        if char.isspace():
+            flush()
+            chars, box = [], None
+            continue
+        left, bottom, right, top = textpage.get_charbox(i, loose=True)
+        if box is not None:
+            height = box[3] - box[1]
+            # A wide gap or a jump to another baseline starts a new word
+            if left - box[2] > height / 2 or abs((bottom + top) - (box[1] + box[3])) > height:
+                flush()
+                chars, box = [], None
+        chars.append(char)
+        if box is None:
+            box = [left, bottom, right, top]
+        else:
+            box = [min(box[0], left), min(box[1], bottom), max(box[2], right), max(box[3], top)]
+    flush()
+
+    textpage.close()
+    return words
+
+def image_coverage(page):
+    """Share of the page area covered by its largest image"""
+    width, height = page.get_size()
+    largest = 0.0
+    for obj in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE], max_depth=2):
+        # get_pos in pypdfium2 4.x, get_bounds in 5.x
+        left, bottom, right, top = obj.get_bounds() if hasattr(obj, 'get_bounds') else obj.get_pos()
+        largest = max(largest, (right - left) * (top - bottom) / (width * height))
+    return min(largest, 1.0)
+
+def has_text_layer(words, page_area=None, scan_coverage=0.0):
+    """
+    A text layer is usable if it has enough readable characters with real
+    boxes. On a scanned page (scan_coverage: share of the page under its
+    largest image) the word boxes must also cover MIN_SCAN_TEXT_COVERAGE of
+    page_area, in the same units as the word coordinates.
+    """
+    boxes = [w for w in words
+             if w['coordinates'][2] > w['coordinates'][0] and w['coordinates'][3] > w['coordinates'][1]]
+    visible = sum(len(w['value']) for w in boxes)
+    if visible < MIN_TEXT_LAYER_CHARS:
+        return False
+    if page_area and scan_coverage >= SCAN_IMAGE_COVERAGE:
+        covered = sum((c[2] - c[0]) * (c[3] - c[1]) for c in (w['coordinates'] for w in boxes))
+        if covered / page_area < MIN_SCAN_TEXT_COVERAGE:
+            return False
+    # Fonts without a unicode map come out as replacement or control characters
+    garbage = sum(1 for w in words for c in w['value'] if c == '\ufffd' or (ord(c) < 32))
+    return garbage / visible < 0.1
+
+def extract_text_layer(pdf_path, add_spaces=True, max_tokens=16000, layout='spaces'):
+    """
+    Build the same layout text as extract_ocr.layout_text from each page's
+    native text layer. Returns one entry per page: the text, or
+    None when the page has no usable text layer and needs OCR.
+    """
+    pages = []
+    with PDF_LOCK:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            for i in range(len(pdf)):
+                page = pdf[i]
+                words = page_words(page)
+                width, height = page.get_size()
+                pages.append((words, has_text_layer(words, width * height * (300 / 72) ** 2, image_coverage(page))))
+                page.close()
+        finally:
+            pdf.close()
+    return [layout_text(words, add_spaces, max_tokens, layout) if usable else None for words, usable in pages]
+
+@instrumented('pdf_to_images', lambda paths, pdf_path, *args, **kwargs: {'file': os.path.basename(pdf_path), 'pages': len(paths)})
+def pdf_to_images(pdf_path, output_dir=None, dpi=300, pages=None):
     """
     Convert PDF pages to images using PyMuPDF
     
@@ -48,12 +151,12 @@ def pdf_to_images(pdf_path, output_dir=None, dpi=300):
         pdf_path (str): Path to the PDF file
         output_dir (str): Directory to save images
         dpi (int): Resolution for conversion
+        pages (list): Zero-based page numbers to convert (default: all)
     
     Returns:
         list: List of image file paths
     """
     try:
-        doc = fitz.open(pdf_path)
         image_paths = []
         
         if output_dir:
@@ -61,30 +164,144 @@ def pdf_to_images(pdf_path, output_dir=None, dpi=300):
         else:
             output_dir = os.path.dirname(pdf_path)
         
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            
-            # Set the matrix for higher resolution
-            mat = fitz.Matrix(dpi/72, dpi/72)
-            pix = page.get_pixmap(matrix=mat)
-            
-            # Save as image
-            base_name = Path(pdf_path).stem
-            image_filename = f"{base_name}_page_{page_num + 1}.jpg"
-            image_path = os.path.join(output_dir, image_filename)
-            
-            pix.save(image_path)
-            image_paths.append(image_path)
-            
-            print(f"✅ Converted page {page_num + 1}/{doc.page_count} to {image_filename}")
-        
-        doc.close()
+        with PDF_LOCK:
+            doc = fitz.open(pdf_path)
+            try:
+                for page_num in (range(doc.page_count) if pages is None else pages):
+                    page = doc[page_num]
+                    
+                    # Set the matrix for higher resolution
+                    mat = fitz.Matrix(dpi/72, dpi/72)
+                    pix = page.get_pixmap(matrix=mat)
+                    
+                    # Save as image
+                    base_name = Path(pdf_path).stem
+                    image_filename = f"{base_name}_page_{page_num + 1}.jpg"
+                    image_path = os.path.join(output_dir, image_filename)
+                    
+                    pix.save(image_path)
+                    image_paths.append(image_path)
+                    
+                    print(f"✅ Converted page {page_num + 1}/{doc.page_count} to {image_filename}")
+            finally:
+                doc.close()
         return image_paths
         
     except Exception as e:
         print(f"❌ Error converting PDF: {e}")
         return []
 
+class _PixmapArray:
+    """Exposes a pixmap's samples to NumPy and keeps the pixmap alive while arrays use them"""
+
+    def __init__(self, pix):
+        self.pix = pix
+        self.__array_interface__ = {
+            'version': 3,
+            'shape': (pix.height, pix.width, pix.n),
+            'typestr': '|u1',
+            'strides': (pix.stride, pix.n, 1),
+            # A raw pointer makes NumPy keep this object (and the pixmap) as the array base
+            'data': (pix.samples_ptr, False),
+        }
+
+def pdf_page_count(pdf_path):
+    """Number of pages in a PDF"""
+    with PDF_LOCK:
+        doc = fitz.open(pdf_path)
+        try:
+            return doc.page_count
+        finally:
+            doc.close()
+
+def iter_pdf_pages(pdf_path, dpi=300, grayscale=False, pages=None):
+    """
+    Render PDF pages one at a time without touching the disk
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        dpi (int): Resolution for rendering
+        grayscale (bool): Render a single gray channel instead of RGB
+        pages (list): Zero-based page numbers to render (default: all)
+    
+    Yields:
+        tuple: (page_num, array) where array is H x W (grayscale) or
+        H x W x 3 (RGB) uint8 sharing the pixmap buffer, without a copy
+    """
+    with PDF_LOCK:
+        doc = fitz.open(pdf_path)
+        page_count = doc.page_count
+    try:
+        mat = fitz.Matrix(dpi/72, dpi/72)
+        colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+        for page_num in (range(page_count) if pages is None else pages):
+            # Runs in the prefetch thread, so the page is named here rather than by the caller
+            with measure('render', page=f"{Path(pdf_path).stem}_page_{page_num + 1}.jpg", dpi=dpi) as details:
+                with PDF_LOCK:
+                    pix = doc[page_num].get_pixmap(matrix=mat, colorspace=colorspace, alpha=False)
+                array = np.asarray(_PixmapArray(pix))
+                details.update(image_fields(array))
+            # The lock is released while the caller works on the page
+            yield page_num, (array[:, :, 0] if grayscale else array)
+    finally:
+        with PDF_LOCK:
+            doc.close()
+
+def prefetch(iterator, depth=1):
+    """
+    Run an iterator in a background thread, keeping up to `depth` items
+    ready so the next page renders while the current one is processed
+    """
+    if depth <= 0:
+        yield from iterator
+        return
+
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        """Queue an item, giving up once the consumer has stopped"""
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+            else:
+                put(done)
+        except BaseException as e:
+            put(e)
+        finally:
+            # Release the source (e.g. the open PDF) in the thread that used it
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Drop the pages already rendered, then wait for the producer to finish its current one
+        while not items.empty():
+            items.get_nowait()
+        producer.join()
+
 def is_pdf_file(file_path):
     """Check if file is a PDF"""
     return Path(file_path).suffix.lower() == '.pdf'
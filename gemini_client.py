@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+DEFAULT_MODEL = 'gemini-1.5-flash'
+
+class TransientError(Exception):
+    """Raised by transports for failures worth retrying (429, 5xx, timeouts)"""
+
+def is_transient(error):
+    """Decide whether a failed request should be retried"""
+    if isinstance(error, (TransientError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    try:
+        from google.api_core import exceptions as api_exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (
+        api_exceptions.TooManyRequests,
+        api_exceptions.ResourceExhausted,
+        api_exceptions.InternalServerError,
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.DeadlineExceeded,
+    ))
+
+def rough_token_count(text):
+    """
+    Average-case token count (about 4 characters per token) for rate
+    limiting and the fake transport; tokenizer.estimate_tokens is an upper bound
+    """
+    return len(text) // 4 + 1
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`.
+    acquire() waits until enough tokens are available.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # Requests larger than the bucket would never fit, let them through at full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+class GenAITransport:
+    """Default transport calling the google-generativeai SDK"""
+
+    def __init__(self, api_key=None, model_name=DEFAULT_MODEL, api_endpoint=None):
+        import google.generativeai as genai
+
+        api_key = api_key or os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables")
+
+        # Configured once per process, the model object is reused for every request
+        options = {'api_key': api_key}
+        if api_endpoint:
+            options['client_options'] = {'api_endpoint': api_endpoint}
+            options['transport'] = 'rest'
+        genai.configure(**options)
+        self.genai = genai
+        self.model = genai.GenerativeModel(model_name)
+
+    async def __call__(self, prompt, generation_config):
+        response = await self.model.generate_content_async(
+            prompt,
+            generation_config=self.genai.types.GenerationConfig(**generation_config)
+        )
+        finish_reason = None
+        if response.candidates:
+            finish_reason = getattr(response.candidates[0].finish_reason, 'name', None)
+        usage = getattr(response, 'usage_metadata', None)
+        return {
+            'text': response.text,
+            'finish_reason': finish_reason,
+            'prompt_tokens': getattr(usage, 'prompt_token_count', None),
+            'output_tokens': getattr(usage, 'candidates_token_count', None),
+        }
+
+class FakeTransport:
+    """
+    Offline stand-in for GenAITransport: answers every request with an empty
+    statement after `latency` seconds, to run the pipeline or load-test the
+    services without an API key or network. Clients using it report this
+    model_name, so its canned answers never share cache keys with real ones.
+    """
+
+    model_name = 'fake'
+
+    def __init__(self, latency=0.5):
+        self.latency = latency
+
+    async def __call__(self, prompt, generation_config):
+        await asyncio.sleep(self.latency)
+        text = json.dumps({'bank': None, 'transactions': []})
+        return {
+            'text': text,
+            'finish_reason': 'STOP',
+            'prompt_tokens': rough_token_count(prompt),
+            'output_tokens': rough_token_count(text),
+        }
+
+class GeminiClient:
+    """
+    Shared Gemini client with a cap on in-flight requests, token-bucket rate
+    limits for requests/min and tokens/min, and jittered exponential backoff
+    on transient errors.
+
+    All requests run on one background event loop owned by the client, so the
+    limits hold across threads and callers. `transport` is an async callable
+    (prompt, generation_config) -> {'text', 'finish_reason', ...}; inject a
+    fake one to run offline.
+    """
+
+    def __init__(self, transport=None, model_name=DEFAULT_MODEL, max_concurrency=4,
+                 requests_per_minute=60, tokens_per_minute=1000000,
+                 max_retries=5, backoff_base=1.0, backoff_cap=30.0):
+        self.transport = transport
+        # A transport answering for another model (e.g. FakeTransport) names it
+        self.model_name = getattr(transport, 'model_name', None) or model_name
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._loop = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    @property
+    def needs_api_key(self):
+        """False when requests go to a transport that works without a Gemini API key"""
+        return not isinstance(self.transport, FakeTransport)
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self.transport is None:
+                self.transport = GenAITransport(model_name=self.model_name,
+                                                api_endpoint=os.getenv('GEMINI_API_ENDPOINT'))
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name='gemini-client', daemon=True)
+                thread.start()
+        return self._loop
+
+    async def _generate(self, prompt, generation_config):
+        if self._semaphore is None:
+            # Created on the client loop itself so it binds to the right loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        cost = rough_token_count(prompt) + generation_config.get('max_output_tokens', 0)
+
+        attempt = 0
+        while True:
+            # Every attempt, retries included, counts against both limits
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(cost)
+            try:
+                async with self._semaphore:
+                    return await self.transport(prompt, generation_config)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient(e):
+                    raise
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                attempt += 1
+                print(f"Transient Gemini error ({e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def submit(self, prompt, temperature=0.0, max_output_tokens=5000, **config):
+        """Schedule a request on the client loop and return a concurrent.futures.Future"""
+        generation_config = dict(config, temperature=temperature, max_output_tokens=max_output_tokens)
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._generate(prompt, generation_config), loop)
+
+    async def generate(self, prompt, **config):
+        """Async API: await a response dict from any event loop"""
+        return await asyncio.wrap_future(self.submit(prompt, **config))
+
+    def generate_sync(self, prompt, **config):
+        """Blocking API for threads and scripts"""
+        return self.submit(prompt, **config).result()
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_client():
+    """Process-wide client configured from the environment, created on first use"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            transport = os.getenv('GEMINI_TRANSPORT', 'genai')
+            if transport not in ('genai', 'fake'):
+                raise ValueError(f"Unknown GEMINI_TRANSPORT {transport!r}, expected genai or fake")
+            _default_client = GeminiClient(
+                transport=FakeTransport(float(os.getenv('GEMINI_FAKE_LATENCY', '0.5'))) if transport == 'fake' else None,
+                model_name=os.getenv('GEMINI_MODEL', DEFAULT_MODEL),
+                max_concurrency=int(os.getenv('GEMINI_MAX_CONCURRENCY', '4')),
+                requests_per_minute=int(os.getenv('GEMINI_RPM', '60')),
+                tokens_per_minute=int(os.getenv('GEMINI_TPM', '1000000')),
+                max_retries=int(os.getenv('GEMINI_MAX_RETRIES', '5')),
+            )
+        return _default_client
+
+def set_client(client):
+    """Replace the process-wide client, e.g. with one using a fake transport"""
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
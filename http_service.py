@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Headless HTTP extraction service
+Exposes the pipeline to other services: upload a statement, poll its job,
+fetch the statement JSON. Jobs run in a pre-warmed worker pool; once
+SERVICE_QUEUE_SIZE jobs are queued or running, new uploads get a 429.
+
+    POST /jobs?filename=statement.pdf[&bank=lcl]   body: the raw file -> 202 {id, status_url, result_url}
+    GET  /jobs/<id>                                state, progress and current step
+    GET  /jobs/<id>/result                         statement JSON once done
+    GET  /health                                   pool size and load
+    GET  /metrics                                  per-stage totals in the Prometheus format (METRICS=true)
+"""
+
+import json
+import os
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from dotenv import load_dotenv
+from main import process_to_statement, ensure_api_key, warm_up_page_ocr
+from job_runner import JobRunner, QueueFull, FINISHED_STATES, warm_up_resources
+from extract_pdf import is_image_file, is_pdf_file
+from gemini_client import GeminiClient, FakeTransport, set_client
+import instrumentation
+
+# Load environment variables
+load_dotenv()
+
+SERVICE_HOST = os.getenv('SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = int(os.getenv('SERVICE_PORT', '8080'))
+SERVICE_WORKERS = int(os.getenv('SERVICE_WORKERS', '2'))
+# Jobs queued or running before uploads are refused with 429
+SERVICE_QUEUE_SIZE = int(os.getenv('SERVICE_QUEUE_SIZE', '8'))
+SERVICE_MAX_UPLOAD_MB = float(os.getenv('SERVICE_MAX_UPLOAD_MB', '50'))
+SERVICE_UPLOAD_DIR = os.getenv('SERVICE_UPLOAD_DIR', os.path.join('.cache', 'uploads'))
+SERVICE_OUTPUT_DIR = os.getenv('SERVICE_OUTPUT_DIR', 'service_output')
+
+# Seconds a client refused with 429 is asked to wait before retrying
+RETRY_AFTER = 5
+CHUNK_SIZE = 64 * 1024
+DEFAULT_PROMPT = "Extract all relevant data from this bank statement and return in structured JSON format."
+
+def extract_upload(file_path, output_dir, prompt, bank=None):
+    """Job: run the pipeline on an uploaded file, then delete the upload"""
+    try:
+        return process_to_statement(file_path, output_dir, prompt, bank=bank)
+    finally:
+        try:
+            os.unlink(file_path)
+        except OSError:
+            pass
+
+def job_status(job):
+    """Public view of a job"""
+    events = job.events()
+    return {
+        'id': job.id,
+        'filename': job.name,
+        'state': job.state,
+        'progress': round(job.progress(), 3),
+        'step': {key: value for key, value in events[-1].items() if key != 'time'} if events else None,
+        'submitted': job.submitted,
+        'started': job.started,
+        'finished': job.finished,
+        'elapsed': round(job.elapsed, 3),
+        'error': job.error,
+    }
+
+class ExtractionHandler(BaseHTTPRequestHandler):
+    """Routes for the job API; the server object carries the runner and settings"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text, content_type='text/plain; charset=utf-8'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {'error': message}, headers)
+
+    def refuse_upload(self, status, message, headers=None):
+        """Error response to an upload whose body was not read: the connection cannot be reused"""
+        self.close_connection = True
+        headers = dict(headers or {}, Connection='close')
+        self.send_error_json(status, message, headers)
+
+    def do_GET(self):
+        parts = [part for part in urlsplit(self.path).path.split('/') if part]
+        runner = self.server.runner
+        if parts == ['health']:
+            self.send_json(200, {
+                'status': 'ok',
+                'workers': runner.max_workers,
+                'active': runner.active(),
+                'queue_size': runner.max_pending,
+            })
+            return
+        if parts == ['metrics']:
+            if not instrumentation.enabled():
+                self.send_error_json(404, "Metrics are off, start the service with METRICS=true")
+            else:
+                self.send_text(200, instrumentation.prometheus_text(instrumentation.current_totals()),
+                               'text/plain; version=0.0.4; charset=utf-8')
+            return
+        if len(parts) not in (2, 3) or parts[0] != 'jobs' or (len(parts) == 3 and parts[2] != 'result'):
+            self.send_error_json(404, f"No route for {self.path}")
+            return
+        job = runner.get(parts[1])
+        if job is None:
+            self.send_error_json(404, f"Unknown job {parts[1]}")
+        elif len(parts) == 2:
+            self.send_json(200, job_status(job))
+        elif job.state not in FINISHED_STATES:
+            self.send_json(409, {'error': 'Job not finished', **job_status(job)})
+        elif job.state == 'failed':
+            self.send_json(422, {'error': job.error, **job_status(job)})
+        else:
+            self.send_json(200, job.result)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') != '/jobs':
+            self.refuse_upload(404, f"No route for {self.path}")
+            return
+        query = parse_qs(url.query)
+        filename = os.path.basename(query.get('filename', [''])[0])
+        if not (is_image_file(filename) or is_pdf_file(filename)):
+            self.refuse_upload(415, "Pass ?filename= with an image or PDF extension")
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.refuse_upload(411, "Content-Length required")
+            return
+        if length > self.server.max_upload_bytes:
+            self.refuse_upload(413, f"Upload larger than {self.server.max_upload_bytes} bytes")
+            return
+        runner = self.server.runner
+        # Cheap check before taking the upload; submit checks again atomically
+        if runner.max_pending is not None and runner.active() >= runner.max_pending:
+            self.refuse_upload(429, "Too many jobs queued, retry later", {'Retry-After': RETRY_AFTER})
+            return
+
+        upload_path = Path(self.server.upload_dir) / f"{uuid.uuid4().hex}_{filename}"
+        if not self.receive_file(upload_path, length):
+            return
+
+        try:
+            job_id = runner.submit(extract_upload, str(upload_path), self.server.output_dir,
+                                   query.get('prompt', [DEFAULT_PROMPT])[0], query.get('bank', [None])[0],
+                                   name=filename)
+        except QueueFull as e:
+            upload_path.unlink(missing_ok=True)
+            self.send_error_json(429, str(e), {'Retry-After': RETRY_AFTER})
+            return
+        self.send_json(202, {'id': job_id, 'status_url': f"/jobs/{job_id}", 'result_url': f"/jobs/{job_id}/result"},
+                       {'Location': f"/jobs/{job_id}"})
+
+    def receive_file(self, path, length):
+        """Stream the request body to disk in chunks; False (response sent) when it ends early"""
+        remaining = length
+        try:
+            with open(path, 'wb') as upload:
+                while remaining:
+                    chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    upload.write(chunk)
+                    remaining -= len(chunk)
+        except OSError as e:
+            path.unlink(missing_ok=True)
+            self.refuse_upload(500, f"Could not store the upload: {e}")
+            return False
+        if remaining:
+            path.unlink(missing_ok=True)
+            self.refuse_upload(400, f"Upload ended {remaining} bytes short of Content-Length")
+            return False
+        return True
+
+    def log_message(self, format, *args):
+        print(f"🌐 {self.address_string()} {format % args}")
+
+def create_server(host=SERVICE_HOST, port=SERVICE_PORT, workers=SERVICE_WORKERS, queue_size=SERVICE_QUEUE_SIZE,
+                  upload_dir=SERVICE_UPLOAD_DIR, output_dir=SERVICE_OUTPUT_DIR, max_upload_mb=SERVICE_MAX_UPLOAD_MB):
+    """HTTP server with a warmed-up worker pool (OCR engine, tokenizer and Gemini client loaded)"""
+    ensure_api_key()
+    os.makedirs(upload_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    warm_up_resources()
+    runner = JobRunner(max_workers=workers, initializer=warm_up_page_ocr, max_pending=queue_size)
+    runner.warm_up()
+
+    server = ThreadingHTTPServer((host, port), ExtractionHandler)
+    server.daemon_threads = True
+    server.runner = runner
+    server.upload_dir = upload_dir
+    server.output_dir = output_dir
+    server.max_upload_bytes = int(max_upload_mb * 1024 * 1024)
+    return server
+
+def serve(server):
+    host, port = server.server_address[:2]
+    print(f"🚀 Extraction service on http://{host}:{port} "
+          f"({server.runner.max_workers} workers, queue of {server.runner.max_pending})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        server.server_close()
+        server.runner.shutdown(wait=False)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Headless HTTP service for bank statement extraction")
+    parser.add_argument("--host", default=SERVICE_HOST, help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Documents processed concurrently")
+    parser.add_argument("--queue-size", type=int, default=SERVICE_QUEUE_SIZE,
+                        help="Jobs queued or running before uploads get a 429")
+    parser.add_argument("--fake-llm", action="store_true",
+                        help="Answer Gemini requests locally with empty statements (no API key or network)")
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="Seconds per fake Gemini answer")
+    args = parser.parse_args()
+
+    if args.fake_llm:
+        set_client(GeminiClient(transport=FakeTransport(args.fake_latency)))
+    serve(create_server(args.host, args.port, args.workers, args.queue_size))
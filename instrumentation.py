@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Per-stage instrumentation of the pipeline
+When METRICS is on, every measured call (deskew, OCR, PDF rendering, token
+limiting, Gemini) appends one JSON line to METRICS_DIR/metrics.jsonl with its
+wall and CPU time, memory, and details such as image size, word count or
+token counts. Per-stage totals are exported in the Prometheus text format.
+When off, a measured call costs a single flag check.
+
+Run as a script to rebuild the Prometheus file of a run from the JSON lines:
+    python instrumentation.py [--run RUN_ID | --all]
+"""
+
+import contextvars
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Load environment variables
+load_dotenv()
+
+METRICS = os.getenv('METRICS', 'false').lower() in ('1', 'true', 'yes')
+METRICS_DIR = os.getenv('METRICS_DIR', 'metrics')
+JSONL_NAME = 'metrics.jsonl'
+PROMETHEUS_NAME = 'metrics.prom'
+PROMETHEUS_PREFIX = 'bankocr'
+
+# Numeric record fields summed per stage in the Prometheus export
+SUMMED_FIELDS = ('pixels', 'words', 'prompt_tokens', 'output_tokens')
+
+# Page the current thread is working on, added to every record it makes
+current_page = contextvars.ContextVar('metrics_page', default=None)
+
+_state = {'enabled': METRICS, 'dir': METRICS_DIR, 'run': os.getenv('METRICS_RUN') or uuid.uuid4().hex[:12]}
+_lock = threading.Lock()
+_files = {}
+_totals = {}
+
+def enabled():
+    return _state['enabled']
+
+def enable(directory=None):
+    """
+    Turn recording on, optionally into another directory. The environment
+    is updated too, so worker processes started afterwards record as well.
+    """
+    if directory:
+        _state['dir'] = directory
+    _state['enabled'] = True
+    os.environ['METRICS'] = 'true'
+    os.environ['METRICS_DIR'] = _state['dir']
+
+def disable():
+    _state['enabled'] = False
+
+def run_id():
+    """ID stamped on the records of this run"""
+    return _state['run']
+
+def start_run():
+    """
+    Start a new run ID, also passed through the environment so worker
+    processes stamp their records with it
+    """
+    _state['run'] = uuid.uuid4().hex[:12]
+    os.environ['METRICS_RUN'] = _state['run']
+    with _lock:
+        _totals.clear()
+    return _state['run']
+
+def memory_mb():
+    """(current RSS, peak RSS) of this process in MB; None where the platform cannot tell"""
+    current = peak = None
+    try:
+        with open('/proc/self/statm') as statm:
+            current = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is not None:
+        # ru_maxrss is in KB on Linux, in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+    return current, peak
+
+def jsonl_path(directory=None):
+    return os.path.join(directory or _state['dir'], JSONL_NAME)
+
+def _append(entry):
+    """Write one record as a single line; each process keeps its own append handle"""
+    line = json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+    with _lock:
+        key = (os.getpid(), _state['dir'])
+        handle = _files.get(key)
+        if handle is None:
+            os.makedirs(_state['dir'], exist_ok=True)
+            handle = _files[key] = open(jsonl_path(), 'a', encoding='utf-8')
+        handle.write(line)
+        handle.flush()
+        add_to_totals(_totals, entry)
+
+def record(stage, wall, cpu, fields, error=None):
+    """Store one measurement with the memory of the process at its end"""
+    rss, peak = memory_mb()
+    entry = {
+        'ts': round(time.time(), 3),
+        'run': _state['run'],
+        'pid': os.getpid(),
+        'stage': stage,
+        'page': fields.pop('page', None) or current_page.get(),
+        'wall_s': round(wall, 6),
+        'cpu_s': round(cpu, 6),
+        'rss_mb': None if rss is None else round(rss, 1),
+        'peak_rss_mb': None if peak is None else round(peak, 1),
+    }
+    entry.update(fields)
+    if error:
+        entry['error'] = error
+    _append(entry)
+
+class measure:
+    """
+    Context manager measuring a block as one stage. It yields a dict for
+    details only known at the end (e.g. token counts); CPU time is the
+    calling thread's, so work done in subprocesses is not included.
+    """
+    __slots__ = ('stage', 'fields', 'wall', 'cpu')
+
+    def __init__(self, stage, **fields):
+        self.stage = stage
+        self.fields = fields
+        self.wall = None
+
+    def __enter__(self):
+        if _state['enabled']:
+            self.wall = time.perf_counter()
+            self.cpu = time.thread_time()
+        return self.fields
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.wall is not None:
+            record(self.stage, time.perf_counter() - self.wall, time.thread_time() - self.cpu, self.fields,
+                   exc_type.__name__ if exc_type else None)
+        return False
+
+class page_scope:
+    """Attribute the records made inside the block to a page"""
+    __slots__ = ('page', 'token')
+
+    def __init__(self, page):
+        self.page = page
+
+    def __enter__(self):
+        self.token = current_page.set(self.page)
+
+    def __exit__(self, exc_type, exc, tb):
+        current_page.reset(self.token)
+        return False
+
+def instrumented(stage, fields=None):
+    """
+    Decorator measuring every call of a function as stage. fields(result,
+    *args, **kwargs) returns details for the record and is only called
+    when recording is on.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return func(*args, **kwargs)
+            with measure(stage) as details:
+                result = func(*args, **kwargs)
+                if fields is not None:
+                    try:
+                        details.update(fields(result, *args, **kwargs))
+                    except Exception as e:
+                        details['fields_error'] = str(e)
+                return result
+        return wrapper
+    return decorate
+
+def image_fields(image):
+    """Size details of an image array (nothing for a path)"""
+    shape = getattr(image, 'shape', None)
+    if shape is None:
+        return {}
+    return {'width': shape[1], 'height': shape[0], 'pixels': shape[0] * shape[1]}
+
+def add_to_totals(totals, entry):
+    """Fold one record into per-stage totals"""
+    stage = totals.setdefault(entry['stage'], {'calls': 0, 'errors': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'wall_max_s': 0.0,
+                                               'peak_rss_mb': 0.0, **{field: 0 for field in SUMMED_FIELDS}})
+    stage['calls'] += 1
+    stage['errors'] += 1 if entry.get('error') else 0
+    stage['wall_s'] += entry['wall_s']
+    stage['cpu_s'] += entry['cpu_s']
+    stage['wall_max_s'] = max(stage['wall_max_s'], entry['wall_s'])
+    stage['peak_rss_mb'] = max(stage['peak_rss_mb'], entry.get('peak_rss_mb') or 0.0)
+    for field in SUMMED_FIELDS:
+        value = entry.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            stage[field] += value
+    return totals
+
+def current_totals():
+    """Per-stage totals of the records made by this process in the current run"""
+    with _lock:
+        return json.loads(json.dumps(_totals))
+
+def read_records(path=None, run=None):
+    """Records of a JSON lines file, only those of one run when given"""
+    records = []
+    with open(path or jsonl_path(), encoding='utf-8') as jsonl:
+        for line in jsonl:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a killed process
+                continue
+            if run is None or entry.get('run') == run:
+                records.append(entry)
+    return records
+
+def aggregate(records):
+    totals = {}
+    for entry in records:
+        add_to_totals(totals, entry)
+    return totals
+
+def prometheus_text(totals):
+    """Per-stage totals in the Prometheus text exposition format"""
+    metrics = [
+        ('stage_calls_total', 'counter', 'Measured calls per pipeline stage', 'calls', 1),
+        ('stage_errors_total', 'counter', 'Calls that raised, per pipeline stage', 'errors', 1),
+        ('stage_wall_seconds_total', 'counter', 'Wall time per pipeline stage', 'wall_s', 1),
+        ('stage_cpu_seconds_total', 'counter', 'CPU time of the calling thread per pipeline stage', 'cpu_s', 1),
+        ('stage_wall_seconds_max', 'gauge', 'Slowest call per pipeline stage', 'wall_max_s', 1),
+        ('stage_peak_rss_bytes', 'gauge', 'Peak process RSS seen at the end of a stage', 'peak_rss_mb', 2**20),
+        ('stage_pixels_total', 'counter', 'Image pixels handled per pipeline stage', 'pixels', 1),
+        ('stage_words_total', 'counter', 'Words produced per pipeline stage', 'words', 1),
+        ('stage_prompt_tokens_total', 'counter', 'Prompt tokens sent per pipeline stage', 'prompt_tokens', 1),
+        ('stage_output_tokens_total', 'counter', 'Output tokens received per pipeline stage', 'output_tokens', 1),
+    ]
+    lines = []
+    for name, kind, help_text, field, scale in metrics:
+        samples = [(stage, values[field] * scale) for stage, values in sorted(totals.items()) if values[field]]
+        if not samples and field not in ('calls', 'wall_s'):
+            continue
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+        for stage, value in samples:
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}{{stage="{stage}"}} {round(value) if scale != 1 else round(value, 6)}')
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(run=None, directory=None):
+    """
+    Rebuild the Prometheus file from the JSON lines of a run (default: the
+    current one, all runs with run='all'), which also covers the records of
+    worker processes. Returns (path, totals), or (None, {}) without records.
+    """
+    directory = directory or _state['dir']
+    if not os.path.exists(jsonl_path(directory)):
+        return None, {}
+    totals = aggregate(read_records(jsonl_path(directory), None if run == 'all' else (run or _state['run'])))
+    path = os.path.join(directory, PROMETHEUS_NAME)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{PROMETHEUS_NAME}.", suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as prom:
+        prom.write(prometheus_text(totals))
+    os.replace(temp_path, path)
+    return path, totals
+
+def format_totals(totals):
+    """One line per stage, slowest first"""
+    lines = []
+    for stage, values in sorted(totals.items(), key=lambda item: -item[1]['wall_s']):
+        line = (f"{stage}: {values['calls']} calls, {values['wall_s']:.2f}s wall, {values['cpu_s']:.2f}s CPU, "
+                f"max {values['wall_max_s']:.2f}s")
+        if values['prompt_tokens'] or values['output_tokens']:
+            line += f", {values['prompt_tokens']} prompt / {values['output_tokens']} output tokens"
+        if values['words']:
+            line += f", {values['words']} words"
+        lines.append(line)
+    return lines
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export pipeline metrics in the Prometheus text format")
+    parser.add_argument("--dir", default=METRICS_DIR, help="Directory holding metrics.jsonl")
+    parser.add_argument("--run", help="Run ID to export (default: the last run in the file)")
+    parser.add_argument("--all", action="store_true", help="Export every run in the file")
+    args = parser.parse_args()
+
+    run = 'all' if args.all else args.run
+    if run is None and os.path.exists(jsonl_path(args.dir)):
+        records = read_records(jsonl_path(args.dir))
+        run = records[-1]['run'] if records else None
+    path, totals = write_prometheus(run, args.dir)
+    if path is None:
+        print(f"No metrics found in {jsonl_path(args.dir)}")
+    else:
+        print(f"Run {run}: {sum(values['calls'] for values in totals.values())} records")
+        for line in format_totals(totals):
+            print(f"  - {line}")
+        print(f"Prometheus metrics written to {path}")
@@ -0,0 +1,143 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from main import progress_listener
+from gemini_client import get_client
+from tokenizer import get_encoding
+
+# Events that close a stage for a page (see main.report_progress)
+OCR_DONE_STAGES = ('text_layer', 'ocr', 'skipped')
+PARSE_DONE_STAGES = ('parse', 'skipped', 'failed')
+FINISHED_STATES = ('done', 'failed')
+
+class QueueFull(Exception):
+    """Raised by JobRunner.submit when max_pending jobs are already queued or running"""
+
+def warm_up_resources():
+    """Create the tokenizer and the Gemini client once per process, before the first job needs them"""
+    for name, load in (('tokenizer', get_encoding), ('Gemini client', get_client)):
+        try:
+            load()
+        except Exception as e:
+            print(f"Warning: Could not preload the {name}: {e}")
+
+class Job:
+    """One submitted piece of work: its state, pipeline events and result"""
+
+    def __init__(self, job_id, name=None):
+        self.id = job_id
+        self.name = name
+        self.state = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._events = []
+        self._lock = threading.Lock()
+
+    def add_event(self, event):
+        """Progress listener: record a pipeline event with its time"""
+        event['time'] = time.time()
+        with self._lock:
+            self._events.append(event)
+
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    @property
+    def elapsed(self):
+        """Seconds spent running, so far or in total"""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def progress(self):
+        """
+        Fraction of the work done, counting half for the pages OCR'd and half
+        for the pages parsed (or the Gemini calls made, in document mode)
+        """
+        if self.state in FINISHED_STATES:
+            return 1.0
+        events = self.events()
+        pages = next((event['pages'] for event in events if event['stage'] == 'start'), 0)
+        if not pages:
+            return 0.0
+        ocr_done = {event.get('page') for event in events if event['stage'] in OCR_DONE_STAGES}
+        parsed = {event.get('page') for event in events if event['stage'] in PARSE_DONE_STAGES}
+        calls = [event for event in events if event['stage'] == 'llm']
+        parse_fraction = calls[-1]['call'] / calls[-1]['calls'] if calls else len(parsed) / pages
+        return min(0.99, 0.5 * min(len(ocr_done) / pages, 1.0) + 0.5 * min(parse_fraction, 1.0))
+
+class JobRunner:
+    """
+    Thread pool running jobs in the background. Each job gets an ID to look
+    it up by and collects the progress events the pipeline reports while it
+    runs. With max_pending, submit refuses work once that many jobs are
+    queued or running. The last `keep` finished jobs are kept.
+    """
+
+    def __init__(self, max_workers=2, initializer=None, keep=100, max_pending=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job',
+                                        initializer=initializer)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, name=None, **kwargs):
+        """Queue fn(*args, **kwargs) and return the job ID; raises QueueFull when max_pending is reached"""
+        job = Job(uuid.uuid4().hex[:12], name)
+        with self._lock:
+            if self.max_pending is not None and self._pending() >= self.max_pending:
+                raise QueueFull(f"{self.max_pending} jobs already queued or running")
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        """The job with this ID, or None when unknown or forgotten"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self):
+        """Number of jobs queued or running"""
+        with self._lock:
+            return self._pending()
+
+    def warm_up(self):
+        """Start every worker thread now, so each runs its initializer before the first real job"""
+        barrier = threading.Barrier(self.max_workers)
+        futures = [self._pool.submit(barrier.wait) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+
+    def _pending(self):
+        return sum(1 for job in self._jobs.values() if job.state not in FINISHED_STATES)
+
+    def _run(self, job, fn, args, kwargs):
+        job.state = 'running'
+        job.started = time.time()
+        token = progress_listener.set(job.add_event)
+        try:
+            job.result = fn(*args, **kwargs)
+            job.state = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.state = 'failed'
+        finally:
+            progress_listener.reset(token)
+            job.finished = time.time()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -1,70 +1,535 @@
 import os
+import contextvars
 import json
+import tempfile
+import time
+from pathlib import Path
 import cv2
+import numpy as np
 from dotenv import load_dotenv
-from preprocess import correct_skew
-from extract_ocr import extract_text_ocr
-from parse_with_LLM import parse_with_gemini
-from extract_pdf import pdf_to_images, is_pdf_file, is_image_file, get_file_type
+from preprocess import correct_skew, text_regions, estimate_x_height, DESKEW_STATS
+from extract_ocr import extract_text_ocr, get_ocr_backend, warm_up_ocr
+from parse_with_LLM import parse_with_gemini, SYSTEM_PROMPT, RESPONSE_FORMAT, MAX_CONTINUATIONS
+from template_parser import parse_with_template, get_template
+from page_classifier import classify_image, classify_text
+from document_merge import chunk_pages, chunk_text, merge_statements, PAGE_MARKER
+from ocr_profile import ocr_profile, profile_config, rescale_factor, rescale_page
+from gemini_client import get_client
+from result_cache import get_cache, cache_stats, diff_stats, ocr_key, llm_key
+from instrumentation import page_scope
+from extract_pdf import iter_pdf_pages, prefetch, extract_text_layer, pdf_page_count, is_pdf_file, is_image_file, get_file_type
 
 # Load environment variables
 load_dotenv()
 
+# Skew estimator used for every page (see preprocess.SKEW_ESTIMATORS)
+SKEW_METHOD = os.getenv('SKEW_METHOD', 'coarse_to_fine')
+# Pages straight within this many degrees skip deskewing (0 disables)
+SKEW_SKIP_TOLERANCE = float(os.getenv('SKEW_SKIP_TOLERANCE', '0.5'))
+# Write deskewed pages to corrected_images/ for debugging
+SAVE_CORRECTED_IMAGES = os.getenv('SAVE_CORRECTED_IMAGES', 'false').lower() in ('1', 'true', 'yes')
+# Read digital PDF pages from their text layer instead of rasterizing and OCR'ing them
+PDF_TEXT_LAYER = os.getenv('PDF_TEXT_LAYER', 'true').lower() in ('1', 'true', 'yes')
+# Rasterization of scanned PDF pages, rendered in memory in grayscale
+PDF_RENDER_DPI = int(os.getenv('PDF_RENDER_DPI', '300'))
+# Pages rendered ahead in a background thread while the current one is OCR'd (0 disables)
+PDF_PREFETCH_PAGES = int(os.getenv('PDF_PREFETCH_PAGES', '1'))
+# Page text sent to the LLM: table rows with tab or pipe separated cells (tsv, pipe)
+# or space-padded lines (spaces)
+TEXT_LAYOUT = os.getenv('TEXT_LAYOUT', 'tsv')
+# Parse known bank layouts locally, calling Gemini only below this confidence
+TEMPLATE_PARSER = os.getenv('TEMPLATE_PARSER', 'true').lower() in ('1', 'true', 'yes')
+TEMPLATE_MIN_CONFIDENCE = float(os.getenv('TEMPLATE_MIN_CONFIDENCE', '0.8'))
+# Page classification: off, text (blank check before OCR, bank and page type from
+# the OCR text) or header (also OCR the page header first, so terms pages skip full OCR)
+PAGE_CLASSIFIER = os.getenv('PAGE_CLASSIFIER', 'text')
+# Page types that are never sent to a parser
+SKIP_PAGE_TYPES = {t.strip() for t in os.getenv('SKIP_PAGE_TYPES', 'blank,terms').split(',') if t.strip()}
+# OCR only the detected text regions: off (whole page), mosaic (crops packed into
+# one image, one Tesseract call) or crops (one Tesseract call per region)
+OCR_ROI = os.getenv('OCR_ROI', 'mosaic')
+# Tesseract language(s) of the OCR profile
+OCR_LANG = os.getenv('OCR_LANG', 'fra')
+# Pages are rescaled so their text reaches this x-height in pixels, e.g. 20 for
+# low-resolution scans (0, the default, OCRs pages at their own resolution)
+OCR_TARGET_X_HEIGHT = float(os.getenv('OCR_TARGET_X_HEIGHT', '0'))
+# Parse a PDF as one statement (one JSON, pages batched into few Gemini calls)
+# instead of one JSON and one call per page
+DOCUMENT_MODE = os.getenv('DOCUMENT_MODE', 'false').lower() in ('1', 'true', 'yes')
+# Input tokens of page text per Gemini call in document mode, and its output limit
+DOCUMENT_TOKEN_BUDGET = int(os.getenv('DOCUMENT_TOKEN_BUDGET', '6000'))
+DOCUMENT_MAX_OUTPUT_TOKENS = int(os.getenv('DOCUMENT_MAX_OUTPUT_TOKENS', '8192'))
+
 def ensure_api_key():
     """
-    Ensure the Gemini API key is set.
+    Ensure the Gemini API key is set (unless the client runs on the fake transport).
     """
-    if "GEMINI_API_KEY" not in os.environ:
+    if "GEMINI_API_KEY" not in os.environ and get_client().needs_api_key:
         raise ValueError("GEMINI_API_KEY not found in environment variables. Please set it in your .env file.")
 
-def process_single_image(image_path, output_dir, prompt, add_spaces=True):
-    """Process a single image file"""
+# Called with one event dict (stage, page, ...) per pipeline step of the job
+# running in the current context, e.g. to stream progress to the web app
+progress_listener = contextvars.ContextVar('progress_listener', default=None)
+
+def report_progress(stage, **details):
+    """Send a pipeline event to the current progress listener, if any"""
+    listener = progress_listener.get()
+    if listener is not None:
+        listener(dict(details, stage=stage))
+
+def add_timing(timings, stage, seconds):
+    """Accumulate seconds spent in a pipeline stage"""
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+def ocr_image(image, add_spaces=True, page_name=None, output_dir=None, save_corrected=None, timings=None,
+              bank=None, page_info=None):
+    """
+    Deskew and OCR one page held in memory, returning the layout text.
+    Blank pages (and, with header classification, terms pages) are skipped
+    and come back as an empty string. The OCR choices made for the page
+    (profile, x-height, scale) are recorded in page_info['ocr'].
+    """
+    if PAGE_CLASSIFIER != 'off':
+        start = time.perf_counter()
+        page = classify_image(image, bank, read_header=PAGE_CLASSIFIER == 'header')
+        add_timing(timings, 'classify', time.perf_counter() - start)
+        if page['page_type'] in SKIP_PAGE_TYPES:
+            print(f"Skipped {page['page_type']} page {page_name or ''}".rstrip())
+            report_progress('skipped', page=page_name, page_type=page['page_type'])
+            return ""
+
+    start = time.perf_counter()
+    angle, corrected_image, *mask = correct_skew(image, method=SKEW_METHOD, skip_tolerance=SKEW_SKIP_TOLERANCE,
+                                                 return_mask=OCR_ROI != 'off' or OCR_TARGET_X_HEIGHT > 0)
+    add_timing(timings, 'deskew', time.perf_counter() - start)
+    report_progress('deskew', page=page_name, angle=angle)
+    if corrected_image is image:
+        print("Page already straight, skipped deskew")
+    else:
+        print(f"Corrected skew angle: {angle}")
+
+    if save_corrected is None:
+        save_corrected = SAVE_CORRECTED_IMAGES
+    if save_corrected and output_dir and page_name:
+        corrected_image_dir = os.path.join(output_dir, 'corrected_images')
+        os.makedirs(corrected_image_dir, exist_ok=True)
+
+        corrected_image_path = os.path.join(corrected_image_dir, f"corrected_{page_name}")
+        cv2.imwrite(corrected_image_path, corrected_image)
+        print(f"Corrected image saved to {corrected_image_path}")
+
+    regions = None
+    if OCR_ROI != 'off':
+        start = time.perf_counter()
+        regions = text_regions(mask[0])
+        add_timing(timings, 'roi', time.perf_counter() - start)
+
+    x_height, scale = 0.0, 1.0
+    if OCR_TARGET_X_HEIGHT > 0:
+        start = time.perf_counter()
+        x_height = estimate_x_height(mask[0])
+        scale = rescale_factor(x_height, OCR_TARGET_X_HEIGHT, corrected_image.shape)
+        corrected_image, regions = rescale_page(corrected_image, regions, scale)
+        add_timing(timings, 'rescale', time.perf_counter() - start)
+
+    # Hand the deskewed buffer straight to Tesseract, no JPEG round-trip
+    start = time.perf_counter()
+    config = profile_config(ocr_profile(OCR_LANG))
+    extracted_text = extract_text_ocr(corrected_image, add_spaces, max_tokens=16000, layout=TEXT_LAYOUT,
+                                      config=config, regions=regions, roi_mode=OCR_ROI)
+    add_timing(timings, 'ocr', time.perf_counter() - start)
+    report_progress('ocr', page=page_name)
+    if page_info is not None:
+        page_info['ocr'] = {
+            'config': config,
+            'x_height': round(x_height, 1),
+            'scale': round(scale, 3),
+            'size': [corrected_image.shape[1], corrected_image.shape[0]],
+        }
+    return extracted_text
+
+def warm_up_page_ocr():
+    """
+    Load the OCR engine with the options pages are OCR'd with (a pool
+    initializer), so the first page of each worker does not pay for it
+    """
+    return warm_up_ocr(profile_config(ocr_profile(OCR_LANG)))
+
+def ocr_settings(add_spaces):
+    """Every setting that changes the OCR text, part of the OCR cache key"""
+    return {
+        'skew_method': SKEW_METHOD,
+        'skew_skip_tolerance': SKEW_SKIP_TOLERANCE,
+        'add_spaces': add_spaces,
+        'layout': TEXT_LAYOUT,
+        'max_tokens': 16000,
+        'page_classifier': PAGE_CLASSIFIER,
+        'skip_page_types': sorted(SKIP_PAGE_TYPES),
+        'roi': OCR_ROI,
+        'ocr_backend': get_ocr_backend().name,
+        'ocr_profile': ocr_profile(OCR_LANG),
+        'target_x_height': OCR_TARGET_X_HEIGHT,
+    }
+
+def cached_ocr(source, settings, page_name, compute, page_info=None):
+    """
+    Return cached OCR text for source+settings, or compute and store it.
+    The page_info filled by compute is cached with the text and restored on a hit.
+    """
+    page_info = {} if page_info is None else page_info
+    cache = get_cache()
+    key = ocr_key(source, settings)
+    if cache:
+        cached = cache.get_json('ocr', key)
+        if cached is not None:
+            print(f"OCR cache hit for {page_name}")
+            report_progress('ocr', page=page_name, cached=True)
+            page_info.update(cached['page_info'])
+            return cached['text']
+
+    with page_scope(page_name):
+        extracted_text = compute(page_info)
+    if cache and extracted_text is not None:
+        cache.put_json('ocr', key, {'text': extracted_text, 'page_info': page_info})
+    return extracted_text
+
+def ocr_image_file(image_path, add_spaces=True, output_dir=None, save_corrected=None, timings=None, bank=None,
+                   page_info=None):
+    """
+    Read a page image from disk and OCR it, reusing the cached text when the
+    same image was already OCR'd with the same settings.
+    Returns None if the image cannot be read.
+    """
     try:
-        image = cv2.imread(image_path)
+        with open(image_path, 'rb') as img_file:
+            image_bytes = img_file.read()
+    except OSError as e:
+        print(f"Error reading image: {e}")
+        return None
+
+    page_name = os.path.basename(image_path)
+
+    def compute(info):
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
         if image is None:
             print(f"Error: Could not read image {image_path}")
             return None
-    except Exception as e:
-        print(f"Error reading image: {e}")
-        return None
+        return ocr_image(image, add_spaces, page_name, output_dir, save_corrected, timings, bank, info)
+
+    return cached_ocr(image_bytes, ocr_settings(add_spaces), page_name, compute, page_info)
 
-    angle, corrected_image = correct_skew(image)
-    print(f"Corrected skew angle: {angle}")
+def ocr_page_array(image, page_name, add_spaces=True, output_dir=None, save_corrected=None, timings=None,
+                   bank=None, page_info=None):
+    """OCR a page already in memory (e.g. a rendered PDF page), with caching on its pixels"""
+    image = np.ascontiguousarray(image)
+    settings = dict(ocr_settings(add_spaces), shape=list(image.shape))
+    return cached_ocr(image, settings, page_name,
+                      lambda info: ocr_image(image, add_spaces, page_name, output_dir, save_corrected, timings,
+                                             bank, info),
+                      page_info)
 
-    corrected_image_dir = os.path.join(output_dir, 'corrected_images')
-    os.makedirs(corrected_image_dir, exist_ok=True)
+def parse_locally(extracted_text, timings=None, bank=None, page_info=None):
+    """
+    Classify a page and parse it with its bank template. Returns the page's
+    JSON when no LLM call is needed (skipped page or confident template
+    parse), else None, together with the page classification.
+    """
+    page = None
+    if PAGE_CLASSIFIER != 'off':
+        start = time.perf_counter()
+        page = classify_text(extracted_text, bank)
+        add_timing(timings, 'classify', time.perf_counter() - start)
+        bank = page['bank']
+        if page['page_type'] in SKIP_PAGE_TYPES:
+            print(f"Skipped {page['page_type']} page, nothing to parse")
+            return with_page_info(skipped_page(page), page, page_info), page
 
-    corrected_image_path = os.path.join(corrected_image_dir, f"corrected_{os.path.basename(image_path)}")
-    cv2.imwrite(corrected_image_path, corrected_image)
-    print(f"Corrected image saved to {corrected_image_path}")
+    if TEMPLATE_PARSER:
+        start = time.perf_counter()
+        parsed = parse_with_template(extracted_text, bank, TEMPLATE_MIN_CONFIDENCE)
+        add_timing(timings, 'template', time.perf_counter() - start)
+        if parsed is not None:
+            print(f"Parsed with the {parsed['processing_info']['template']} template "
+                  f"(confidence {parsed['processing_info']['confidence']:.2f})")
+            return with_page_info(parsed, page, page_info), page
+    return None, page
 
-    with open(corrected_image_path, 'rb') as img_file:
-        extracted_text = extract_text_ocr(img_file, add_spaces, max_tokens=16000)
+def parse_with_llm(extracted_text, prompt, timings=None, max_tokens=5000):
+    """Send the text with the extraction prompt to Gemini, or reuse a cached answer"""
+    prompt_ending = '\n' if extracted_text[-1] != '\n' else ''
+    full_prompt = prompt + '\n' + extracted_text + prompt_ending
 
-        if not extracted_text.strip():
-            print(f"OCR failed or no text extracted from {image_path}. Skipping...")
-            return None
+    cache = get_cache()
+    settings = {'response_format': RESPONSE_FORMAT, 'max_tokens': max_tokens, 'max_continuations': MAX_CONTINUATIONS}
+    key = llm_key(extracted_text, prompt + '\n' + SYSTEM_PROMPT, get_client().model_name, settings)
+    if cache:
+        cached_response = cache.get_json('llm', key)
+        if cached_response is not None:
+            print("LLM cache hit")
+            return cached_response
+
+    start = time.perf_counter()
+    try:
+        gemini_response = parse_with_gemini(full_prompt, max_tokens)
+    finally:
+        add_timing(timings, 'llm', time.perf_counter() - start)
+
+    # A cut-off answer is not cached, so the next run asks again
+    info = gemini_response.get('processing_info') if isinstance(gemini_response, dict) else None
+    if cache and not (isinstance(info, dict) and info.get('truncated')):
+        cache.put_json('llm', key, gemini_response)
+    return gemini_response
+
+def parse_text(extracted_text, prompt, timings=None, bank=None, page_info=None):
+    """
+    Parse OCR text into statement JSON: with the bank's layout template when
+    it is confident enough, otherwise by sending the text with the extraction
+    prompt to Gemini (or reusing a cached answer). bank is an optional
+    template id such as the dataset directory name; page_info (e.g. the
+    OCR choices) is recorded under processing_info.
+    """
+    parsed, page = parse_locally(extracted_text, timings, bank, page_info)
+    if parsed is not None:
+        return parsed
+    return with_page_info(parse_with_llm(extracted_text, prompt, timings), page, page_info)
+
+def parse_document(pages, prompt, timings=None, bank=None, page_infos=None):
+    """
+    Parse all pages of one statement into a single JSON. Pages the templates
+    handle are parsed locally; the others are concatenated into as few
+    Gemini calls as DOCUMENT_TOKEN_BUDGET allows, split only between pages
+    or transactions, and every part is merged in page order.
+    The bank found on one page is used for the following ones.
+    """
+    page_infos = page_infos or {}
+    parts = []
+    pending = []
+    page_summaries = []
+    for number, (page_name, text) in enumerate(pages, start=1):
+        if not text.strip():
+            print(f"No text extracted from {page_name}. Skipping...")
+            continue
+        parsed, page = parse_locally(text, timings, bank, page_infos.get(page_name))
+        if page is not None and page['bank']:
+            bank = page['bank']
+        if parsed is not None:
+            parts.append(((number, 0), parsed))
+            page_summaries.append({'page': number, 'page_name': page_name, **parsed['processing_info']})
+        else:
+            pending.append((number, text))
+            page_summaries.append({'page': number, 'page_name': page_name, 'parser': 'gemini',
+                                   'page_type': page['page_type'] if page else None,
+                                   **page_infos.get(page_name, {})})
+
+    chunks = chunk_pages(pending, DOCUMENT_TOKEN_BUDGET)
+    for index, chunk in enumerate(chunks):
+        numbers = sorted({number for number, _ in chunk})
+        print(f"Gemini call {index + 1}/{len(chunks)} for page(s) {', '.join(map(str, numbers))}")
+        chunk_prompt = (f"{prompt}\nThe text covers page(s) {', '.join(map(str, numbers))} of one statement, "
+                        f"each page starting with a '{PAGE_MARKER.format('N')}' line.")
+        with page_scope(', '.join(pages[number - 1][0] for number in numbers)):
+            parsed = parse_with_llm(chunk_text(chunk), chunk_prompt, timings, DOCUMENT_MAX_OUTPUT_TOKENS)
+        parts.append(((chunk[0][0], index + 1), parsed))
+        report_progress('llm', call=index + 1, calls=len(chunks), pages=numbers)
+
+    merged = merge_statements([parsed for _, parsed in sorted(parts, key=lambda part: part[0])])
+    merged['processing_info'] = {
+        'parser': 'document',
+        'pages': page_summaries,
+        'llm_calls': len(chunks),
+    }
+    return merged
 
-        prompt_ending = '\n' if extracted_text[-1] != '\n' else ''
-        full_prompt = prompt + '\n' + extracted_text + prompt_ending
+def skipped_page(page):
+    """Output for a page that needs no parsing (blank or terms page)"""
+    template = get_template(page['bank'])[1] if page['bank'] else None
+    return {
+        'bank': template['name'] if template else None,
+        'transactions': [],
+        'processing_info': {'parser': None, 'template': page['bank'], 'page_type': page['page_type']},
+    }
 
+def parser_name(data):
+    """Which parser produced a page's JSON: 'gemini', 'template', or None for a skipped page"""
+    info = data.get('processing_info') if isinstance(data, dict) else None
+    return info.get('parser', 'gemini') if isinstance(info, dict) else 'gemini'
+
+def with_page_info(data, page, page_info=None):
+    """Record the classified page type and the page's OCR info under processing_info"""
+    if (page is not None or page_info) and isinstance(data, dict):
+        info = data.setdefault('processing_info', {})
+        if isinstance(info, dict):
+            info.setdefault('parser', 'gemini')
+            if page is not None:
+                info['page_type'] = page['page_type']
+            info.update(page_info or {})
+    return data
+
+def write_json_atomic(path, data):
+    """
+    Write JSON to a temporary file in the same directory, then rename it over
+    path, so a crash never leaves a half-written file behind
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as json_file:
+            json.dump(data, json_file, indent=4, ensure_ascii=False)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def save_result(page_name, output_dir, data):
+    """Write the parsed JSON for a page next to the other outputs"""
+    output_file_name = f"{os.path.splitext(page_name)[0]}.json"
+    output_file_path = os.path.join(output_dir, output_file_name)
+
+    write_json_atomic(output_file_path, data)
+
+    print(f"Output saved to {output_file_path}")
+    return output_file_path
+
+def process_single_image(image_path, output_dir, prompt, add_spaces=True, save_corrected=None, bank=None):
+    """Process a single image file"""
+    page_name = os.path.basename(image_path)
+    page_info = {}
+    extracted_text = ocr_image_file(image_path, add_spaces, output_dir, save_corrected, bank=bank, page_info=page_info)
+    if extracted_text is None:
+        return None
+
+    if not extracted_text.strip():
+        print(f"OCR failed or no text extracted from {image_path}. Skipping...")
+        report_progress('skipped', page=page_name)
+        return None
+
+    try:
+        with page_scope(page_name):
+            gemini_response = parse_text(extracted_text, prompt, bank=bank, page_info=page_info)
+    except Exception as e:
+        print(f"Error with Gemini API: {e}")
+        report_progress('failed', page=page_name, error=str(e))
+        return None
+
+    report_progress('parse', page=page_name, parser=parser_name(gemini_response))
+    return save_result(page_name, output_dir, gemini_response)
+
+def extract_pdf_pages(file_path, add_spaces=True, output_dir=None, save_corrected=None, timings=None, bank=None,
+                      page_infos=None, skip_pages=None):
+    """
+    Layout text for every page of a PDF. Pages with a usable native text
+    layer are read straight from the PDF's character boxes; only scanned
+    pages are rasterized, deskewed and OCR'd.
+    Returns a list of (page_name, text) in page order. The page_info of each
+    OCR'd page is stored in page_infos under its page name. Pages named in
+    skip_pages (e.g. already done in a resumed batch) are left out.
+    """
+    layer_texts = None
+    if PDF_TEXT_LAYER:
+        start = time.perf_counter()
         try:
-            gemini_response = parse_with_gemini(full_prompt)
+            layer_texts = extract_text_layer(file_path, add_spaces, max_tokens=16000, layout=TEXT_LAYOUT)
         except Exception as e:
-            print(f"Error with Gemini API: {e}")
-            return None
+            print(f"Warning: Could not read PDF text layer: {e}")
+        add_timing(timings, 'text_layer', time.perf_counter() - start)
 
-        base_name = os.path.basename(image_path)
-        output_file_name = f"{os.path.splitext(base_name)[0]}.json"
-        output_file_path = os.path.join(output_dir, output_file_name)
+    base_name = Path(file_path).stem
+    skip_pages = skip_pages or set()
+    if layer_texts is None:
+        scanned = None
+    else:
+        scanned = [i for i, text in enumerate(layer_texts) if text is None]
+        print(f"Text layer used for {len(layer_texts) - len(scanned)}/{len(layer_texts)} pages")
+    if skip_pages:
+        if scanned is None:
+            scanned = list(range(pdf_page_count(file_path)))
+        scanned = [i for i in scanned if f"{base_name}_page_{i + 1}.jpg" not in skip_pages]
 
-        with open(output_file_path, 'w', encoding='utf-8') as json_file:
-            json.dump(gemini_response, json_file, indent=4, ensure_ascii=False)
+    page_texts = {}
+    if layer_texts:
+        for i, text in enumerate(layer_texts):
+            page_name = f"{base_name}_page_{i + 1}.jpg"
+            if text is not None and page_name not in skip_pages:
+                page_texts[i] = (page_name, text)
+                report_progress('text_layer', page=page_name)
 
-        print(f"Output saved to {output_file_path}")
-        return output_file_path
+    if scanned is None or scanned:
+        # Pages stream from the renderer one at a time, the next one rendering while this one is OCR'd
+        rendered = prefetch(iter_pdf_pages(file_path, dpi=PDF_RENDER_DPI, grayscale=True, pages=scanned),
+                            PDF_PREFETCH_PAGES)
+        # Only opening and rendering errors end the loop; OCR errors propagate to the caller
+        try:
+            start = time.perf_counter()
+            while True:
+                try:
+                    i, image = next(rendered)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    print(f"❌ Error converting PDF: {e}")
+                    break
+                add_timing(timings, 'render', time.perf_counter() - start)
+                page_name = f"{base_name}_page_{i + 1}.jpg"
+                print(f"Rendered page {i + 1} ({image.shape[1]}x{image.shape[0]})")
+                report_progress('render', page=page_name)
+                page_info = {}
+                page_texts[i] = (page_name, ocr_page_array(image, page_name, add_spaces, output_dir,
+                                                           save_corrected, timings, bank, page_info))
+                if page_infos is not None:
+                    page_infos[page_name] = page_info
+                start = time.perf_counter()
+        finally:
+            # Stops the renderer thread (and closes the PDF) when a page fails
+            rendered.close()
+
+    return [page_texts[i] for i in sorted(page_texts)]
+
+def extract_file_text(file_path, add_spaces=True, bank=None, output_dir=None, skip_pages=None):
+    """
+    Run the CPU-bound stages (PDF rendering, deskew, OCR) for one file.
+    Returns the OCR text of every page together with the per-page OCR info,
+    per-stage timings, the deskew counters and cache counters, so it can run
+    in a worker process. Pages named in skip_pages are not extracted.
+    """
+    timings = {}
+    page_infos = {}
+    stats_before = dict(DESKEW_STATS)
+    cache_before = cache_stats()
+    pages = []
+    file_type = get_file_type(file_path)
 
-def process_file(file_path, output_dir, prompt, add_spaces=True):
+    if file_type == 'image':
+        page_name = os.path.basename(file_path)
+        if not skip_pages or page_name not in skip_pages:
+            page_infos[page_name] = {}
+            extracted_text = ocr_image_file(file_path, add_spaces, output_dir, timings=timings, bank=bank,
+                                            page_info=page_infos[page_name])
+            if extracted_text is not None:
+                pages.append((page_name, extracted_text))
+
+    elif file_type == 'pdf':
+        pages = extract_pdf_pages(file_path, add_spaces, output_dir, timings=timings, bank=bank,
+                                  page_infos=page_infos, skip_pages=skip_pages)
+
+    else:
+        print(f"Unsupported file type: {file_path}")
+
+    deskew_stats = {key: DESKEW_STATS[key] - stats_before[key] for key in DESKEW_STATS}
+    return {
+        'pages': pages,
+        'page_info': page_infos,
+        'timings': timings,
+        'deskew_stats': deskew_stats,
+        'cache_stats': diff_stats(cache_stats(), cache_before),
+    }
+
+def process_file(file_path, output_dir, prompt, add_spaces=True, bank=None):
     """Process either PDF or image file"""
     ensure_api_key()
     
@@ -72,35 +537,45 @@ def process_file(file_path, output_dir, prompt, add_spaces=True):
     
     if file_type == 'image':
         print(f"Processing image: {os.path.basename(file_path)}")
-        return process_single_image(file_path, output_dir, prompt, add_spaces)
+        report_progress('start', pages=1)
+        return process_single_image(file_path, output_dir, prompt, add_spaces, bank=bank)
     
     elif file_type == 'pdf':
         print(f"Processing PDF: {os.path.basename(file_path)}")
+        report_progress('start', pages=pdf_page_count(file_path))
         
-        # Convert PDF to images
-        temp_image_dir = os.path.join(output_dir, 'temp_pdf_images')
-        os.makedirs(temp_image_dir, exist_ok=True)
-        
-        image_paths = pdf_to_images(file_path, temp_image_dir)
+        page_infos = {}
+        pages = extract_pdf_pages(file_path, add_spaces, output_dir, bank=bank, page_infos=page_infos)
         
-        if not image_paths:
-            print(f"Failed to convert PDF to images: {file_path}")
+        if not pages:
+            print(f"Failed to extract any page from PDF: {file_path}")
             return None
+
+        if DOCUMENT_MODE:
+            try:
+                statement = parse_document(pages, prompt, bank=bank, page_infos=page_infos)
+            except Exception as e:
+                print(f"Error with Gemini API: {e}")
+                return []
+            return [save_result(os.path.basename(file_path), output_dir, statement)]
         
         results = []
-        for i, image_path in enumerate(image_paths):
-            print(f"\nProcessing page {i+1}/{len(image_paths)}")
-            result = process_single_image(image_path, output_dir, prompt, add_spaces)
-            if result:
-                results.append(result)
-        
-        # Clean up temporary images
-        try:
-            import shutil
-            shutil.rmtree(temp_image_dir)
-            print(f"Cleaned up temporary images")
-        except Exception as e:
-            print(f"Warning: Could not clean up temp directory: {e}")
+        for i, (page_name, extracted_text) in enumerate(pages):
+            print(f"\nProcessing page {i+1}/{len(pages)}")
+            if not extracted_text.strip():
+                print(f"No text extracted from {page_name}. Skipping...")
+                report_progress('skipped', page=page_name)
+                continue
+            try:
+                with page_scope(page_name):
+                    gemini_response = parse_text(extracted_text, prompt, bank=bank,
+                                                 page_info=page_infos.get(page_name))
+            except Exception as e:
+                print(f"Error with Gemini API: {e}")
+                report_progress('failed', page=page_name, error=str(e))
+                continue
+            report_progress('parse', page=page_name, parser=parser_name(gemini_response))
+            results.append(save_result(page_name, output_dir, gemini_response))
         
         return results
     
@@ -108,6 +583,22 @@ def process_file(file_path, output_dir, prompt, add_spaces=True):
         print(f"Unsupported file type: {file_path}")
         return None
 
+def process_to_statement(file_path, output_dir, prompt, add_spaces=True, bank=None):
+    """
+    Process a file and return its statement JSON: the JSON of its only page,
+    or the JSONs of a PDF's pages merged into one statement.
+    Raises ValueError when nothing could be extracted.
+    """
+    result = process_file(file_path, output_dir, prompt, add_spaces, bank)
+    if not result:
+        raise ValueError("No data could be extracted from the file")
+
+    statements = []
+    for result_file in (result if isinstance(result, list) else [result]):
+        with open(result_file, 'r', encoding='utf-8') as json_file:
+            statements.append(json.load(json_file))
+    return statements[0] if len(statements) == 1 else merge_statements(statements)
+
 # Keep backward compatibility
 def process_image(image_path, output_dir, prompt, add_spaces=True, ocr=True):
     """Backward compatibility wrapper"""
@@ -0,0 +1,95 @@
+import functools
+import shlex
+import cv2
+from extract_ocr import get_ocr_backend
+
+# Tesseract settings for a page.
+# psm and oem None keep Tesseract's defaults (automatic segmentation, LSTM engine)
+DEFAULT_PROFILE = {
+    'lang': 'fra',
+    'psm': None,
+    'oem': None,
+    # Characters Tesseract may output (tessedit_char_whitelist), None for all
+    'whitelist': None,
+    # Any other options, passed through as is
+    'config': '',
+}
+
+# Tesseract is most accurate around a 20 px x-height (~30 px capitals); pages
+# within these bounds of the target are OCR'd at their own resolution
+X_HEIGHT_TOLERANCE = (0.75, 1.5)
+SCALE_LIMITS = (0.4, 2.0)
+# Pages are never enlarged past this many pixels (an A4 page at 600 DPI)
+MAX_PIXELS = 35_000_000
+
+def ocr_profile(lang=None):
+    """Default profile; lang replaces the default language"""
+    profile = dict(DEFAULT_PROFILE)
+    if lang:
+        profile['lang'] = lang
+    return profile
+
+@functools.lru_cache(maxsize=None)
+def installed_languages():
+    """Languages the OCR engine can load, or None when they cannot be listed"""
+    try:
+        return frozenset(get_ocr_backend().languages())
+    except Exception:
+        return None
+
+@functools.lru_cache(maxsize=None)
+def resolve_lang(lang):
+    """
+    Keep the installed languages of a 'fra+eng' style spec, so a missing
+    traineddata file degrades to another language instead of failing every page
+    """
+    installed = installed_languages()
+    if installed is None:
+        return lang
+    wanted = lang.split('+')
+    available = [code for code in wanted if code in installed]
+    if len(available) < len(wanted):
+        fallback = '+'.join(available) or ('eng' if 'eng' in installed else sorted(installed)[0])
+        print(f"Warning: OCR language {lang} not fully installed, using {fallback}")
+        return fallback
+    return lang
+
+def profile_config(profile):
+    """Tesseract command line options for a profile"""
+    options = ['-l', resolve_lang(profile['lang'])]
+    if profile['psm'] is not None:
+        options += ['--psm', str(profile['psm'])]
+    if profile['oem'] is not None:
+        options += ['--oem', str(profile['oem'])]
+    if profile['whitelist']:
+        options += ['-c', f"tessedit_char_whitelist={profile['whitelist']}"]
+    config = shlex.join(options)
+    return f"{config} {profile['config']}".strip()
+
+def rescale_factor(x_height, target, shape=None):
+    """
+    Scale that brings x_height to target, or 1.0 when it is close enough,
+    unknown (no text) or rescaling is disabled (target 0). Enlarging stops
+    at MAX_PIXELS for a page of the given shape.
+    """
+    if not target or not x_height:
+        return 1.0
+    low, high = X_HEIGHT_TOLERANCE
+    if low * target <= x_height <= high * target:
+        return 1.0
+    scale = min(max(target / x_height, SCALE_LIMITS[0]), SCALE_LIMITS[1])
+    if scale > 1 and shape is not None:
+        scale = max(1.0, min(scale, (MAX_PIXELS / (shape[0] * shape[1])) ** 0.5))
+    return scale
+
+def rescale_page(image, regions, scale):
+    """Resize a page and its text regions by scale"""
+    if scale == 1.0:
+        return image, regions
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation)
+    if regions is not None:
+        h, w = image.shape[:2]
+        regions = [(int(x0 * scale), int(y0 * scale), min(w, int(x1 * scale + 0.5)), min(h, int(y1 * scale + 0.5)))
+                   for x0, y0, x1, y1 in regions]
+    return image, regions
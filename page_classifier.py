@@ -0,0 +1,87 @@
+import re
+import cv2
+import numpy as np
+from extract_ocr import get_ocr_backend
+from template_parser import fold, get_template, identify_bank, split_cells, DATE_RE, AMOUNT_RE
+
+PAGE_TYPES = ('first', 'continuation', 'terms', 'blank')
+
+# Share of ink pixels below which a page is blank (scanner noise is ~1e-5,
+# the emptiest statement pages in the dataset are ~4e-3)
+BLANK_INK_RATIO = 0.001
+
+# Patterns are matched against fold()ed text
+TERMS_RE = re.compile(r"conditions generales|conditions particulieres|mediateur|reclamation|garantie des depots"
+                      r"|donnees personnelles|informations reglementaires|lexique|bareme|tarifs? (?:en vigueur|des)"
+                      r"|capital (?:social|de|variable)|siege social|\brcs\b|controle prudentiel|\bacpr\b")
+CONTINUATION_RE = re.compile(r"\(suite\)|solde reporte|report(?:e)? de solde|a reporter")
+FIRST_PAGE_RE = re.compile(r"\biban\b|\bdu\s+\d{2}[./]\d{2}[./]\d{2,4}\s+au\b|ancien solde|solde au|date d.arrete")
+PAGE_NUMBER_RE = re.compile(r"\bpage\s*(\d+)\s*/\s*\d+|^\s*(\d+)\s*/\s*\d+\s*$", re.MULTILINE)
+BALANCE_RE = re.compile(r"ancien solde|nouveau solde|solde (?:au|en|crediteur|debiteur)")
+
+def ink_ratio(image, scale=0.25):
+    """Share of pixels clearly darker than the paper, on a downsampled grayscale copy"""
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    background = np.median(small)
+    return float(np.mean(small < background - 60))
+
+def is_blank(image):
+    return ink_ratio(image) < BLANK_INK_RATIO
+
+def transaction_lines(text):
+    """Number of lines that look like a transaction: a cell starting with a date and an amount"""
+    count = 0
+    for line in text.splitlines():
+        if not AMOUNT_RE.search(line):
+            continue
+        _, cells = split_cells(line)
+        if any(DATE_RE.match(cell.strip()) for _, cell in cells):
+            count += 1
+    return count
+
+def page_type(folded_text):
+    """
+    first, continuation, terms or blank from a page's (folded) text.
+    Terms pages are boilerplate with legal mentions and no transaction or
+    balance line at all, so a short statement page is never mistaken for one.
+    """
+    if not folded_text.strip():
+        return 'blank'
+    if (len(set(TERMS_RE.findall(folded_text))) >= 2 and not transaction_lines(folded_text)
+            and not BALANCE_RE.search(folded_text)):
+        return 'terms'
+    match = PAGE_NUMBER_RE.search(folded_text)
+    if match:
+        return 'first' if int(match.group(1) or match.group(2)) == 1 else 'continuation'
+    if CONTINUATION_RE.search(folded_text):
+        return 'continuation'
+    return 'first' if FIRST_PAGE_RE.search(folded_text) else 'continuation'
+
+def classify_text(text, bank=None):
+    """
+    Bank template id and page type of a page from its OCR or text-layer
+    text. A known bank hint (e.g. the dataset directory) takes precedence.
+    """
+    folded_text = fold(text)
+    bank_id = get_template(bank)[0] or identify_bank(folded_text)
+    return {'bank': bank_id, 'page_type': page_type(folded_text)}
+
+def header_text(image, fraction=0.25, scale=0.5):
+    """OCR only the top of the page at reduced resolution (letterhead, title, page number)"""
+    height = image.shape[0]
+    crop = image[:max(1, int(height * fraction))]
+    crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return get_ocr_backend().image_to_string(crop)
+
+def classify_image(image, bank=None, read_header=True):
+    """
+    Classify a page image before full OCR: blank pages from their ink
+    coverage alone, otherwise bank and page type from a header-region OCR
+    (page_type None when read_header is False).
+    """
+    if is_blank(image):
+        return {'bank': get_template(bank)[0], 'page_type': 'blank'}
+    if not read_header:
+        return {'bank': get_template(bank)[0], 'page_type': None}
+    return classify_text(header_text(image), bank)
@@ -1,43 +1,23 @@
 import json
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
+from gemini_client import get_client
+from statement_schema import Statement, TransactionList, response_schema, salvage_json, validate_statement
+from document_merge import transaction_blocks
+from instrumentation import measure
 
 # Load environment variables
 load_dotenv()
 
-def handle_json(json_text):
-    """Extract JSON content from text response"""
-    try:
-        # Find the first { and last } to extract JSON
-        start = json_text.find('{')
-        end = json_text.rfind('}') + 1
-        if start != -1 and end != 0:
-            return json_text[start:end]
-        return json_text
-    except Exception as e:
-        print(f"Error handling JSON: {e}")
-        return json_text
-
-def parse_with_gemini(input_text: str, max_tokens: int = 5000) -> dict:
-    """
-    This function utilizes the Gemini model to parse the input text into a JSON format
-    """
-    try:
-        # Configure Gemini API
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
-        
-        genai.configure(api_key=api_key)
-        
-        # Initialize the model
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Create the prompt
-        system_prompt = """You are an expert at extracting structured data from bank statements. 
+# How Gemini is asked to answer: schema (JSON constrained to the Statement
+# schema), json (any JSON) or text (free text, JSON extracted afterwards)
+RESPONSE_FORMAT = os.getenv('GEMINI_RESPONSE_FORMAT', 'schema')
+# Follow-up requests for the rest of an answer cut off by the output token limit
+MAX_CONTINUATIONS = int(os.getenv('GEMINI_MAX_CONTINUATIONS', '4'))
+
+SYSTEM_PROMPT = """You are an expert at extracting structured data from bank statements.
         Extract all relevant information from the following bank statement text and return it in a well-structured JSON format.
-        
+
         Include the following fields when available:
         - bank: Bank name
         - statement_date: Date of the statement
@@ -47,36 +27,176 @@ def parse_with_gemini(input_text: str, max_tokens: int = 5000) -> dict:
         - client_info: Customer information (name, address)
         - account_details: Account details (IBAN, BIC, balance, etc.)
         - transactions: Array of transactions with date, description, debit, credit amounts
-        
+
+        Tables may be given as rows of cells separated by tabs or " | ", one cell per column of the
+        header row. Empty cells are kept, so use each amount's position to tell debit, credit and balance apart.
+
         Return only valid JSON without any additional text or formatting."""
-        
-        full_prompt = f"{system_prompt}\n\nBank Statement Text:\n{input_text}"
-        
-        # Generate response
-        response = model.generate_content(
-            full_prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.0,
-                max_output_tokens=max_tokens,
-            )
-        )
-        
-        # Extract and parse JSON
-        response_text = response.text
-        json_text = handle_json(response_text)
-        data = json.loads(json_text)
-        
-        return data
-        
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {e}")
+
+CONTINUATION_PROMPT = """You are extracting the transactions of a bank statement. A previous answer was cut off
+        after {count} transactions; the last one extracted was:
+        {last}
+
+        Return the transactions that come after it in the statement text below, in order and with the same
+        fields (date, description, debit, credit, balance), as JSON {{"transactions": [...]}}.
+        Return {{"transactions": []}} if there are none. Return only valid JSON."""
+
+def build_prompt(input_text: str) -> str:
+    """Prefix the statement text with the extraction instructions"""
+    return f"{SYSTEM_PROMPT}\n\nBank Statement Text:\n{input_text}"
+
+def response_options(response_format=None, schema=Statement) -> dict:
+    """Generation config entries that make Gemini answer in JSON"""
+    response_format = response_format or RESPONSE_FORMAT
+    if response_format == 'schema':
+        return {'response_mime_type': 'application/json', 'response_schema': response_schema(schema)}
+    if response_format == 'json':
+        return {'response_mime_type': 'application/json'}
+    return {}
+
+def decode_answer(response_text: str, schema=Statement):
+    """
+    Parse the model's text answer into a dict checked against schema,
+    salvaging a truncated or slightly malformed answer up to its last
+    complete transaction. Returns (data, complete).
+    """
+    data, complete = salvage_json(response_text)
+    if data is None:
         print(f"Response text: {response_text}")
-        raise
-    except Exception as e:
-        print(f"Error with Gemini API: {e}")
-        raise
+        raise ValueError("Gemini response contains no usable JSON")
+    return validate_statement(data, schema), complete
+
+def transaction_key(transaction):
+    return (transaction.get('date'), transaction.get('description'),
+            transaction.get('debit'), transaction.get('credit'))
+
+def remaining_text(input_text: str, last: dict) -> str:
+    """
+    Statement text for a continuation: the lines before the first
+    transaction (header and column titles), then the text from the last
+    extracted transaction on. The whole text when that transaction cannot be
+    found on exactly one line.
+    """
+    words = (last.get('description') or '').split()[:3]
+    if not words:
+        return input_text
+    needle = ' '.join(words).lower()
+    blocks = transaction_blocks(input_text)
+    matches = [i for i, block in enumerate(blocks) if needle in block.lower()]
+    if len(matches) != 1 or matches[0] == 0:
+        return input_text
+    return blocks[0] + ''.join(blocks[matches[0]:])
+
+def continuation_prompt(input_text: str, data: dict) -> str:
+    """Ask for the transactions after the last one extracted so far"""
+    transactions = data.get('transactions') or []
+    if not transactions:
+        return build_prompt(input_text)
+    last = transactions[-1]
+    instructions = CONTINUATION_PROMPT.format(count=len(transactions),
+                                              last=json.dumps(last, ensure_ascii=False))
+    return f"{instructions}\n\nBank Statement Text:\n{remaining_text(input_text, last)}"
+
+def merge_continuation(data: dict, extra: dict) -> int:
+    """
+    Append the transactions of a continuation answer, skipping the ones it
+    repeats from the end of the previous answer. Returns how many were added.
+    """
+    transactions = data.setdefault('transactions', [])
+    new = extra.get('transactions') or []
+    tail = [transaction_key(transaction) for transaction in transactions[-5:]]
+    skip = 0
+    while skip < len(new) and transaction_key(new[skip]) in tail:
+        skip += 1
+    transactions.extend(new[skip:])
+    return len(new) - skip
+
+def extraction(input_text: str, max_continuations: int = None):
+    """
+    Request protocol of one extraction, shared by the sync and async entry
+    points: yields (prompt, generation options), receives each response and
+    returns the statement. When an answer stops early (output token limit),
+    the transactions after the last one extracted are requested, up to
+    max_continuations times, and appended.
+    """
+    if max_continuations is None:
+        max_continuations = MAX_CONTINUATIONS
+    response = yield build_prompt(input_text), response_options()
+    data, complete = decode_answer(response['text'])
+    finish_reason = response.get('finish_reason')
+    continuations = 0
+    while not complete and continuations < max_continuations:
+        continuations += 1
+        print(f"Answer cut off after {len(data.get('transactions') or [])} transactions "
+              f"(finish reason {finish_reason}), continuation {continuations}/{max_continuations}")
+        response = yield continuation_prompt(input_text, data), response_options(schema=TransactionList)
+        finish_reason = response.get('finish_reason')
+        try:
+            extra, complete = decode_answer(response['text'], TransactionList)
+        except ValueError:
+            break
+        if not merge_continuation(data, extra):
+            # Nothing new: the model has no more transactions to give
+            complete = True
+
+    info = {}
+    if continuations:
+        info['continuations'] = continuations
+    if not complete:
+        info.update(truncated=True, finish_reason=finish_reason)
+    if info:
+        data['processing_info'] = info
+    return data
+
+def add_usage(details, response):
+    """Add a response's token usage to the metrics of an extraction"""
+    details['calls'] = details.get('calls', 0) + 1
+    for key in ('prompt_tokens', 'output_tokens'):
+        if response.get(key) is not None:
+            details[key] = details.get(key, 0) + response[key]
+
+def parse_with_gemini(input_text: str, max_tokens: int = 5000, client=None) -> dict:
+    """
+    This function utilizes the Gemini model to parse the input text into a JSON format
+    """
+    client = client or get_client()
+    steps = extraction(input_text)
+    prompt, options = next(steps)
+    with measure('gemini', input_chars=len(input_text)) as details:
+        while True:
+            try:
+                response = client.generate_sync(prompt, temperature=0.0, max_output_tokens=max_tokens, **options)
+            except Exception as e:
+                print(f"Error with Gemini API: {e}")
+                raise
+            add_usage(details, response)
+            try:
+                prompt, options = steps.send(response)
+            except StopIteration as done:
+                return done.value
+
+async def parse_with_gemini_async(input_text: str, max_tokens: int = 5000, client=None) -> dict:
+    """
+    Async variant of parse_with_gemini sharing the same client, so concurrency
+    caps, rate limits and retries apply across every caller in the process
+    """
+    client = client or get_client()
+    steps = extraction(input_text)
+    prompt, options = next(steps)
+    with measure('gemini', input_chars=len(input_text)) as details:
+        while True:
+            try:
+                response = await client.generate(prompt, temperature=0.0, max_output_tokens=max_tokens, **options)
+            except Exception as e:
+                print(f"Error with Gemini API: {e}")
+                raise
+            add_usage(details, response)
+            try:
+                prompt, options = steps.send(response)
+            except StopIteration as done:
+                return done.value
 
 # Keep backward compatibility
 def parse_with_gpt(input_text: str, max_tokens: int = 5000) -> dict:
     """Backward compatibility wrapper"""
-    return parse_with_gemini(input_text, max_tokens)
\ No newline at end of file
+    return parse_with_gemini(input_text, max_tokens)
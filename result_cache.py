@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+def content_hash(*parts):
+    """
+    SHA-256 over str or buffer parts (bytes, contiguous NumPy arrays),
+    separated so ('ab', 'c') != ('a', 'bc')
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        part = memoryview(part).cast('B')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+def ocr_key(image_bytes, settings):
+    """
+    Cache key for OCR text: page image content (encoded file bytes or a
+    contiguous pixel array) plus every setting that changes the text
+    """
+    return content_hash(image_bytes, json.dumps(settings, sort_keys=True))
+
+def llm_key(text, prompt, model_name, settings=None):
+    """
+    Cache key for parsed JSON: OCR text plus prompt plus model, plus the
+    generation settings that change the answer (response format, limits)
+    """
+    return content_hash(text, prompt, model_name, json.dumps(settings or {}, sort_keys=True))
+
+class ResultCache:
+    """
+    On-disk SQLite cache for stage results, evicting least recently used
+    entries once the stored values exceed `max_bytes`.
+    Safe to share between threads; each process opens its own connection.
+    The stored size is kept as a running total; it is only recounted when
+    it crosses max_bytes, to account for writes by other processes.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " size INTEGER NOT NULL, last_access REAL NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        self._conn.commit()
+        self._total = self._stored_size()
+
+    def _stored_size(self):
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, kind, key):
+        """Return the cached value or None, counting the hit or miss"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            if row is None:
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE kind = ? AND key = ?", (time.time(), kind, key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, kind, key, value):
+        """Store a value and evict old entries if the cache grew past max_bytes"""
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM entries WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (kind, key, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, value, size, time.time())
+            )
+            self._total += size - (row[0] if row else 0)
+            if self._total > self.max_bytes:
+                self._total = self._stored_size()
+                if self._total > self.max_bytes:
+                    self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        rows = self._conn.execute("SELECT kind, key, size FROM entries ORDER BY last_access").fetchall()
+        for kind, key, size in rows:
+            if self._total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+            self._total -= size
+
+    def get_json(self, kind, key):
+        value = self.get(kind, key)
+        return None if value is None else json.loads(value)
+
+    def put_json(self, kind, key, data):
+        self.put(kind, key, json.dumps(data, ensure_ascii=False))
+
+    def stats(self):
+        """Hit and miss counters per kind since this process opened the cache"""
+        kinds = set(self.hits) | set(self.misses)
+        return {kind: {'hits': self.hits.get(kind, 0), 'misses': self.misses.get(kind, 0)} for kind in kinds}
+
+def merge_stats(total, stats):
+    """Add one stats() snapshot into a running total"""
+    for kind, counts in stats.items():
+        entry = total.setdefault(kind, {'hits': 0, 'misses': 0})
+        entry['hits'] += counts['hits']
+        entry['misses'] += counts['misses']
+    return total
+
+def diff_stats(after, before):
+    """Counters accumulated between two stats() snapshots"""
+    diff = {}
+    for kind, counts in after.items():
+        previous = before.get(kind, {'hits': 0, 'misses': 0})
+        diff[kind] = {'hits': counts['hits'] - previous['hits'], 'misses': counts['misses'] - previous['misses']}
+    return diff
+
+def format_hit_ratio(stats):
+    """One line per kind, e.g. 'ocr: 12/20 hits (60.0%)'"""
+    lines = []
+    for kind in sorted(stats):
+        hits = stats[kind]['hits']
+        lookups = hits + stats[kind]['misses']
+        if lookups:
+            lines.append(f"{kind}: {hits}/{lookups} hits ({hits/lookups*100:.1f}%)")
+    return lines
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache():
+    """
+    Process-wide cache configured from the environment, or None when
+    RESULT_CACHE is disabled. Forked worker processes get their own connection.
+    """
+    if os.getenv('RESULT_CACHE', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    with _caches_lock:
+        pid = os.getpid()
+        if pid not in _caches:
+            _caches[pid] = ResultCache(
+                os.getenv('RESULT_CACHE_PATH', os.path.join('.cache', 'results.sqlite')),
+                int(float(os.getenv('RESULT_CACHE_MAX_MB', '512')) * 1024 * 1024)
+            )
+        return _caches[pid]
+
+def cache_stats():
+    """stats() of this process's cache, empty when caching is disabled"""
+    cache = get_cache()
+    return cache.stats() if cache else {}
@@ -0,0 +1,185 @@
+import json
+import re
+import typing
+from typing import TypedDict
+
+# Statement JSON schema of the Gemini answers, also followed by the template
+# parser. TypedDicts keep the parsed data a plain dict (no conversion on the
+# hot path) while giving the types that build Gemini's response schema.
+
+class Transaction(TypedDict, total=False):
+    date: str
+    value_date: str
+    description: str
+    reference: str
+    debit: float
+    credit: float
+    balance: float
+
+class AccountDetails(TypedDict, total=False):
+    iban: str
+    bic: str
+    opening_balance: float
+    closing_balance: float
+    currency: str
+
+class ContactInfo(TypedDict, total=False):
+    phone: str
+    address: str
+    website: str
+    email: str
+
+class ClientInfo(TypedDict, total=False):
+    name: str
+    address: str
+
+class Statement(TypedDict, total=False):
+    bank: str
+    statement_date: str
+    account_number: str
+    statement_period: str
+    contact_info: ContactInfo
+    client_info: ClientInfo
+    account_details: AccountDetails
+    transactions: typing.List[Transaction]
+
+class TransactionList(TypedDict, total=False):
+    """Answer to a continuation request: the transactions after a given one"""
+    transactions: typing.List[Transaction]
+
+SCHEMA_TYPES = {str: 'STRING', float: 'NUMBER', int: 'INTEGER', bool: 'BOOLEAN'}
+
+# Characters that matter for JSON structure; everything else is skipped in bulk
+STRUCTURE_RE = re.compile(r'[{}\[\],"]')
+TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+def response_schema(hint=Statement):
+    """Gemini response schema (OpenAPI subset) for a TypedDict or field type"""
+    if typing.get_origin(hint) is list:
+        return {'type': 'ARRAY', 'items': response_schema(typing.get_args(hint)[0])}
+    if hint in SCHEMA_TYPES:
+        return {'type': SCHEMA_TYPES[hint], 'nullable': True}
+    fields = typing.get_type_hints(hint)
+    return {'type': 'OBJECT', 'properties': {name: response_schema(field) for name, field in fields.items()}}
+
+def parse_number(value):
+    """Amount from a JSON value: a number or a string such as '1 234,56 €' or '-89.50', else None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        cleaned = value.replace(' ', '').replace('\u00a0', '').replace('€', '').replace('EUR', '')
+        # The right-most of ',' and '.' is the decimal separator, the other groups
+        # thousands; a separator repeated ('1.234.567') only groups thousands
+        decimal = ',' if cleaned.rfind(',') > cleaned.rfind('.') else '.'
+        thousands = '.' if decimal == ',' else ','
+        if cleaned.count(decimal) > 1:
+            cleaned = cleaned.replace(decimal, '')
+        else:
+            cleaned = cleaned.replace(thousands, '').replace(decimal, '.')
+        try:
+            return float(cleaned)
+        except ValueError:
+            return None
+    return None
+
+def coerce(value, hint):
+    """
+    Bring a decoded value in line with its schema type: numbers given as
+    strings are converted, lists and objects are checked recursively and
+    malformed items dropped. Keys outside the schema are kept as they are.
+    """
+    if value is None:
+        return None
+    if typing.get_origin(hint) is list:
+        if not isinstance(value, list):
+            return []
+        item_hint = typing.get_args(hint)[0]
+        items = (coerce(item, item_hint) for item in value)
+        return [item for item in items if item is not None]
+    if hint is float:
+        return parse_number(value)
+    if hint is str:
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    if hint in SCHEMA_TYPES:
+        return value
+    if not isinstance(value, dict):
+        return None
+    fields = typing.get_type_hints(hint)
+    return {key: coerce(item, fields[key]) if key in fields else item for key, item in value.items()}
+
+def validate_statement(data, schema=Statement):
+    """A decoded Gemini answer checked against the Statement (or another) schema"""
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+    return coerce(data, schema)
+
+def closes_string(text, i):
+    """True when the quote at i is not escaped (preceded by an even number of backslashes)"""
+    j = i - 1
+    while j >= 0 and text[j] == '\\':
+        j -= 1
+    return (i - 1 - j) % 2 == 0
+
+def salvage_json(text):
+    """
+    Decode possibly truncated or slightly malformed JSON (trailing commas).
+    When it does not parse, one pass over the structural characters records
+    every point where the document could be closed: after a complete member
+    or element, or right after a container opens. The text is cut at the
+    last such point and the open containers closed. Array items are only
+    kept when complete, so a transaction cut mid-way is dropped rather than
+    returned without its amounts.
+    Returns (data, complete), or (None, False) when nothing can be saved.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None, False
+    decoder = json.JSONDecoder()
+    try:
+        return decoder.raw_decode(text, start)[0], True
+    except json.JSONDecodeError:
+        pass
+    text = TRAILING_COMMA_RE.sub(r"\1", text)
+    try:
+        return decoder.raw_decode(text, start)[0], True
+    except json.JSONDecodeError:
+        pass
+
+    stack = []
+    in_string = False
+    cut, cut_stack = None, None
+    for match in STRUCTURE_RE.finditer(text, start):
+        char, i = match.group(), match.start()
+        if in_string:
+            if char == '"' and closes_string(text, i):
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+            continue
+        if char in '{[':
+            stack.append(char)
+            position = i + 1
+        elif char in '}]':
+            if not stack:
+                break
+            stack.pop()
+            position = i + 1
+            if not stack:
+                # Top-level object closed but invalid: nothing safe to add
+                break
+        else:
+            position = i
+        # Never cut inside an object that is an array item
+        if '[' not in stack or '{' not in stack[stack.index('['):]:
+            cut, cut_stack = position, list(stack)
+
+    if cut is None:
+        return None, False
+    closing = ''.join('}' if opener == '{' else ']' for opener in reversed(cut_stack))
+    try:
+        return json.loads(text[start:cut] + closing), False
+    except json.JSONDecodeError:
+        return None, False
@@ -1,18 +1,38 @@
 import streamlit as st
 import os
+import io
 import json
 import tempfile
 import time
+import zipfile
 from datetime import datetime
 from PIL import Image
 import pandas as pd
-from main import process_file
+from main import process_to_statement, warm_up_page_ocr
+from extract_pdf import is_image_file, is_pdf_file
+from job_runner import JobRunner, FINISHED_STATES, warm_up_resources
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Background worker threads shared by all sessions, and how often a running job's progress is refreshed
+APP_JOB_WORKERS = int(os.getenv('APP_JOB_WORKERS', '2'))
+PROGRESS_REFRESH = float(os.getenv('APP_PROGRESS_REFRESH', '0.5'))
+
+STAGE_LABELS = {
+    'start': "🚀 Started: {pages} page(s)",
+    'text_layer': "📄 Read the text layer of {page}",
+    'render': "🖼️ Rendered {page}",
+    'deskew': "📐 Deskewed {page}",
+    'ocr': "🔍 OCR done for {page}",
+    'skipped': "⏭️ Skipped {page}",
+    'parse': "🤖 Parsed {page} ({parser})",
+    'llm': "🤖 Gemini call {call}/{calls} done",
+    'failed': "⚠️ Could not parse {page}",
+}
+
 # Page configuration
 st.set_page_config(
     page_title="🏦 Bank Statement OCR",
@@ -145,6 +165,302 @@ def create_transactions_dataframe(json_data):
     
     return df
 
+def process_upload(file_path, output_dir, prompt):
+    """Background job: run the pipeline on an uploaded file and return its statement JSON"""
+    try:
+        return process_to_statement(file_path, output_dir, prompt)
+    finally:
+        try:
+            os.unlink(file_path)
+        except OSError:
+            pass
+
+@st.cache_resource
+def get_job_runner():
+    """
+    Worker pool shared by every session of this server. The tokenizer and
+    Gemini client are created once here, each worker loads its OCR engine
+    before its first job.
+    """
+    warm_up_resources()
+    return JobRunner(max_workers=APP_JOB_WORKERS, initializer=warm_up_page_ocr)
+
+def describe_event(event):
+    """One-line status for a pipeline event"""
+    label = STAGE_LABELS.get(event['stage'], event['stage'])
+    try:
+        return label.format(**event)
+    except (KeyError, IndexError):
+        return event['stage']
+
+def events_dataframe(job):
+    """Pipeline events of a job, timed from its start"""
+    rows = []
+    for event in job.events():
+        details = {key: value for key, value in event.items() if key not in ('stage', 'page', 'time')}
+        rows.append({
+            'time (s)': round(event['time'] - (job.started or event['time']), 2),
+            'stage': event['stage'],
+            'page': event.get('page') or '',
+            'details': ', '.join(f"{key}={value}" for key, value in details.items()),
+        })
+    return pd.DataFrame(rows)
+
+def expand_uploads(uploaded_files):
+    """(name, bytes) of every uploaded document, zip archives unpacked to the images and PDFs they hold"""
+    documents = []
+    for uploaded_file in uploaded_files:
+        if not uploaded_file.name.lower().endswith('.zip'):
+            documents.append((uploaded_file.name, uploaded_file.getvalue()))
+            continue
+        try:
+            with zipfile.ZipFile(io.BytesIO(uploaded_file.getvalue())) as archive:
+                for member in archive.infolist():
+                    member_name = os.path.basename(member.filename)
+                    if member.is_dir() or member_name.startswith('.') or member.filename.startswith('__MACOSX/'):
+                        continue
+                    if is_image_file(member_name) or is_pdf_file(member_name):
+                        documents.append((f"{uploaded_file.name}/{member.filename}", archive.read(member)))
+        except zipfile.BadZipFile:
+            st.error(f"{uploaded_file.name} is not a valid zip archive")
+    return documents
+
+def submit_document(runner, name, data, output_dir, prompt):
+    """Copy a document to a temporary file and queue it; the job deletes the copy when done"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{os.path.basename(name)}") as tmp_file:
+        tmp_file.write(data)
+    return runner.submit(process_upload, tmp_file.name, output_dir, prompt, name=name)
+
+def job_status(job):
+    """Current step of a job, in words"""
+    if job.state == 'failed':
+        return f"❌ {job.error}"
+    if job.state == 'done':
+        return "✅ Done"
+    events = job.events()
+    if events:
+        return describe_event(events[-1])
+    return "⏳ Waiting for a free worker..." if job.state == 'queued' else "🚀 Starting..."
+
+def job_pages(job):
+    """Page count reported by a job, 0 before it starts"""
+    return next((event['pages'] for event in job.events() if event['stage'] == 'start'), 0)
+
+def batch_dataframe(jobs):
+    """One row per document: state, progress, current step, pages, wait and processing time"""
+    return pd.DataFrame([{
+        'Document': job.name,
+        'Progress': job.progress(),
+        'Step': job_status(job),
+        'Pages': job_pages(job),
+        'Wait (s)': round((job.started or time.time()) - job.submitted, 1),
+        'Latency (s)': round(job.elapsed, 1),
+    } for job in jobs])
+
+def combined_transactions(jobs):
+    """Transactions of every finished document in one table, with the document they come from"""
+    frames = []
+    for job in jobs:
+        if job.state != 'done':
+            continue
+        df = create_transactions_dataframe(job.result)
+        if df is not None and not df.empty:
+            df.insert(0, 'document', job.name)
+            frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+def show_batch(jobs):
+    """Throughput, per-document status and latency, combined results, then each finished document"""
+    finished = [job for job in jobs if job.state in FINISHED_STATES]
+    done = [job for job in finished if job.state == 'done']
+    progress = sum(job.progress() for job in jobs) / len(jobs)
+    st.progress(progress, text=f"{len(finished)}/{len(jobs)} documents finished")
+    
+    # Throughput over the wall time since the first document started
+    starts = [job.started for job in jobs if job.started]
+    end = max(job.finished for job in finished) if len(finished) == len(jobs) else time.time()
+    wall_time = end - min(starts) if starts else 0.0
+    pages = sum(job_pages(job) for job in done)
+    metric_cols = st.columns(4)
+    metric_cols[0].metric("Documents done", f"{len(done)}/{len(jobs)}")
+    metric_cols[1].metric("Pages processed", pages)
+    metric_cols[2].metric("Throughput", f"{(pages / wall_time * 60 if wall_time else 0):.1f} pages/min")
+    metric_cols[3].metric("Mean latency", f"{(sum(job.elapsed for job in finished) / len(finished) if finished else 0):.1f} s")
+    
+    st.dataframe(
+        batch_dataframe(jobs),
+        use_container_width=True,
+        hide_index=True,
+        column_config={'Progress': st.column_config.ProgressColumn('Progress', min_value=0.0, max_value=1.0)}
+    )
+    
+    if not done:
+        return
+    
+    st.markdown("### 💳 All Transactions")
+    df = combined_transactions(done)
+    if df is not None:
+        st.dataframe(df, use_container_width=True)
+        st.info(f"📊 Total transactions: {len(df)} from {df['document'].nunique()} document(s)")
+    else:
+        st.warning("No transactions found in the processed documents yet")
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="📥 Download all (JSON)",
+            data=json.dumps({job.name: job.result for job in done}, indent=2, ensure_ascii=False),
+            file_name=f"bank_statements_{timestamp}.json",
+            mime="application/json",
+            key="batch_json"
+        )
+    with col2:
+        if df is not None:
+            st.download_button(
+                label="📊 Download all transactions (CSV)",
+                data=df.to_csv(index=False),
+                file_name=f"transactions_{timestamp}.csv",
+                mime="text/csv",
+                key="batch_csv"
+            )
+    
+    st.markdown("### 📄 Documents")
+    for job in finished:
+        with st.expander(f"{'✅' if job.state == 'done' else '❌'} {job.name} ({job.elapsed:.1f}s)"):
+            if job.state == 'done':
+                show_results(job.result, job.id)
+            else:
+                st.error(f"Error processing file: {job.error}")
+
+def show_jobs(jobs):
+    """A single document with its full results view, or a batch overview"""
+    if len(jobs) > 1:
+        show_batch(jobs)
+        return
+    job = jobs[0]
+    if job.state == 'failed':
+        show_error(job)
+        return
+    if job.state == 'done':
+        st.success(f"🎉 Successfully processed {job.name} in {job.elapsed:.1f} seconds!")
+        show_results(job.result, job.id)
+    else:
+        st.progress(job.progress(), text=f"{job.name}: {job_status(job)} ({job.elapsed:.1f}s)")
+    if job.events():
+        with st.expander("📜 Pipeline events"):
+            st.dataframe(events_dataframe(job), use_container_width=True)
+
+@st.fragment(run_every=PROGRESS_REFRESH)
+def show_running_jobs(job_ids):
+    """Jobs still running: only this fragment refreshes, then the page reruns once they all finish"""
+    jobs = [job for job in map(get_job_runner().get, job_ids) if job is not None]
+    if all(job.state in FINISHED_STATES for job in jobs):
+        st.rerun()
+    show_jobs(jobs)
+
+def show_error(job):
+    """Error message of a failed job with the usual fixes"""
+    st.error(f"Error processing file: {job.error}")
+    
+    with st.expander("🔍 Error Details"):
+        st.code(job.error)
+        st.markdown("""
+        **Common solutions:**
+        - Check if your API key is valid
+        - Ensure the image is clear and readable
+        - Try a different file format
+        - Check your internet connection
+        """)
+
+def show_results(json_data, result_id='result'):
+    """Summary, transactions, raw JSON and downloads of a processed statement; result_id tells its widgets apart"""
+    # Create tabs for different views
+    tab1, tab2, tab3, tab4 = st.tabs(["📊 Summary", "💳 Transactions", "📄 Full JSON", "💾 Download"])
+    
+    with tab1:
+        st.markdown("### 📈 Key Metrics")
+        metrics = extract_key_metrics(json_data)
+    
+        # Display metrics in columns
+        if metrics:
+            metric_cols = st.columns(min(len(metrics), 4))
+            for i, (key, value) in enumerate(metrics.items()):
+                with metric_cols[i % 4]:
+                    st.metric(key, value)
+    
+        # Display account information
+        if isinstance(json_data, dict):
+            col1, col2 = st.columns(2)
+    
+            with col1:
+                st.markdown("#### 🏦 Bank Information")
+                bank_info = {
+                    "Bank": json_data.get('bank', 'Unknown'),
+                    "Statement Date": json_data.get('statement_date', 'Unknown'),
+                    "Statement Period": json_data.get('statement_period', 'Unknown')
+                }
+                for key, value in bank_info.items():
+                    st.text(f"{key}: {value}")
+    
+            with col2:
+                st.markdown("#### 👤 Account Information")
+                account_details = json_data.get('account_details', {})
+                client_info = json_data.get('client_info', {})
+    
+                info_to_show = {
+                    "Account Number": json_data.get('account_number', 'Unknown'),
+                    "Client Name": client_info.get('name', 'Unknown') if isinstance(client_info, dict) else 'Unknown',
+                    "IBAN": account_details.get('iban', 'Unknown') if isinstance(account_details, dict) else 'Unknown'
+                }
+    
+                for key, value in info_to_show.items():
+                    st.text(f"{key}: {value}")
+    
+    with tab2:
+        st.markdown("### 💳 Transaction Details")
+        df = create_transactions_dataframe(json_data)
+    
+        if df is not None and not df.empty:
+            st.dataframe(df, use_container_width=True)
+            st.info(f"📊 Total transactions: {len(df)}")
+        else:
+            st.warning("No transactions found in the processed data")
+    
+    with tab3:
+        st.markdown("### 📄 Complete JSON Output")
+        st.json(json_data)
+    
+    with tab4:
+        st.markdown("### 💾 Download Results")
+    
+        # Prepare download data
+        json_str = json.dumps(json_data, indent=2, ensure_ascii=False)
+    
+        col1, col2 = st.columns(2)
+    
+        with col1:
+            st.download_button(
+                label="📥 Download JSON",
+                data=json_str,
+                file_name=f"bank_statement_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                mime="application/json",
+                key=f"{result_id}_json"
+            )
+    
+        with col2:
+            if df is not None and not df.empty:
+                csv_data = df.to_csv(index=False)
+                st.download_button(
+                    label="📊 Download CSV",
+                    data=csv_data,
+                    file_name=f"transactions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    mime="text/csv",
+                    key=f"{result_id}_csv"
+                )
+    
+        st.info("💡 **Tip:** Save these files for your records or import into accounting software")
+
 def main():
     # Header
     st.markdown('<h1 class="main-header">🏦 Bank Statement OCR & Data Extraction</h1>', unsafe_allow_html=True)
@@ -174,7 +490,7 @@ def main():
     with st.sidebar:
         st.markdown("## 📋 How to Use")
         st.markdown("""
-        1. **Upload** a bank statement (image or PDF)
+        1. **Upload** bank statements (images, PDFs or a zip of them)
         2. **Customize** the extraction prompt (optional)
         3. **Click Process** to extract data
         4. **View** results and download JSON
@@ -192,6 +508,7 @@ def main():
         st.markdown("## 📁 Supported Formats")
         st.markdown("• **Images**: JPG, PNG, TIFF, BMP")
         st.markdown("• **Documents**: PDF")
+        st.markdown("• **Archives**: ZIP of images and PDFs")
         
         st.markdown("## ⚡ Processing Info")
         st.info("Processing typically takes 5-15 seconds per document")
@@ -200,13 +517,14 @@ def main():
     col1, col2 = st.columns([1, 1])
     
     with col1:
-        st.markdown("### 📤 Upload Bank Statement")
+        st.markdown("### 📤 Upload Bank Statements")
         
         # File uploader
-        uploaded_file = st.file_uploader(
-            "Choose a bank statement file",
-            type=['jpg', 'jpeg', 'png', 'tiff', 'bmp', 'pdf'],
-            help="Upload an image or PDF of your bank statement"
+        uploaded_files = st.file_uploader(
+            "Choose bank statement files",
+            type=['jpg', 'jpeg', 'png', 'tiff', 'bmp', 'pdf', 'zip'],
+            accept_multiple_files=True,
+            help="Upload images or PDFs of your bank statements, or a zip archive of them"
         )
         
         # Custom prompt
@@ -229,15 +547,20 @@ Format the output as structured JSON with clear field names."""
         
         # Processing button
         process_button = st.button(
-            "🚀 Process Bank Statement",
+            "🚀 Process Bank Statements",
             type="primary",
-            disabled=uploaded_file is None
+            disabled=not uploaded_files
         )
     
     with col2:
         st.markdown("### 👁️ Preview")
         
-        if uploaded_file is not None:
+        if len(uploaded_files) > 1:
+            st.info(f"**Files:** {len(uploaded_files)}")
+            for uploaded_file in uploaded_files:
+                st.text(f"{uploaded_file.name} ({uploaded_file.size:,} bytes)")
+        elif uploaded_files:
+            uploaded_file = uploaded_files[0]
             # Display file info
             st.info(f"**File:** {uploaded_file.name}")
             st.info(f"**Size:** {uploaded_file.size:,} bytes")
@@ -249,6 +572,8 @@ Format the output as structured JSON with clear field names."""
                     st.image(image, caption="Uploaded Bank Statement", use_column_width=True)
                 except Exception as e:
                     st.error(f"Error displaying image: {str(e)}")
+            elif uploaded_file.name.lower().endswith('.zip'):
+                st.info("🗜️ Zip archive uploaded - its images and PDFs are processed together")
             else:
                 st.info("📄 PDF file uploaded - preview not available")
         else:
@@ -260,162 +585,30 @@ Format the output as structured JSON with clear field names."""
             """, unsafe_allow_html=True)
     
     # Processing section
-    if process_button and uploaded_file is not None:
+    if process_button and uploaded_files:
+        output_dir = "streamlit_output"
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # Documents run concurrently in the shared worker pool, at most APP_JOB_WORKERS at a time
+        runner = get_job_runner()
+        documents = expand_uploads(uploaded_files)
+        if not documents:
+            st.error("No image or PDF found in the upload")
+        st.session_state['job_ids'] = [submit_document(runner, name, data, output_dir, custom_prompt)
+                                       for name, data in documents]
+    
+    job_ids = st.session_state.get('job_ids')
+    if job_ids:
         st.markdown("---")
         st.markdown("## 🔄 Processing Results")
         
-        # Create progress indicators
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        try:
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{uploaded_file.name}") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                temp_file_path = tmp_file.name
-            
-            # Update progress
-            progress_bar.progress(20)
-            status_text.text("📁 File saved temporarily...")
-            time.sleep(0.5)
-            
-            # Create output directory
-            output_dir = "streamlit_output"
-            os.makedirs(output_dir, exist_ok=True)
-            
-            progress_bar.progress(40)
-            status_text.text("🔍 Starting OCR and AI processing...")
-            time.sleep(0.5)
-            
-            # Process the file
-            start_time = time.time()
-            result_file = process_file(
-                file_path=temp_file_path,
-                output_dir=output_dir,
-                prompt=custom_prompt
-            )
-            processing_time = time.time() - start_time
-            
-            progress_bar.progress(80)
-            status_text.text("📊 Parsing results...")
-            time.sleep(0.5)
-            
-            # Load and display results
-            with open(result_file, 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
-            
-            progress_bar.progress(100)
-            status_text.text("✅ Processing completed!")
-            
-            # Display success message
-            st.success(f"🎉 Successfully processed in {processing_time:.1f} seconds!")
-            
-            # Create tabs for different views
-            tab1, tab2, tab3, tab4 = st.tabs(["📊 Summary", "💳 Transactions", "📄 Full JSON", "💾 Download"])
-            
-            with tab1:
-                st.markdown("### 📈 Key Metrics")
-                metrics = extract_key_metrics(json_data)
-                
-                # Display metrics in columns
-                if metrics:
-                    metric_cols = st.columns(min(len(metrics), 4))
-                    for i, (key, value) in enumerate(metrics.items()):
-                        with metric_cols[i % 4]:
-                            st.metric(key, value)
-                
-                # Display account information
-                if isinstance(json_data, dict):
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.markdown("#### 🏦 Bank Information")
-                        bank_info = {
-                            "Bank": json_data.get('bank', 'Unknown'),
-                            "Statement Date": json_data.get('statement_date', 'Unknown'),
-                            "Statement Period": json_data.get('statement_period', 'Unknown')
-                        }
-                        for key, value in bank_info.items():
-                            st.text(f"{key}: {value}")
-                    
-                    with col2:
-                        st.markdown("#### 👤 Account Information")
-                        account_details = json_data.get('account_details', {})
-                        client_info = json_data.get('client_info', {})
-                        
-                        info_to_show = {
-                            "Account Number": json_data.get('account_number', 'Unknown'),
-                            "Client Name": client_info.get('name', 'Unknown') if isinstance(client_info, dict) else 'Unknown',
-                            "IBAN": account_details.get('iban', 'Unknown') if isinstance(account_details, dict) else 'Unknown'
-                        }
-                        
-                        for key, value in info_to_show.items():
-                            st.text(f"{key}: {value}")
-            
-            with tab2:
-                st.markdown("### 💳 Transaction Details")
-                df = create_transactions_dataframe(json_data)
-                
-                if df is not None and not df.empty:
-                    st.dataframe(df, use_container_width=True)
-                    st.info(f"📊 Total transactions: {len(df)}")
-                else:
-                    st.warning("No transactions found in the processed data")
-            
-            with tab3:
-                st.markdown("### 📄 Complete JSON Output")
-                st.json(json_data)
-            
-            with tab4:
-                st.markdown("### 💾 Download Results")
-                
-                # Prepare download data
-                json_str = json.dumps(json_data, indent=2, ensure_ascii=False)
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.download_button(
-                        label="📥 Download JSON",
-                        data=json_str,
-                        file_name=f"bank_statement_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                        mime="application/json"
-                    )
-                
-                with col2:
-                    if df is not None and not df.empty:
-                        csv_data = df.to_csv(index=False)
-                        st.download_button(
-                            label="📊 Download CSV",
-                            data=csv_data,
-                            file_name=f"transactions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                            mime="text/csv"
-                        )
-                
-                st.info("💡 **Tip:** Save these files for your records or import into accounting software")
-            
-        except Exception as e:
-            progress_bar.progress(100)
-            status_text.text("❌ Processing failed")
-            st.error(f"Error processing file: {str(e)}")
-            
-            with st.expander("🔍 Error Details"):
-                st.code(str(e))
-                st.markdown("""
-                **Common solutions:**
-                - Check if your API key is valid
-                - Ensure the image is clear and readable
-                - Try a different file format
-                - Check your internet connection
-                """)
-        
-        finally:
-            # Clean up temporary file
-            try:
-                if 'temp_file_path' in locals():
-                    os.unlink(temp_file_path)
-            except:
-                pass
+        jobs = [job for job in map(get_job_runner().get, job_ids) if job is not None]
+        if len(jobs) < len(job_ids):
+            st.warning("Some jobs are no longer available, please process those files again")
+        if any(job.state not in FINISHED_STATES for job in jobs):
+            show_running_jobs(job_ids)
+        elif jobs:
+            show_jobs(jobs)
     
     # Footer
     st.markdown("---")
@@ -0,0 +1,468 @@
+import re
+import threading
+import unicodedata
+from extract_ocr import LAYOUT_SEPARATORS
+
+# Patterns are matched against accent-free, lower-case text (see fold)
+
+# Header cell patterns, first match wins: (column name, pattern). A None
+# name marks a column whose cells are ignored.
+HEADER_COLUMNS = [
+    ('value_date', r"valeur"),
+    ('date', r"^date"),
+    ('description', r"libelle|operation|transaction|nature|detail|description"),
+    ('debit', r"debit"),
+    ('credit', r"credit"),
+    ('balance', r"solde"),
+    ('amount', r"montant"),
+]
+
+DEFAULT_TEMPLATE = {
+    'name': None,
+    'identify': None,
+    'opening': r"ancien solde|solde precedent|solde reporte|solde initial",
+    'closing': r"nouveau solde|solde en euros|solde final",
+    'totals': r"^total|totaux",
+    # Whether the totals line also counts the opening balance
+    'totals_include_opening': False,
+    'account': r"(?:compte|ccp)[^\n\d]{0,30}?n[o°]\s*:?\s*([0-9][0-9a-z ]{5,}[0-9a-z])",
+    'columns': HEADER_COLUMNS,
+}
+
+# One template per recurring layout, keyed like the dataset directories, with
+# the column headers of its transaction table
+BANK_TEMPLATES = {
+    'LCL': {
+        'name': 'LCL',
+        'identify': r"\blcl\b|credit lyonnais|crlyfrpp",
+        'totals_include_opening': True,
+        'columns': [
+            ('date', r"^date"),
+            ('description', r"^libelle"),
+            ('value_date', r"^valeur"),
+            ('debit', r"^debit"),
+            ('credit', r"^credit"),
+        ],
+    },
+    'banquepopulaire': {
+        'name': 'Banque Populaire',
+        'identify': r"banque populaire|ccbpfrpp",
+        'columns': [
+            # DATE COMPTA is the booking date; DATE OPERATION is not kept
+            (None, r"operation"),
+            ('value_date', r"valeur"),
+            ('date', r"^date"),
+            ('description', r"libelle|reference"),
+            ('debit', r"^debit"),
+            ('credit', r"^credit"),
+        ],
+    },
+    'caisseepargne': {
+        'name': "Caisse d'Epargne",
+        'identify': r"caisse d.?epargne|cepafrpp",
+        'columns': [
+            ('date', r"^date"),
+            ('description', r"^detail des operations"),
+            ('debit', r"^debit"),
+            ('credit', r"^credit"),
+        ],
+    },
+    'creditMutuel': {
+        'name': 'Crédit Mutuel',
+        'identify': r"credit mutuel|cmcifrpp",
+        'columns': [
+            ('value_date', r"^date de valeur"),
+            ('date', r"^date"),
+            ('description', r"^operation"),
+            ('debit', r"^debit"),
+            ('credit', r"^credit"),
+        ],
+    },
+    'creditagricol': {
+        'name': 'Crédit Agricole',
+        'identify': r"credit agricole|agrifrpp",
+        'opening': r"ancien solde",
+        'closing': r"nouveau solde",
+        'columns': [
+            ('value_date', r"^date valeur"),
+            ('date', r"^date"),
+            ('description', r"^libelle"),
+            ('debit', r"^debit"),
+            ('credit', r"^credit"),
+        ],
+    },
+    'creditdunord': {
+        'name': 'Crédit du Nord',
+        'identify': r"credit du nord|nordfrpp",
+        'columns': [
+            ('date', r"^date"),
+            # The label column is headed by the account name
+            ('description', r"^compte|^libelle"),
+            ('debit', r"^debit"),
+            ('credit', r"^credit"),
+            ('value_date', r"^valeur"),
+        ],
+    },
+    'laposte': {
+        'name': 'La Banque Postale',
+        'identify': r"banque postale|psstfrpp",
+        'columns': [
+            ('date', r"^date"),
+            ('description', r"^operation"),
+            ('debit', r"^debit"),
+            ('credit', r"^credit"),
+        ],
+    },
+    'quonto': {
+        'name': 'Qonto',
+        'identify': r"qonto|qntofrp",
+        # The summary box shows "Solde au <first day>" then "Solde au <last day>"
+        'opening': r"^solde au",
+        'closing': r"^solde au",
+        'columns': [
+            # The only date column is the value date, used as the booking date
+            ('date', r"^date de valeur"),
+            ('description', r"^transactions"),
+            ('debit', r"^debit"),
+            ('credit', r"^credit"),
+        ],
+    },
+    'societegenerale': {
+        'name': 'Société Générale',
+        'identify': r"societe generale|sogefrpp",
+        'columns': [
+            ('date', r"^date"),
+            ('value_date', r"^valeur"),
+            ('description', r"^nature de l.operation"),
+            ('debit', r"^debit"),
+            ('credit', r"^credit"),
+        ],
+    },
+}
+
+MONTHS = ['janvier', 'fevrier', 'mars', 'avril', 'mai', 'juin', 'juillet',
+          'aout', 'septembre', 'octobre', 'novembre', 'decembre']
+
+# Crédit du Nord prints single-digit days ("4.11")
+DATE_RE = re.compile(r"^(\d{1,2})[./-](\d{2})(?:[./-](\d{2}|\d{4}))?\b")
+FULL_DATE_RE = re.compile(r"\b(\d{2})[./](\d{2})[./](\d{4})\b")
+LONG_DATE_RE = re.compile(r"\b(\d{1,2})\s+(" + "|".join(MONTHS) + r")\s+(\d{4})\b")
+PERIOD_RE = re.compile(r"\bdu\s+(\d{2}[./]\d{2}[./]\d{2,4})\s+au\s+(\d{2}[./]\d{2}[./]\d{2,4})")
+AMOUNT_RE = re.compile(r"([+-])?\s?(\d{1,3}(?:[ .\u00a0]?\d{3})*,\d{2})(?:\s?(?:€|eur))?(?!\d)")
+IBAN_RE = re.compile(r"\biban\s*:?\s*(fr\d{2}(?:\s?[0-9a-z]{4}){5}\s?[0-9a-z]{1,3})")
+BIC_RE = re.compile(r"\bbic\s*:?\s*([a-z]{6}[a-z0-9]{2}(?:[a-z0-9]{3})?)\b")
+
+TEMPLATE_STATS = {'pages': 0, 'parsed': 0}
+_stats_lock = threading.Lock()
+
+def fold(text):
+    """Lower-case text without accents, for matching"""
+    text = unicodedata.normalize('NFKD', text)
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+def get_template(bank_id):
+    """Template for a bank id (case-insensitive), merged over the defaults"""
+    for key, template in BANK_TEMPLATES.items():
+        if key.lower() == str(bank_id).lower():
+            return key, dict(DEFAULT_TEMPLATE, **template)
+    return None, None
+
+def identify_bank(folded_text, header_lines=20):
+    """
+    Bank id whose anchors appear in the page, looking at the letterhead
+    first so banks named in transaction labels do not win
+    """
+    header = "\n".join(folded_text.splitlines()[:header_lines])
+    for region in (header, folded_text):
+        for key, template in BANK_TEMPLATES.items():
+            if re.search(template['identify'], region):
+                return key
+    return None
+
+def split_cells(line):
+    """
+    Cells of a layout line with their position: the slot index for tab or
+    pipe separated rows, or the character offset of the cell center for
+    space-padded lines (cells there are separated by two or more spaces)
+    """
+    for separator in LAYOUT_SEPARATORS.values():
+        if separator in line:
+            return 'slots', [(i, cell.strip()) for i, cell in enumerate(line.split(separator))]
+    return 'offsets', [(match.start() + len(match.group()) / 2, match.group())
+                       for match in re.finditer(r"\S+(?: \S+)*", line)]
+
+def parse_header(kind, cells, header_columns=HEADER_COLUMNS):
+    """Column name per cell position if the line is a table header, else None"""
+    columns = {}
+    for position, cell in cells:
+        folded = fold(cell)
+        for name, pattern in header_columns:
+            if re.search(pattern, folded):
+                if name is None:
+                    columns[position] = None
+                elif name == 'value_date' and 'date' not in columns.values():
+                    # "Date de valeur" as the only date column is the booking date
+                    name = 'date'
+                elif name == 'date' and 'date' in columns.values():
+                    name = 'value_date'
+                if name not in columns.values():
+                    columns[position] = name
+                break
+    names = set(columns.values())
+    if 'date' in names and names & {'debit', 'credit', 'amount'}:
+        return {'kind': kind, 'slots': len(cells), 'columns': columns}
+    return None
+
+def row_fields(header, kind, cells):
+    """Map the cells of a table row onto the header's columns"""
+    if kind != header['kind'] or (kind == 'slots' and len(cells) != header['slots']):
+        return None
+    positions = list(header['columns'])
+    fields = {}
+    for position, cell in cells:
+        if not cell:
+            continue
+        if kind == 'slots':
+            name = header['columns'].get(position)
+        else:
+            name = header['columns'][min(positions, key=lambda p: abs(p - position))]
+        if name:
+            fields[name] = f"{fields[name]} {cell}" if name in fields else cell
+    return fields
+
+def parse_amount(text):
+    """French formatted amount ('- 1 234,56 €') as a float, or None"""
+    match = AMOUNT_RE.search(fold(text)) if text else None
+    if not match:
+        return None
+    value = float(re.sub(r"[ .\u00a0]", "", match.group(2)).replace(',', '.'))
+    return -value if match.group(1) == '-' else value
+
+def balance_amount(pattern, fields, cells):
+    """
+    Match a balance label and return (matched, signed amount). In table rows
+    the label is the description and the amount sits in a balance, credit
+    or (negative) debit column; elsewhere any cell can hold the label and
+    the amount is the first one after it, as in summary boxes.
+    """
+    if fields is not None:
+        if not re.search(pattern, fold(fields.get('description', ''))):
+            return False, None
+        for name, sign in (('balance', 1), ('credit', 1), ('debit', -1), ('amount', 1)):
+            value = parse_amount(fields.get(name))
+            if value is not None:
+                return True, sign * value
+        return True, None
+
+    for i, (_, cell) in enumerate(cells):
+        folded = fold(cell)
+        match = re.search(pattern, folded)
+        if match:
+            for text in [folded[match.end():]] + [other for _, other in cells[i + 1:]]:
+                value = parse_amount(text)
+                if value is not None:
+                    return True, value
+            return True, None
+    return False, None
+
+def to_iso(day, month, year):
+    if len(year) == 2:
+        year = '20' + year
+    return f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
+
+def statement_dates(folded_text):
+    """Statement period (start, end) and closing date as ISO strings when found"""
+    match = PERIOD_RE.search(folded_text)
+    if match:
+        start, end = (to_iso(*re.split(r"[./]", date)) for date in match.groups())
+        return (start, end), end
+    match = FULL_DATE_RE.search(folded_text)
+    if match:
+        return None, to_iso(*match.groups())
+    match = LONG_DATE_RE.search(folded_text)
+    if match:
+        day, month, year = match.groups()
+        return None, to_iso(day, MONTHS.index(month) + 1, year)
+    return None, None
+
+def resolve_date(text, reference):
+    """ISO date for a row date, taking a missing year from the statement date"""
+    match = DATE_RE.match(text.strip()) if text else None
+    if not match:
+        return None
+    day, month, year = match.groups()
+    if not (1 <= int(day) <= 31 and 1 <= int(month) <= 12):
+        return None
+    if year:
+        return to_iso(day, month, year)
+    if reference is None:
+        return f"{int(day):02d}/{month}"
+    ref_year, ref_month = int(reference[:4]), int(reference[5:7])
+    # A December operation on a January statement belongs to the previous year
+    return to_iso(day, month, str(ref_year - 1 if int(month) > ref_month else ref_year))
+
+def close_to(a, b):
+    return abs(a - b) < 0.005
+
+def score(transactions, opening, closing, totals, totals_include_opening=False):
+    """
+    Confidence in [0, 1]: complete rows (date and exactly one amount) plus
+    arithmetic checks that tie the rows together. Any failed check caps the
+    score below the reconciled range.
+    """
+    if not transactions:
+        return 0.0
+    complete = sum(1 for t in transactions
+                   if t['date'] and (t['debit'] > 0) != (t['credit'] > 0))
+    row_quality = complete / len(transactions)
+
+    debits = sum(t['debit'] for t in transactions)
+    credits = sum(t['credit'] for t in transactions)
+    checks = []
+    if opening is not None and closing is not None:
+        checks.append(close_to(opening - debits + credits, closing))
+    if any(total is not None for total in totals):
+        expected = [debits, credits]
+        if totals_include_opening and opening is not None:
+            expected[opening > 0] += abs(opening)
+        checks.append(all(close_to(total, value) for total, value in zip(totals, expected) if total is not None))
+    balances = [(t['balance'], t['debit'], t['credit']) for t in transactions if t.get('balance') is not None]
+    if len(balances) == len(transactions) > 1:
+        checks.append(all(close_to(previous[0] - debit + credit, balance)
+                          for previous, (balance, debit, credit) in zip(balances, balances[1:])))
+
+    reconciled = bool(checks) and all(checks)
+    return round(0.3 + 0.3 * row_quality + (0.4 if reconciled else 0.0), 2)
+
+def parse_statement(text, bank=None):
+    """
+    Parse one page of layout text with the matching bank template.
+    Returns the statement JSON (same schema as the Gemini prompt) with the
+    template id and confidence under processing_info, or None when no
+    template matches the page.
+    """
+    folded_text = fold(text)
+    bank_id = bank if get_template(bank)[0] else identify_bank(folded_text)
+    bank_id, template = get_template(bank_id)
+    if template is None:
+        return None
+
+    period, statement_date = statement_dates(folded_text)
+    account = re.search(template['account'], folded_text)
+    iban = IBAN_RE.search(folded_text)
+    bic = BIC_RE.search(folded_text)
+
+    transactions = []
+    opening = closing = None
+    totals = (None, None)
+    header = None
+    current = None
+
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        kind, cells = split_cells(line)
+        new_header = parse_header(kind, cells, template['columns'])
+        if new_header:
+            header, current = new_header, None
+            continue
+
+        fields = row_fields(header, kind, cells) if header else None
+        if opening is None:
+            matched, value = balance_amount(template['opening'], fields, cells)
+            if matched:
+                opening, current = value, None
+                continue
+        matched, value = balance_amount(template['closing'], fields, cells)
+        if matched:
+            closing, current = value, None
+            continue
+        if fields is None:
+            continue
+        if re.search(template['totals'], fold(fields.get('description', ''))):
+            totals = tuple(None if value is None else abs(value)
+                           for value in (parse_amount(fields.get('debit')), parse_amount(fields.get('credit'))))
+            current = None
+            continue
+
+        date = resolve_date(fields.get('date'), statement_date)
+        if date:
+            signed = parse_amount(fields.get('amount'))
+            debit = parse_amount(fields.get('debit'))
+            credit = parse_amount(fields.get('credit'))
+            if signed is not None:
+                debit, credit = (-signed, None) if signed < 0 else (None, signed)
+            current = {
+                'date': date,
+                'description': fields.get('description', ''),
+                'debit': abs(debit) if debit is not None else 0.0,
+                'credit': abs(credit) if credit is not None else 0.0,
+            }
+            if 'value_date' in fields:
+                current['value_date'] = resolve_date(fields['value_date'], statement_date)
+            if 'balance' in header['columns'].values():
+                current['balance'] = parse_amount(fields.get('balance'))
+            transactions.append(current)
+        elif current is not None and set(fields) == {'description'}:
+            # Wrapped label: a line with nothing but description text
+            current['description'] = f"{current['description']} {fields['description']}".strip()
+
+    confidence = score(transactions, opening, closing, totals, template['totals_include_opening'])
+    total_debits = round(sum(t['debit'] for t in transactions), 2)
+    total_credits = round(sum(t['credit'] for t in transactions), 2)
+    return {
+        'bank': template['name'],
+        'statement_date': statement_date,
+        'account_number': account.group(1).upper().strip() if account else None,
+        'statement_period': f"{period[0]} to {period[1]}" if period else None,
+        'contact_info': {},
+        'client_info': {},
+        'account_details': {
+            'iban': iban.group(1).upper() if iban else None,
+            'bic': bic.group(1).upper() if bic else None,
+            'opening_balance': opening,
+            'closing_balance': closing,
+            'currency': 'EUR',
+        },
+        'transactions': transactions,
+        'summary': {
+            'total_credits': total_credits,
+            'total_debits': total_debits,
+            'transaction_count': len(transactions),
+            'net_change': round(total_credits - total_debits, 2),
+        },
+        'processing_info': {
+            'parser': 'template',
+            'template': bank_id,
+            'confidence': confidence,
+        },
+    }
+
+def parse_with_template(text, bank=None, min_confidence=0.8):
+    """
+    Local alternative to parse_with_gemini: the template result when its
+    confidence reaches min_confidence, otherwise None so the caller falls
+    back to the LLM. Counts pages in TEMPLATE_STATS.
+    """
+    try:
+        result = parse_statement(text, bank)
+    except Exception as e:
+        print(f"Template parser error: {e}")
+        result = None
+    accepted = result is not None and result['processing_info']['confidence'] >= min_confidence
+    with _stats_lock:
+        TEMPLATE_STATS['pages'] += 1
+        TEMPLATE_STATS['parsed'] += int(accepted)
+    if result is not None and not accepted:
+        print(f"Template {result['processing_info']['template']} confidence "
+              f"{result['processing_info']['confidence']:.2f} too low, using Gemini")
+    return result if accepted else None
+
+def template_summary(stats=None):
+    """One-line summary of pages parsed locally vs sent to Gemini"""
+    stats = TEMPLATE_STATS if stats is None else stats
+    pages = stats['pages']
+    if not pages:
+        return "Template parser: no pages"
+    return (f"Template parser: {stats['parsed']}/{pages} pages parsed locally "
+            f"({stats['parsed']/pages*100:.1f}%), {pages - stats['parsed']} sent to Gemini")
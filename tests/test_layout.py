@@ -0,0 +1,20 @@
+import pytest
+import extract_ocr
+from extract_ocr import extract_text
+from benchmark_layout import legacy_extract_text, synthetic_page
+
+@pytest.fixture(autouse=True)
+def no_token_limit(monkeypatch):
+    # Token limiting is tested with the tokenizer; keep pages whole here
+    monkeypatch.setattr(extract_ocr, 'limit_tokens', lambda text, max_tokens: text)
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('add_spaces', [True, False])
+def test_extract_text_matches_legacy_output(seed, add_spaces):
+    """The NumPy line clustering and collation give the pre-rewrite text exactly"""
+    data = synthetic_page(60, 40, seed=seed)
+    assert extract_text(data, add_spaces) == legacy_extract_text(data, add_spaces)
+
+def test_extract_text_single_word():
+    data = [{'value': 'Solde', 'coordinates': [10, 10, 100, 30]}]
+    assert extract_text(data, True) == legacy_extract_text(data, True)
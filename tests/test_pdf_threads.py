@@ -0,0 +1,67 @@
+import threading
+import time
+import fitz
+import pytest
+import extract_ocr
+from extract_pdf import PDF_LOCK, extract_text_layer, extract_text_pdf, iter_pdf_pages, pdf_page_count, prefetch
+from job_runner import JobRunner
+
+@pytest.fixture(autouse=True)
+def no_token_limit(monkeypatch):
+    # Token limiting is tested with the tokenizer; keep pages whole here
+    monkeypatch.setattr(extract_ocr, 'limit_tokens', lambda text, max_tokens: text)
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Relevé de compte page {i + 1}", fontsize=12)
+        for row in range(30):
+            page.insert_text((72, 110 + 20 * row), f"{row + 1:02d}/03   CB ACHAT {i}-{row}   {row + 10},00",
+                             fontsize=10)
+    doc.save(path)
+    doc.close()
+    return str(path)
+
+def pdf_job(path):
+    """What a document job does with the PDF libraries: count, read the text layer, render"""
+    rendered = [(page_num, array.shape, int(array[::50, ::50].sum()))
+                for page_num, array in prefetch(iter_pdf_pages(path, dpi=72, grayscale=True))]
+    return pdf_page_count(path), extract_text_layer(path), rendered
+
+def test_concurrent_pdf_jobs(tmp_path):
+    """PDF jobs running side by side (each with its prefetch thread) match a serial run"""
+    paths = [make_pdf(tmp_path / 'a.pdf', 4), make_pdf(tmp_path / 'b.pdf', 6)]
+    expected = {path: pdf_job(path) for path in paths}
+
+    runner = JobRunner(max_workers=4)
+    try:
+        job_ids = {runner.submit(pdf_job, path): path for path in paths * 4}
+        deadline = time.time() + 60
+        while runner.active() and time.time() < deadline:
+            time.sleep(0.05)
+        for job_id, path in job_ids.items():
+            job = runner.get(job_id)
+            assert job.state == 'done', job.error
+            assert job.result == expected[path]
+    finally:
+        runner.shutdown()
+    assert expected[paths[1]][0] == 6
+    assert all(expected[paths[1]][1])
+
+@pytest.mark.parametrize('call', [
+    pdf_page_count,
+    extract_text_layer,
+    extract_text_pdf,
+    lambda path: next(iter_pdf_pages(path, dpi=72)),
+])
+def test_pdf_calls_wait_for_the_lock(tmp_path, call):
+    """Every entry point into PDFium or MuPDF waits while another thread uses them"""
+    path = make_pdf(tmp_path / 'a.pdf', 1)
+    done = threading.Event()
+    worker = threading.Thread(target=lambda: (call(path), done.set()))
+    with PDF_LOCK:
+        worker.start()
+        assert not done.wait(0.3)
+    worker.join(10)
+    assert done.is_set()
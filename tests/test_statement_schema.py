@@ -0,0 +1,19 @@
+import pytest
+from statement_schema import parse_number
+
+@pytest.mark.parametrize('value, expected', [
+    ('1,234.56', 1234.56),
+    ('1.234,56', 1234.56),
+    ('1 234,56 €', 1234.56),
+    ('-89.50', -89.5),
+    ('12,00', 12.0),
+    ('1.234.567', 1234567.0),
+    ('1,234,567.89', 1234567.89),
+    (42, 42.0),
+])
+def test_parse_number(value, expected):
+    assert parse_number(value) == pytest.approx(expected)
+
+@pytest.mark.parametrize('value', ['abc', '', None, True])
+def test_parse_number_unreadable(value):
+    assert parse_number(value) is None
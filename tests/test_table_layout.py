@@ -0,0 +1,43 @@
+import random
+import pytest
+import extract_ocr
+from extract_ocr import extract_table_text
+from benchmark_layout import COLUMNS, place, synthetic_statement
+
+@pytest.fixture(autouse=True)
+def no_token_limit(monkeypatch):
+    # Token limiting is tested with the tokenizer; keep pages whole here
+    monkeypatch.setattr(extract_ocr, 'limit_tokens', lambda text, max_tokens: text)
+
+def table(text, separator='\t'):
+    return [line.split(separator) for line in text.split("\n")]
+
+@pytest.mark.parametrize('seed', range(3))
+def test_amounts_stay_in_their_column(seed):
+    data, expected = synthetic_statement(40, seed=seed)
+    # Three address lines come before the table
+    assert table(extract_table_text(data))[3:] == expected
+
+def test_sparse_credit_column_is_kept():
+    """Two credits in thirty rows still get their own column, apart from the balance"""
+    rng = random.Random(0)
+    data = []
+    header = ['Date', 'Libellé', 'Débit', 'Crédit', 'Solde']
+    place(data, rng, 'Date', 200, COLUMNS['date'])
+    place(data, rng, 'Libellé', 200, COLUMNS['description'])
+    for name, column in zip(header[2:], ('debit', 'credit', 'balance')):
+        place(data, rng, name, 200, COLUMNS[column], right_aligned=True)
+    expected = [header]
+    for i in range(30):
+        top = 240 + 40 * i
+        column = 'credit' if i in (7, 21) else 'debit'
+        amount = f"{100 + i},00"
+        balance = f"{5000 - 10 * i},00"
+        place(data, rng, f"{i + 1:02d}/03", top, COLUMNS['date'])
+        place(data, rng, f"CB ACHAT {i}", top, COLUMNS['description'])
+        place(data, rng, amount, top, COLUMNS[column], right_aligned=True)
+        place(data, rng, balance, top, COLUMNS['balance'], right_aligned=True)
+        expected.append([f"{i + 1:02d}/03", f"CB ACHAT {i}", amount if column == 'debit' else '',
+                         amount if column == 'credit' else '', balance])
+
+    assert table(extract_table_text(data, separator=' | '), ' | ') == expected
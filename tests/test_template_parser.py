@@ -0,0 +1,32 @@
+from template_parser import HEADER_COLUMNS, get_template, parse_header, parse_statement, split_cells
+
+def header_columns(line, bank):
+    _, template = get_template(bank)
+    header = parse_header(*split_cells(line), template['columns'])
+    return header and sorted((position, name) for position, name in header['columns'].items() if name)
+
+def test_bank_columns_pick_the_value_date():
+    line = "DATE COMPTA | LIBELLE/REFERENCE | DATE OPERATION | DATE VALEUR | DEBIT EUROS | CREDIT EUROS"
+    assert header_columns(line, 'banquepopulaire') == [
+        (0, 'date'), (1, 'description'), (3, 'value_date'), (4, 'debit'), (5, 'credit')]
+    # The shared patterns take the operation date for the value date
+    assert parse_header(*split_cells(line), HEADER_COLUMNS)['columns'][2] == 'value_date'
+
+def test_bank_columns_find_an_unlabelled_description():
+    line = "Date | Compte courant EUR | Débit | Crédit | Valeur"
+    assert header_columns(line, 'creditdunord') == [
+        (0, 'date'), (1, 'description'), (2, 'debit'), (3, 'credit'), (4, 'value_date')]
+
+def test_parse_statement_with_bank_columns():
+    text = "\n".join([
+        "Crédit du Nord",
+        "Relevé de compte du 01.11.2019 au 30.11.2019",
+        "Date | Compte courant EUR | Débit | Crédit | Valeur",
+        " | Solde précédent |  | 872,21 | ",
+        "31.10 | LOCATION.MONETIA N° 7175996 | 46,20 |  | 31.10",
+        "4.11 | REMISE CB NO 93958 7175996001 |  | 97,75 | 4.11",
+    ])
+    statement = parse_statement(text)
+    assert statement['bank'] == 'Crédit du Nord'
+    assert [(t['description'], t['debit'], t['credit']) for t in statement['transactions']] == [
+        ('LOCATION.MONETIA N° 7175996', 46.2, 0.0), ('REMISE CB NO 93958 7175996001', 0.0, 97.75)]
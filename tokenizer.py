@@ -0,0 +1,48 @@
+import functools
+import tiktoken
+from instrumentation import instrumented
+
+DEFAULT_MODEL = "gpt-3.5-turbo-0613"
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model=DEFAULT_MODEL):
+    """Load the tiktoken encoding for a model once per process"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        print("Warning: model not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
+def num_tokens(text, model=DEFAULT_MODEL):
+    """Return the number of tokens in text."""
+    return len(get_encoding(model).encode(text))
+
+def estimate_tokens(text):
+    """
+    Cheap upper bound on the token count without encoding: every token
+    covers at least one UTF-8 byte.
+    """
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+@instrumented('limit_tokens', lambda result, text, *args, **kwargs: {
+    'chars_in': len(text), 'chars_out': len(result), 'truncated': len(result) < len(text)})
+def limit_tokens(text, max_tokens=16000, model=DEFAULT_MODEL):
+    """
+    Truncate text to at most max_tokens tokens. The cut is made on a token
+    boundary and moved back to the last complete line when there is one, so
+    transaction rows are never split.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+
+    truncated = encoding.decode(tokens[:max_tokens])
+    last_newline = truncated.rfind('\n')
+    if last_newline > 0:
+        return truncated[:last_newline]
+    # A single huge line: keep the exact token prefix, minus any split character
+    return truncated.rstrip('�')